@@ -0,0 +1,136 @@
+from sqladmin import Admin, ModelView
+
+from database import engine, User, Chat, Message, Test, TestResult, StudentReport, Parent, Teacher, Subject, ScheduleAndBooks, PsychologicalAssessment, StudentProgress, BookSection
+from search import admin_search_query
+
+# Admin paneli alohida modul: ADMIN_ENABLED=0 bo'lsa sqladmin umuman import qilinmaydi
+
+class UserAdmin(ModelView, model=User):
+    column_list = [User.id, User.first_name, User.last_name, User.email, User.role, User.grade, User.interests]
+    column_searchable_list = [User.first_name, User.last_name, User.email, User.interests]
+    column_filters = [User.role, User.grade]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+    def search_query(self, stmt, term):
+        return admin_search_query(stmt, User, term)
+
+class ParentAdmin(ModelView, model=Parent):
+    column_list = [Parent.id, Parent.user_id, Parent.student_id]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+class TeacherAdmin(ModelView, model=Teacher):
+    column_list = [Teacher.id, Teacher.user_id, Teacher.subjects]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+class SubjectAdmin(ModelView, model=Subject):
+    column_list = [Subject.id, Subject.name, Subject.grade, Subject.description]
+    column_searchable_list = [Subject.name]
+    column_filters = [Subject.grade]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+    def search_query(self, stmt, term):
+        return admin_search_query(stmt, Subject, term)
+
+class ScheduleAndBooksAdmin(ModelView, model=ScheduleAndBooks):
+    column_list = [ScheduleAndBooks.id, ScheduleAndBooks.subject_id, ScheduleAndBooks.grade, ScheduleAndBooks.title]
+    column_searchable_list = [ScheduleAndBooks.title, ScheduleAndBooks.content]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+    def search_query(self, stmt, term):
+        return admin_search_query(stmt, ScheduleAndBooks, term)
+
+class BookSectionAdmin(ModelView, model=BookSection):
+    column_list = [BookSection.id, BookSection.subject_id, BookSection.source, BookSection.position, BookSection.heading, BookSection.token_count]
+    column_filters = [BookSection.subject_id, BookSection.source]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+class TestAdmin(ModelView, model=Test):
+    column_list = [Test.id, Test.user_id, Test.type, Test.timestamp]
+    column_searchable_list = [Test.user_id, Test.type]
+    column_filters = [Test.type, Test.timestamp]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+class TestResultAdmin(ModelView, model=TestResult):
+    column_list = [TestResult.id, TestResult.user_id, TestResult.test_id, TestResult.created_at]
+    column_searchable_list = [TestResult.user_id, TestResult.test_id]
+    column_filters = [TestResult.created_at]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+class PsychologicalAssessmentAdmin(ModelView, model=PsychologicalAssessment):
+    column_list = [PsychologicalAssessment.id, PsychologicalAssessment.user_id, PsychologicalAssessment.timestamp]
+    column_searchable_list = [PsychologicalAssessment.user_id]
+    column_filters = [PsychologicalAssessment.timestamp]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+class StudentProgressAdmin(ModelView, model=StudentProgress):
+    column_list = [StudentProgress.id, StudentProgress.user_id, StudentProgress.subject_id, StudentProgress.progress, StudentProgress.last_updated]
+    column_searchable_list = [StudentProgress.user_id, StudentProgress.subject_id]
+    column_filters = [StudentProgress.last_updated]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+class ChatAdmin(ModelView, model=Chat):
+    column_list = [Chat.id, Chat.user_id, Chat.name, Chat.created_at, Chat.updated_at]
+    column_searchable_list = [Chat.user_id, Chat.name]
+    column_filters = [Chat.created_at, Chat.updated_at]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+class MessageAdmin(ModelView, model=Message):
+    column_list = [Message.id, Message.chat_id, Message.role, Message.timestamp]
+    column_searchable_list = [Message.chat_id, Message.content]
+    column_filters = [Message.role, Message.timestamp]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+    def search_query(self, stmt, term):
+        return admin_search_query(stmt, Message, term)
+
+class StudentReportAdmin(ModelView, model=StudentReport):
+    column_list = [StudentReport.id, StudentReport.user_id, StudentReport.subject, StudentReport.percentage, StudentReport.grade, StudentReport.created_at]
+    column_searchable_list = [StudentReport.user_id, StudentReport.subject]
+    column_filters = [StudentReport.grade, StudentReport.created_at]
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+# Admin panelni yaratish
+def create_admin(app):
+    admin = Admin(app, engine)
+
+    # Admin modellarini qo'shish
+    admin.add_view(UserAdmin)
+    admin.add_view(ParentAdmin)
+    admin.add_view(TeacherAdmin)
+    admin.add_view(SubjectAdmin)
+    admin.add_view(ScheduleAndBooksAdmin)
+    admin.add_view(BookSectionAdmin)
+    admin.add_view(TestAdmin)
+    admin.add_view(TestResultAdmin)
+    admin.add_view(PsychologicalAssessmentAdmin)
+    admin.add_view(StudentProgressAdmin)
+    admin.add_view(ChatAdmin)
+    admin.add_view(MessageAdmin)
+    admin.add_view(StudentReportAdmin)
+    return admin
@@ -0,0 +1,264 @@
+from datetime import datetime
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session, object_session
+
+from database import AnalyticsRollup, StudentProgress, StudentReport, Subject, User
+
+# Agregat turlari: o'quvchi progressi va AI hisobot foizlari
+METRIC_PROGRESS = "progress"
+METRIC_REPORT = "report"
+
+UPSERT_ROLLUP = text(
+    "INSERT INTO analytics_rollups (metric, grade, subject, count, total, score_total, updated_at) "
+    "VALUES (:metric, :grade, :subject, :count, :total, :score_total, :now) "
+    "ON CONFLICT (metric, grade, subject) DO UPDATE SET "
+    "count = count + excluded.count, total = total + excluded.total, "
+    "score_total = score_total + excluded.score_total, updated_at = excluded.updated_at"
+)
+
+class _FlushBatch:
+    # Bitta flush ichidagi agregat o'zgarishlari yig'iladi va after_flush'da bitta executemany bilan yoziladi.
+    # Sinf va fan nomlari ham flush davomida bir marta o'qiladi
+    def __init__(self, connection):
+        self.connection = connection
+        self.deltas = {}
+        self.lookups = {}
+
+def _batch(target, connection):
+    session = object_session(target)
+    batch = session.info.get("analytics_batch")
+    if batch is None:
+        batch = session.info["analytics_batch"] = _FlushBatch(connection)
+    return batch
+
+def _lookup(batch, sql, key):
+    if key not in batch.lookups:
+        batch.lookups[key] = batch.connection.execute(text(sql), {"id": key[1]}).scalar()
+    return batch.lookups[key]
+
+def _student_grade(batch, user_id):
+    grade = _lookup(batch, "SELECT grade FROM users WHERE id = :id", ("grade", user_id))
+    # Sinfi noma'lum o'quvchilar 0-sinf sifatida hisoblanadi, chunki NULL unikal cheklovga tushmaydi
+    return grade or 0
+
+def _subject_name(batch, subject_id):
+    name = _lookup(batch, "SELECT name FROM subjects WHERE id = :id", ("subject", subject_id))
+    return name or str(subject_id)
+
+def _apply(batch, metric, grade, subject, count, total, score_total=0):
+    if subject is None or total is None:
+        return
+    delta = batch.deltas.setdefault((metric, grade, subject), [0, 0.0, 0.0])
+    delta[0] += count
+    delta[1] += total
+    delta[2] += score_total or 0
+
+@event.listens_for(Session, "after_flush")
+def _write_rollups(session, flush_context):
+    batch = session.info.pop("analytics_batch", None)
+    if batch is None or not batch.deltas:
+        return
+    now = datetime.utcnow()
+    rows = [
+        {"metric": metric, "grade": grade, "subject": subject, "count": count,
+         "total": total, "score_total": score_total, "now": now}
+        for (metric, grade, subject), (count, total, score_total) in batch.deltas.items()
+        if count or total or score_total
+    ]
+    if rows:
+        batch.connection.execute(UPSERT_ROLLUP, rows)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rollups(session):
+    session.info.pop("analytics_batch", None)
+
+def _neg(value):
+    return None if value is None else -value
+
+def _old_value(state, attr):
+    history = state.attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, attr)
+
+# StudentProgress o'zgarishlari
+def _progress_key(batch, user_id, subject_id):
+    return _student_grade(batch, user_id), _subject_name(batch, subject_id)
+
+@event.listens_for(StudentProgress, "after_insert")
+def progress_inserted(mapper, connection, target):
+    batch = _batch(target, connection)
+    _apply(batch, METRIC_PROGRESS, *_progress_key(batch, target.user_id, target.subject_id), 1, target.progress)
+
+@event.listens_for(StudentProgress, "after_delete")
+def progress_deleted(mapper, connection, target):
+    batch = _batch(target, connection)
+    _apply(batch, METRIC_PROGRESS, *_progress_key(batch, target.user_id, target.subject_id), -1, _neg(target.progress))
+
+@event.listens_for(StudentProgress, "after_update")
+def progress_updated(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[attr].history.has_changes() for attr in ("user_id", "subject_id", "progress")):
+        return
+    batch = _batch(target, connection)
+    old_key = _progress_key(batch, _old_value(state, "user_id"), _old_value(state, "subject_id"))
+    _apply(batch, METRIC_PROGRESS, *old_key, -1, _neg(_old_value(state, "progress")))
+    _apply(batch, METRIC_PROGRESS, *_progress_key(batch, target.user_id, target.subject_id), 1, target.progress)
+
+# StudentReport o'zgarishlari: faqat o'quvchining oxirgi hisobot generatsiyasi hisobga olinadi
+def _is_current_report(connection, user_id, generation_id):
+    latest = connection.execute(
+        text("SELECT latest_report_generation_id FROM users WHERE id = :id"), {"id": user_id}
+    ).scalar()
+    if generation_id is None:
+        return latest is None
+    return generation_id == latest
+
+@event.listens_for(StudentReport, "after_insert")
+def report_inserted(mapper, connection, target):
+    if not _is_current_report(connection, target.user_id, target.generation_id):
+        return
+    batch = _batch(target, connection)
+    _apply(batch, METRIC_REPORT, _student_grade(batch, target.user_id), target.subject, 1, target.percentage, target.grade)
+
+@event.listens_for(StudentReport, "after_delete")
+def report_deleted(mapper, connection, target):
+    if not _is_current_report(connection, target.user_id, target.generation_id):
+        return
+    batch = _batch(target, connection)
+    _apply(batch, METRIC_REPORT, _student_grade(batch, target.user_id), target.subject, -1,
+           _neg(target.percentage), _neg(target.grade))
+
+@event.listens_for(StudentReport, "after_update")
+def report_updated(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[attr].history.has_changes() for attr in ("user_id", "subject", "percentage", "grade")):
+        return
+    if not _is_current_report(connection, target.user_id, target.generation_id):
+        return
+    batch = _batch(target, connection)
+    _apply(batch, METRIC_REPORT, _student_grade(batch, _old_value(state, "user_id")), _old_value(state, "subject"), -1,
+           _neg(_old_value(state, "percentage")), _neg(_old_value(state, "grade")))
+    _apply(batch, METRIC_REPORT, _student_grade(batch, target.user_id), target.subject, 1, target.percentage, target.grade)
+
+def _apply_generation(batch, user_id, generation_id, grade, sign):
+    if generation_id is None:
+        condition, params = "user_id = :user_id AND generation_id IS NULL", {"user_id": user_id}
+    else:
+        condition, params = "generation_id = :generation_id", {"generation_id": generation_id}
+    rows = batch.connection.execute(text(
+        "SELECT subject, COUNT(*) AS count, SUM(percentage) AS total, SUM(COALESCE(grade, 0)) AS score_total "
+        f"FROM student_reports WHERE {condition} AND subject IS NOT NULL AND percentage IS NOT NULL GROUP BY subject"
+    ), params).fetchall()
+    for row in rows:
+        _apply(batch, METRIC_REPORT, grade, row.subject, sign * row.count, sign * row.total, sign * row.score_total)
+
+def _apply_user_progress(batch, user_id, grade, sign):
+    rows = batch.connection.execute(text(
+        "SELECT COALESCE(s.name, CAST(p.subject_id AS TEXT)) AS subject, COUNT(*) AS count, SUM(p.progress) AS total "
+        "FROM student_progress p LEFT JOIN subjects s ON s.id = p.subject_id "
+        "WHERE p.user_id = :user_id AND p.progress IS NOT NULL GROUP BY COALESCE(s.name, CAST(p.subject_id AS TEXT))"
+    ), {"user_id": user_id}).fetchall()
+    for row in rows:
+        _apply(batch, METRIC_PROGRESS, grade, row.subject, sign * row.count, sign * row.total)
+
+# Eski qiymat muddati o'tgan (commit'dan keyingi) obyektda ham tarixda bo'lishi uchun o'zgartirishdan oldin yuklanadi
+for _attribute in (User.grade, User.latest_report_generation_id, Subject.name):
+    event.listen(_attribute, "set", lambda target, value, oldvalue, initiator: None, active_history=True)
+
+@event.listens_for(User, "after_update")
+def latest_report_changed(mapper, connection, target):
+    # Oxirgi generatsiya yoki o'quvchi sinfi (masalan, yil oxirida keyingi sinfga o'tkazish) o'zgarsa,
+    # eski generatsiya eski sinf agregatidan chiqariladi, joriysi yangi sinfga qo'shiladi; progress ham ko'chiriladi
+    state = inspect(target)
+    generation = state.attrs.latest_report_generation_id.history
+    grade = state.attrs.grade.history
+    if not generation.has_changes() and not grade.has_changes():
+        return
+    batch = _batch(target, connection)
+    old_grade, new_grade = _old_value(state, "grade") or 0, target.grade or 0
+    # Shu flush'dagi keyingi yozuvlar yangi sinf bilan hisoblanadi
+    batch.lookups[("grade", target.id)] = target.grade
+    if generation.has_changes():
+        old_generation = generation.deleted[0] if generation.deleted else None
+    else:
+        old_generation = target.latest_report_generation_id
+    _apply_generation(batch, target.id, old_generation, old_grade, -1)
+    _apply_generation(batch, target.id, target.latest_report_generation_id, new_grade, 1)
+    if old_grade != new_grade:
+        _apply_user_progress(batch, target.id, old_grade, -1)
+        _apply_user_progress(batch, target.id, new_grade, 1)
+
+@event.listens_for(Subject, "after_update")
+def subject_renamed(mapper, connection, target):
+    # Progress agregatlari fan nomi bilan saqlanadi: nom o'zgarsa yozuvlar yangi nomga ko'chiriladi.
+    # Hisobotlar esa yozilgan paytdagi fan matnini saqlaydi, ular o'zgarmaydi
+    state = inspect(target)
+    if not state.attrs.name.history.has_changes():
+        return
+    batch = _batch(target, connection)
+    old_name = _old_value(state, "name") or str(target.id)
+    new_name = target.name or str(target.id)
+    batch.lookups[("subject", target.id)] = target.name
+    rows = connection.execute(text(
+        "SELECT COALESCE(u.grade, 0) AS grade, COUNT(*) AS count, SUM(p.progress) AS total "
+        "FROM student_progress p JOIN users u ON u.id = p.user_id "
+        "WHERE p.subject_id = :subject_id AND p.progress IS NOT NULL GROUP BY COALESCE(u.grade, 0)"
+    ), {"subject_id": target.id}).fetchall()
+    for row in rows:
+        _apply(batch, METRIC_PROGRESS, row.grade, old_name, -row.count, -row.total)
+        _apply(batch, METRIC_PROGRESS, row.grade, new_name, row.count, row.total)
+
+def _rollup_entry(rollup):
+    return {
+        "metric": rollup.metric,
+        "grade": rollup.grade,
+        "subject": rollup.subject,
+        "count": rollup.count,
+        "average": rollup.total / rollup.count if rollup.count else None,
+        "average_score": rollup.score_total / rollup.count if rollup.count and rollup.metric == METRIC_REPORT else None,
+    }
+
+def get_grade_dashboard(db: Session, grade: int):
+    rollups = db.query(AnalyticsRollup).filter(AnalyticsRollup.grade == grade, AnalyticsRollup.count > 0).all()
+    return [_rollup_entry(rollup) for rollup in rollups]
+
+def get_school_dashboard(db: Session):
+    # Sinflar bo'yicha agregatlarni birlashtirish; qatorlar soni o'quvchilar soniga bog'liq emas
+    rows = db.execute(text(
+        "SELECT metric, grade, SUM(count) AS count, SUM(total) AS total, SUM(score_total) AS score_total "
+        "FROM analytics_rollups WHERE count > 0 GROUP BY metric, grade ORDER BY grade, metric"
+    )).fetchall()
+    return [
+        {
+            "metric": row.metric,
+            "grade": row.grade,
+            "subject": None,
+            "count": row.count,
+            "average": row.total / row.count,
+            "average_score": row.score_total / row.count if row.metric == METRIC_REPORT else None,
+        }
+        for row in rows
+    ]
+
+def rebuild_analytics(db: Session):
+    # Agregatlarni noldan qayta hisoblash ("python migrations.py analytics"): ORM'ni chetlab o'tgan
+    # o'zgarishlardan (to'g'ridan-to'g'ri SQL, bulk update) keyin yig'ilgan farqni tuzatadi
+    db.execute(text("DELETE FROM analytics_rollups"))
+    db.execute(text(
+        "INSERT INTO analytics_rollups (metric, grade, subject, count, total, score_total, updated_at) "
+        "SELECT :metric, COALESCE(u.grade, 0), COALESCE(s.name, CAST(p.subject_id AS TEXT)), COUNT(*), SUM(p.progress), 0, :now "
+        "FROM student_progress p JOIN users u ON u.id = p.user_id LEFT JOIN subjects s ON s.id = p.subject_id "
+        "WHERE p.progress IS NOT NULL "
+        "GROUP BY COALESCE(u.grade, 0), COALESCE(s.name, CAST(p.subject_id AS TEXT))"
+    ), {"metric": METRIC_PROGRESS, "now": datetime.utcnow()})
+    db.execute(text(
+        "INSERT INTO analytics_rollups (metric, grade, subject, count, total, score_total, updated_at) "
+        "SELECT :metric, COALESCE(u.grade, 0), r.subject, COUNT(*), SUM(r.percentage), SUM(COALESCE(r.grade, 0)), :now "
+        "FROM student_reports r JOIN users u ON u.id = r.user_id "
+        "WHERE r.subject IS NOT NULL AND r.percentage IS NOT NULL "
+        "AND (r.generation_id = u.latest_report_generation_id "
+        "OR (r.generation_id IS NULL AND u.latest_report_generation_id IS NULL)) "
+        "GROUP BY COALESCE(u.grade, 0), r.subject"
+    ), {"metric": METRIC_REPORT, "now": datetime.utcnow()})
+    db.commit()
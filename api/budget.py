@@ -0,0 +1,140 @@
+import os
+import logging
+
+from prompts import serialize_context
+from tokens import estimate_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Modelga yuboriladigan prompt chegarasi (javob uchun max_tokens va taxmin xatosi uchun zaxira qoldiriladi)
+PROMPT_MAX_TOKENS = int(os.environ.get("PROMPT_MAX_TOKENS", "150000"))
+# Bo'limlar bo'yicha chegaralar
+SECTION_BUDGETS = {
+    "instructions": int(os.environ.get("PROMPT_BUDGET_INSTRUCTIONS", "4000")),
+    "student": int(os.environ.get("PROMPT_BUDGET_STUDENT", "20000")),
+    "history": int(os.environ.get("PROMPT_BUDGET_HISTORY", "40000")),
+    "curriculum": int(os.environ.get("PROMPT_BUDGET_CURRICULUM", "80000")),
+}
+# Umumiy chegaradan oshsa bo'limlar shu tartibda (eng past ustuvorlikdan) qisqartiriladi.
+# Ko'rsatmalar va joriy so'rov hech qachon qisqartirilmaydi
+TRIM_ORDER = ("curriculum", "history", "student")
+MESSAGE_OVERHEAD_TOKENS = 4
+
+class PromptTooLarge(ValueError):
+    pass
+
+def _message_tokens(message):
+    content = message["content"]
+    if not isinstance(content, str):
+        content = serialize_context(content)
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+def allocate_shares(sizes, available):
+    # Byudjet teng ulushlarda taqsimlanadi: kichik talablar to'liq qondiriladi, ortgan ulush kattaroqlariga o'tadi.
+    # sizes: {kalit: kerakli tokenlar}; {kalit: ajratilgan tokenlar} qaytariladi
+    shares = {}
+    ordered = sorted((size, key) for key, size in sizes.items() if size)
+    for position, (size, key) in enumerate(ordered):
+        share = max(available, 0) // (len(ordered) - position)
+        shares[key] = min(size, share)
+        available -= shares[key]
+    return shares
+
+def curriculum_overhead(subjects):
+    # Darslik matnisiz fanlar ro'yxatining o'zi egallaydigan tokenlar
+    return estimate_tokens(serialize_context([{**subject, "book_text": ""} for subject in subjects]))
+
+def _trim_curriculum(subjects, target):
+    # Fanlar ro'yxati saqlanadi, darslik matnlari esa byudjetga teng ulushlarda kesiladi
+    subjects = [dict(subject) for subject in subjects]
+    texts = {index: subject.get("book_text") or "" for index, subject in enumerate(subjects)}
+    shares = allocate_shares({index: estimate_tokens(text) for index, text in texts.items()}, target - curriculum_overhead(subjects))
+    for index, subject in enumerate(subjects):
+        size, share = estimate_tokens(texts[index]), shares.get(index, 0)
+        subject["book_text"] = texts[index] if size <= share else truncate_tokens(texts[index], share)
+    return subjects
+
+def _trim_history(history, target):
+    # Eng eski xabarlar tashlanadi; qolgan suhbat foydalanuvchi xabari bilan boshlanishi kerak
+    history = list(history)
+    total = sum(_message_tokens(message) for message in history)
+    while history and (total > target or history[0]["role"] != "user"):
+        total -= _message_tokens(history.pop(0))
+    return history
+
+def _trim_student(student, target):
+    # Ro'yxatlarning eng eski elementlari (eng uzun ro'yxatdan boshlab) tashlanadi. Lug'at bir marta sanaladi,
+    # har bir element narxi (vergul bilan) alohida hisoblanib jamidan ayiriladi
+    student = {key: list(value) if isinstance(value, list) else value for key, value in student.items()}
+    total = estimate_tokens(serialize_context(student))
+    costs = {key: [estimate_tokens(serialize_context(item)) + 1 for item in value]
+             for key, value in student.items() if isinstance(value, list)}
+    while total > target:
+        lists = [key for key, value in costs.items() if value]
+        if not lists:
+            break
+        key = max(lists, key=lambda key: len(costs[key]))
+        student[key].pop(0)
+        total -= costs[key].pop(0)
+    return student
+
+class PromptBudget:
+    # Prompt bo'limlari (ko'rsatmalar, o'quv materiali, suhbat tarixi, o'quvchi ma'lumotlari) model
+    # chaqiruvidan oldin oflayn sanaladi va chegaralarga sig'diriladi
+    def __init__(self, route, max_tokens=PROMPT_MAX_TOKENS, budgets=SECTION_BUDGETS):
+        self.route = route
+        self.max_tokens = max_tokens
+        self.budgets = budgets
+
+    def fit(self, instructions, context, history=(), query=None):
+        # instructions — kontekstsiz tizim prompti; (context, history) qisqartirilgan holda qaytariladi
+        sections = {
+            "student": {key: value for key, value in context.items() if key != "subjects"},
+            "curriculum": context.get("subjects") or [],
+            "history": list(history),
+        }
+        trimmers = {"student": _trim_student, "curriculum": _trim_curriculum, "history": _trim_history}
+        tokens = {"instructions": estimate_tokens(instructions)}
+        for name, value in sections.items():
+            tokens[name] = self.measure(name, value)
+        query_tokens = _message_tokens({"content": query}) if query is not None else 0
+        original = dict(tokens)
+
+        if tokens["instructions"] > self.budgets["instructions"]:
+            logger.warning(f"{self.route}: ko'rsatmalar byudjetdan katta ({tokens['instructions']} > {self.budgets['instructions']})")
+
+        for name in TRIM_ORDER:
+            if tokens[name] > self.budgets[name]:
+                sections[name] = trimmers[name](sections[name], self.budgets[name])
+                tokens[name] = self.measure(name, sections[name])
+
+        for name in TRIM_ORDER:
+            excess = sum(tokens.values()) + query_tokens - self.max_tokens
+            if excess <= 0:
+                break
+            sections[name] = trimmers[name](sections[name], max(tokens[name] - excess, 0))
+            tokens[name] = self.measure(name, sections[name])
+
+        total = sum(tokens.values()) + query_tokens
+        self.log(tokens, original, query_tokens, total)
+        if total > self.max_tokens:
+            raise PromptTooLarge(f"Prompt chegaradan katta: taxminan {total} > {self.max_tokens} token")
+
+        fitted = dict(sections["student"])
+        if "subjects" in context:
+            fitted["subjects"] = sections["curriculum"]
+        return fitted, sections["history"]
+
+    def measure(self, name, value):
+        if name == "history":
+            return sum(_message_tokens(message) for message in value)
+        return estimate_tokens(serialize_context(value)) if value else 0
+
+    def log(self, tokens, original, query_tokens, total):
+        parts = []
+        for name, value in tokens.items():
+            part = f"{name}={value}/{self.budgets[name]}"
+            if value < original[name]:
+                part += f" (qisqartirildi: {original[name]})"
+            parts.append(part)
+        logger.info(f"Prompt byudjeti {self.route}: {', '.join(parts)}, so'rov={query_tokens}, jami={total}/{self.max_tokens}")
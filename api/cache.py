@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Ikki bosqichli kesh: jarayon ichidagi LRU va (CACHE_URL=redis://... bo'lsa) barcha ishchilar hamda
+# serverlar uchun umumiy Redis. Yozish va o'chirish pub/sub orqali boshqa jarayonlarning LRU'sidan ham o'chiriladi
+CACHE_URL = os.environ.get("CACHE_URL", "")
+CACHE_PREFIX = os.environ.get("CACHE_PREFIX", "iqroai:cache:")
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "1000"))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Umumiy bosqich bo'lsa, LRU yozuvi shundan uzoq yashamaydi: pub/sub xabari yo'qolsa ham eskirish chegaralangan
+CACHE_LOCAL_TTL = int(os.environ.get("CACHE_LOCAL_TTL", "30"))
+RECONNECT_DELAY = 1.0
+# Redis'dagi avlod hisoblagichlari shuncha yashaydi: bazadan o'qish va set() orasidagi vaqtdan ancha uzun
+CACHE_GENERATION_TTL = int(os.environ.get("CACHE_GENERATION_TTL", "3600"))
+# Umumiy bosqichsiz invalidatsiya faqat shu jarayonda ishlaydi: bir nechta ishchida kesh o'chiriladi,
+# aks holda boshqa ishchilar eskirgan kontekst va rollarni (avtorizatsiya) qaytarib turadi
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+
+class MemoryTier:
+    # Yozuvlar soni va taxminiy hajmi bo'yicha chegaralangan LRU. Qaytarilgan qiymatlar umumiy: o'zgartirilmasin
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, size, ttl):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (value, size, time.monotonic() + ttl)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def delete(self, keys=(), prefixes=()):
+        with self.lock:
+            for key in keys:
+                self._remove(key)
+            if prefixes:
+                for key in [key for key in self.entries if key.startswith(tuple(prefixes))]:
+                    self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+class Generations:
+    # Jarayon ichidagi avlod hisoblagichlari (kalit va nomlar fazosi bo'yicha), soni chegaralangan.
+    # Chiqarib yuborilgan hisoblagich o'rniga "floor" qaytariladi: avlod hech qachon orqaga qaytmaydi
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.values = OrderedDict()
+        self.counter = 0
+        self.floor = 0
+        # Tekshirish va LRU'ga yozish bitta qulf ostida bajariladi (Cache.set/delete)
+        self.lock = threading.RLock()
+
+    def get(self, names):
+        with self.lock:
+            return tuple(self.values.get(name, self.floor) for name in names)
+
+    def bump(self, names):
+        with self.lock:
+            for name in names:
+                self.counter += 1
+                self.values.pop(name, None)
+                self.values[name] = self.counter
+            while len(self.values) > self.max_entries:
+                self.floor = max(self.floor, self.values.popitem(last=False)[1])
+
+def _generation_names(key):
+    # Kalitning o'zi va u tegishli nomlar fazolari ("context:12" -> "context:", "context:12")
+    return [key[:index + 1] for index, char in enumerate(key) if char == ":"] + [key]
+
+class Cache:
+    # Eskirgan qiymatni qayta yozishdan himoya: o'qiyotgan kod bazadan o'qishdan oldin version(key) oladi va
+    # set(..., version=...) ga beradi. Oraliqda kalit (yoki uning nomlar fazosi) o'chirilgan bo'lsa, qiymat keshlanmaydi
+    def __init__(self, url=CACHE_URL, prefix=CACHE_PREFIX, local=None, local_ttl=CACHE_LOCAL_TTL, workers=WEB_CONCURRENCY):
+        if url and redis is None:
+            raise RuntimeError("CACHE_URL uchun redis paketi o'rnatilishi kerak")
+        self.url = url
+        self.enabled = bool(url) or workers <= 1
+        if not self.enabled:
+            logger.warning(f"CACHE_URL ko'rsatilmagan va {workers} ta ishchi ishlaydi: kesh o'chirildi")
+        self.prefix = prefix
+        self.channel = prefix + "invalidate"
+        self.local = local or MemoryTier()
+        self.local_ttl = local_ttl
+        self.generations = Generations()
+        # Jarayon o'z xabarlarini o'tkazib yuboradi
+        self.origin = uuid.uuid4().hex
+        self.client = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    @property
+    def shared(self):
+        # Ulanish va obunachi oqim fork'dan keyin har bir ishchida alohida ochiladi (gunicorn preload)
+        if not self.url:
+            return None
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.client = self.connect()
+                    self.local.clear()
+                    self.origin = uuid.uuid4().hex
+                    threading.Thread(target=self.listen, name="cache-invalidation", daemon=True).start()
+                    self.pid = os.getpid()
+        return self.client
+
+    def connect(self):
+        return redis.Redis.from_url(self.url)
+
+    def _generation_keys(self, key):
+        return [self.prefix + "gen:" + name for name in _generation_names(key)]
+
+    def version(self, key):
+        # (jarayon ichidagi avlodlar, Redis'dagi avlodlar). Kesh o'chirilgan yoki Redis xatosida None: qiymat keshlanmaydi
+        if not self.enabled:
+            return None
+        local = self.generations.get(_generation_names(key))
+        client = self.shared
+        if client is None:
+            return local, None
+        try:
+            return local, tuple(int(value or 0) for value in client.mget(self._generation_keys(key)))
+        except redis.RedisError as e:
+            logger.warning(f"Umumiy keshdan o'qishda xatolik: {str(e)}")
+            return None
+
+    def _store_local(self, key, value, size, ttl, version):
+        with self.generations.lock:
+            if version is not None and self.generations.get(_generation_names(key)) == version[0]:
+                self.local.set(key, value, size, ttl)
+
+    def get(self, key):
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry[0]
+        client = self.shared
+        if client is None:
+            return None
+        # Redis'dan o'qish paytida o'chirilgan qiymat LRU'ga yozilmasligi uchun avlodlar oldindan olinadi
+        version = self.generations.get(_generation_names(key)), None
+        try:
+            payload = client.get(self.prefix + key)
+            if payload is None:
+                return None
+            ttl = client.ttl(self.prefix + key)
+        except redis.RedisError as e:
+            logger.warning(f"Umumiy keshdan o'qishda xatolik: {str(e)}")
+            return None
+        value = json.loads(payload)
+        self._store_local(key, value, len(payload), min(self.local_ttl, ttl) if ttl and ttl > 0 else self.local_ttl, version)
+        return value
+
+    def set(self, key, value, ttl, version):
+        # version — bazadan o'qishdan oldin olingan version(key); None bo'lsa qiymat keshlanmaydi. Saqlangan nusxa qaytariladi. Qiymat JSON orqali saqlanadi; LRU'ga ham JSON'dan tiklangan nusxa yoziladi, shunda qaysi bosqichdan
+        # o'qilmasin natija bir xil bo'ladi (masalan son kalitlar satrga aylanadi)
+        payload = json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+        value = json.loads(payload)
+        client = self.shared
+        if client is None:
+            # WEB_CONCURRENCY ko'rsatilmay ishga tushirilgan bir nechta jarayonda ham eskirish local_ttl bilan chegaralanadi
+            self._store_local(key, value, len(payload), min(self.local_ttl, ttl), version)
+            return value
+        if version is None:
+            return value
+        try:
+            with client.pipeline() as pipeline:
+                names = self._generation_keys(key)
+                pipeline.watch(*names)
+                if tuple(int(current or 0) for current in pipeline.mget(names)) != version[1]:
+                    return value
+                pipeline.multi()
+                pipeline.set(self.prefix + key, payload, ex=ttl)
+                pipeline.execute()
+            self.publish(client, keys=[key])
+        except redis.WatchError:
+            # Kalit shu paytda o'chirildi: eskirgan qiymat yozilmaydi
+            return value
+        except redis.RedisError as e:
+            logger.warning(f"Umumiy keshga yozishda xatolik: {str(e)}")
+            return value
+        self._store_local(key, value, len(payload), min(self.local_ttl, ttl), version)
+        return value
+
+    def delete(self, *keys, prefixes=()):
+        # prefixes: nomlar fazolari (':' bilan tugaydi, masalan "context:") — shu prefiksli barcha kalitlar
+        self._drop_local(keys, prefixes)
+        client = self.shared
+        if client is None:
+            return
+        try:
+            pipeline = client.pipeline()
+            for name in [*keys, *prefixes]:
+                pipeline.incr(self.prefix + "gen:" + name)
+                pipeline.expire(self.prefix + "gen:" + name, CACHE_GENERATION_TTL)
+            pipeline.execute()
+            names = [self.prefix + key for key in keys]
+            for prefix in prefixes:
+                names.extend(client.scan_iter(match=self.prefix + prefix + "*", count=500))
+            if names:
+                client.delete(*names)
+            self.publish(client, keys=list(keys), prefixes=list(prefixes))
+        except redis.RedisError as e:
+            logger.warning(f"Umumiy keshdan o'chirishda xatolik: {str(e)}")
+
+    def _drop_local(self, keys, prefixes):
+        with self.generations.lock:
+            self.generations.bump([*keys, *prefixes])
+            self.local.delete(keys, prefixes)
+
+    def publish(self, client, keys=(), prefixes=()):
+        client.publish(self.channel, json.dumps({"origin": self.origin, "keys": keys, "prefixes": prefixes}))
+
+    def listen(self):
+        while True:
+            client = self.connect()
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                # Uzilish paytida xabarlar yo'qolgan bo'lishi mumkin
+                self.local.clear()
+                for message in pubsub.listen():
+                    data = json.loads(message["data"])
+                    if data["origin"] != self.origin:
+                        self._drop_local(data["keys"], data["prefixes"])
+            except Exception as e:
+                logger.warning(f"Kesh invalidatsiya kanali uzildi: {str(e)}")
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                # Qayta ulanishda eski ulanishlar yopiladi
+                pubsub.close()
+                client.close()
+
+cache = Cache()
+
+def invalidate_on_commit(session: Session, *keys, prefixes=()):
+    # Flush paytida yig'iladi va faqat commit'dan keyin o'chiriladi. O'chirishdan oldin o'qib bo'lingan eski qiymatni
+    # qayta yozishga avlod tekshiruvi to'sqinlik qiladi: o'quvchilar set() ga version(key) ni berishi kerak
+    pending = session.info.setdefault("cache_invalidations", (set(), set()))
+    pending[0].update(keys)
+    pending[1].update(prefixes)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    pending = session.info.pop("cache_invalidations", None)
+    if pending:
+        cache.delete(*pending[0], prefixes=tuple(pending[1]))
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session):
+    session.info.pop("cache_invalidations", None)
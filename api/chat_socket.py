@@ -0,0 +1,219 @@
+import os
+import time
+import asyncio
+import logging
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from jose import jwt, JWTError
+
+from database import SessionLocal, Chat
+from budget import PromptBudget, PromptTooLarge
+from prompts import get_system_prompt, get_system_blocks, serialize_context
+from metrics import observe_llm_call, LLM_ERRORS
+from utils import SECRET_KEY, ALGORITHM, get_principal, get_chat_history, create_new_chat, save_chat_turn, find_chat_turn
+from warmup import student_context
+
+logger = logging.getLogger(__name__)
+
+# Ulanish ochilgandan keyin autentifikatsiya xabarini kutish vaqti va bir ulanishdagi parallel javoblar soni
+WS_AUTH_TIMEOUT = float(os.environ.get("WS_AUTH_TIMEOUT", "10"))
+WS_MAX_TURNS = int(os.environ.get("WS_MAX_TURNS", "4"))
+
+# Ilova protokoli xatosi: noto'g'ri yoki muddati o'tgan token
+CLOSE_UNAUTHORIZED = 4401
+
+async def run_db(func, *args):
+    # Ulanish uzoq yashaydi: bazaga har bir murojaat o'z qisqa sessiyasida va oqimlar havzasida bajariladi,
+    # shunda boshqa ulanishlar va HTTP so'rovlar hodisalar siklida kutib qolmaydi
+    def call():
+        db = SessionLocal()
+        try:
+            return func(db, *args)
+        finally:
+            db.close()
+    return await run_in_threadpool(call)
+
+async def authenticate(websocket: WebSocket):
+    # Birinchi xabar {"type": "auth", "token": ...}; token URL'ga qo'yilmaydi, shuning uchun jurnallarga tushmaydi.
+    # Foydalanuvchi identifikatori qaytariladi
+    try:
+        message = await asyncio.wait_for(websocket.receive_json(), WS_AUTH_TIMEOUT)
+        if not isinstance(message, dict) or message.get("type") != "auth" or not message.get("token"):
+            return None
+        email = jwt.decode(message["token"], SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except (asyncio.TimeoutError, JWTError, ValueError, KeyError):
+        return None
+    if email is None:
+        return None
+    principal = await run_db(get_principal, email)
+    return principal["id"] if principal is not None else None
+
+def _open_chat(db, user_id, chat_id):
+    if db.query(Chat.id).filter(Chat.id == chat_id, Chat.user_id == user_id).first() is None:
+        return None
+    return get_chat_history(chat_id, db)
+
+def _new_chat(db, user_id):
+    chat = create_new_chat(user_id, db)
+    return chat.id, chat.name
+
+class ChatConnection:
+    # Bitta WebSocket ulanishi: foydalanuvchi bir marta aniqlanadi, ochilgan chatlarning tarixi xotirada saqlanadi.
+    # Har bir javob alohida vazifa sifatida oqimlanadi va {"type": "cancel"} bilan to'xtatilishi mumkin
+    def __init__(self, websocket: WebSocket, user_id: int, client):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.client = client
+        # chat id -> xabarlar tarixi
+        self.histories = {}
+        # turn id -> (vazifa, chat id)
+        self.turns = {}
+        self.send_lock = asyncio.Lock()
+        self.next_turn = 0
+
+    async def send(self, **message):
+        async with self.send_lock:
+            await self.websocket.send_json(message)
+
+    async def run(self):
+        await self.send(type="ready", user_id=self.user_id)
+        try:
+            while True:
+                try:
+                    message = await self.websocket.receive_json()
+                except (ValueError, KeyError):
+                    # JSON bo'lmagan yoki binar kadr ulanishni uzmaydi
+                    await self.send(type="error", detail="Xabar JSON matni bo'lishi kerak")
+                    continue
+                await self.handle(message if isinstance(message, dict) else {})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            # Foydalanuvchi ketgan bo'lsa, generatsiyalar to'xtatiladi: tokenlar behuda sarflanmaydi
+            for task, _ in list(self.turns.values()):
+                task.cancel()
+            if self.turns:
+                await asyncio.gather(*(task for task, _ in self.turns.values()), return_exceptions=True)
+
+    async def handle(self, message):
+        kind = message.get("type")
+        turn_id = message.get("id")
+        if kind == "message":
+            await self.start_turn(turn_id, message.get("chat_id"), message.get("query"))
+        elif kind == "cancel":
+            turn = self.turns.get(turn_id)
+            if turn is None:
+                await self.send(type="error", id=turn_id, detail="Faol javob topilmadi")
+            else:
+                turn[0].cancel()
+        elif kind == "ping":
+            await self.send(type="pong")
+        else:
+            await self.send(type="error", id=turn_id, detail=f"Noma'lum xabar turi: {kind}")
+
+    async def open_chat(self, chat_id):
+        if chat_id not in self.histories:
+            history = await run_db(_open_chat, self.user_id, chat_id)
+            if history is None:
+                return False
+            self.histories[chat_id] = history
+        return True
+
+    async def start_turn(self, turn_id, chat_id, query):
+        if turn_id is None:
+            self.next_turn += 1
+            turn_id = f"t{self.next_turn}"
+        if not isinstance(query, str) or not query.strip():
+            return await self.send(type="error", id=turn_id, detail="So'rov matni bo'sh")
+        if turn_id in self.turns:
+            return await self.send(type="error", id=turn_id, detail="Bu identifikatorli javob allaqachon ishlayapti")
+        if len(self.turns) >= WS_MAX_TURNS:
+            return await self.send(type="error", id=turn_id, detail=f"Bir vaqtda ko'pi bilan {WS_MAX_TURNS} ta javob")
+
+        if chat_id is None:
+            chat_id, name = await run_db(_new_chat, self.user_id)
+            self.histories[chat_id] = []
+            # Yangi chat identifikatori darhol yuboriladi: mijoz /chats ro'yxatini qayta so'ramaydi
+            await self.send(type="chat", id=turn_id, chat_id=chat_id, name=name)
+        elif not await self.open_chat(chat_id):
+            return await self.send(type="error", id=turn_id, detail="Chat topilmadi")
+        if any(active_chat == chat_id for _, active_chat in self.turns.values()):
+            # Bir chatda javoblar navbat bilan: aks holda tarix aralashib ketadi
+            return await self.send(type="error", id=turn_id, detail="Bu chatda javob hali tugamagan")
+
+        task = asyncio.create_task(self.turn(turn_id, chat_id, query))
+        self.turns[turn_id] = (task, chat_id)
+        task.add_done_callback(lambda _: self.turns.pop(turn_id, None))
+
+    async def turn(self, turn_id, chat_id, query):
+        history = self.histories[chat_id]
+        response_text = ""
+        started = None
+        first_token_at = None
+        llm_finished = False
+        try:
+            saved = await run_db(find_chat_turn, chat_id, turn_id)
+            if saved is not None:
+                # Shu turn id bilan javob saqlangan (mijoz so'rovni qayta yubordi): model qayta chaqirilmaydi
+                await self.send(type="delta", id=turn_id, text=saved[1])
+                return await self.send(type="done", id=turn_id, chat_id=chat_id, message_id=saved[0])
+
+            context = await run_db(student_context, self.user_id)
+            try:
+                context, trimmed = PromptBudget("ws_chat").fit(get_system_prompt(""), context, history, query)
+            except PromptTooLarge as e:
+                return await self.send(type="error", id=turn_id, detail=str(e))
+
+            started = time.perf_counter()
+            async with self.client.messages.stream(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=2000,
+                temperature=0.7,
+                system=get_system_blocks(serialize_context(context)),
+                messages=trimmed + [{"role": "user", "content": query}]
+            ) as stream:
+                async for text in stream.text_stream:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    response_text += text
+                    await self.send(type="delta", id=turn_id, text=text)
+                usage = (await stream.get_final_message()).usage
+            llm_finished = True
+            observe_llm_call("ws_chat", started, first_token_at, time.perf_counter(), usage)
+
+            # Oqimlar havzasidagi saqlashni to'xtatib bo'lmaydi: shu yerdan keyin kelgan cancel kutadi,
+            # javob esa saqlanadi, tarixga qo'shiladi va "done" bilan tasdiqlanadi
+            save = asyncio.ensure_future(run_db(lambda db: save_chat_turn(self.user_id, chat_id, query, response_text, db, turn_id)))
+            while True:
+                try:
+                    message_id = await asyncio.shield(save)
+                    break
+                except asyncio.CancelledError:
+                    if save.cancelled():
+                        raise
+            history.extend([{"role": "user", "content": query}, {"role": "assistant", "content": response_text}])
+            await self.send(type="done", id=turn_id, chat_id=chat_id, message_id=message_id)
+        except asyncio.CancelledError:
+            # Oqim yopiladi va model generatsiyani to'xtatadi; yarim javob saqlanmaydi
+            if started is not None:
+                observe_llm_call("ws_chat", started, first_token_at, time.perf_counter(), None)
+            try:
+                await self.send(type="cancelled", id=turn_id)
+            except Exception:
+                pass
+        except Exception as e:
+            if started is not None and not llm_finished:
+                LLM_ERRORS.labels("ws_chat").inc()
+            logger.error(f"AI javob generatsiyasida xatolik: {str(e)}")
+            await self.send(type="error", id=turn_id, detail="So'rovingizni qayta ishlashda xatolik yuz berdi.")
+
+async def serve_chat(websocket: WebSocket, client):
+    await websocket.accept()
+    try:
+        user_id = await authenticate(websocket)
+    except WebSocketDisconnect:
+        return
+    if user_id is None:
+        await websocket.close(code=CLOSE_UNAUTHORIZED)
+        return
+    await ChatConnection(websocket, user_id, client).run()
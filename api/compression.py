@@ -0,0 +1,109 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Siqish uchun minimal javob hajmi (bayt) va siqiladigan kontent turlari
+MINIMUM_SIZE = 1024
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+def choose_encoding(accept_encoding: str):
+    # Accept-Encoding sarlavhasidagi q-qiymatlarni hisobga olgan holda kodlashni tanlash
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    accepted = [name for name in candidates if weights.get(name, weights.get("*", 0)) > 0]
+    if not accepted:
+        return None
+    return max(accepted, key=lambda name: weights.get(name, weights.get("*", 0)))
+
+def compress(body: bytes, encoding: str, gzip_level=6, brotli_quality=4):
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level)
+
+def _header(headers, name):
+    return next((value.decode("latin-1") for key, value in headers if key.lower() == name), "")
+
+def _add_vary(headers):
+    if not _header(headers, b"vary"):
+        return headers + [(b"vary", b"Accept-Encoding")]
+    if "accept-encoding" in _header(headers, b"vary").lower():
+        return headers
+    return [(name, value + b", Accept-Encoding" if name.lower() == b"vary" else value) for name, value in headers]
+
+def _weaken_etag(headers):
+    # Siqilgan ko'rinish baytma-bayt boshqa: kuchli ETag kuchsizga aylantiriladi (If-None-Match kuchsiz solishtiriladi)
+    return [(name, b"W/" + value if name.lower() == b"etag" and not value.startswith(b"W/") else value) for name, value in headers]
+
+class CompressionMiddleware:
+    # Faqat bitta bo'lakdan iborat (oqimsiz) javoblar siqiladi. Oqimli javoblar (masalan /ai_assistant)
+    # o'zgartirilmasdan uzatiladi, shuning uchun tokenlar kechikmasdan yetib boradi.
+    # Siqiladigan turdagi har bir javob (siqilmaganlari ham) "Vary: Accept-Encoding" bilan yuboriladi,
+    # aks holda umumiy kesh gzip mijozga siqilmagan javobni (yoki aksincha) berishi mumkin
+    def __init__(self, app, minimum_size=MINIMUM_SIZE, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = dict(scope["headers"])
+        encoding = choose_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                compressible = (_header(headers, b"content-type").startswith(COMPRESSIBLE_TYPES)
+                                and not _header(headers, b"content-encoding"))
+                if compressible or message["status"] == 304:
+                    headers = _add_vary(headers)
+                if message["status"] == 304 and encoding is not None:
+                    # Mijoz keshidagi ko'rinish siqilgan bo'lishi mumkin: 304 ham kuchsiz ETag bilan
+                    headers = _weaken_etag(headers)
+                start_message = {**message, "headers": headers}
+                if encoding is None or not compressible:
+                    passthrough = True
+                    await send(start_message)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding, self.gzip_level, self.brotli_quality)
+            headers = [(name, value) for name, value in start_message["headers"] if name.lower() != b"content-length"]
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+            headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+            passthrough = True
+            await send({**start_message, "headers": _weaken_etag(headers)})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
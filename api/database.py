@@ -1,13 +1,73 @@
-from sqlalchemy import create_engine, Column, Integer, String, Date, ForeignKey, DateTime, Text, Float, JSON
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+import zlib
+from sqlalchemy import create_engine, event, Column, Integer, String, Date, ForeignKey, DateTime, Text, Float, JSON, LargeBinary, UniqueConstraint, Index
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker, deferred
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Ma'lumotlar bazasi sozlamalari
 SQLALCHEMY_DATABASE_URL = "sqlite:///./iqroai.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Siqilgan matn formati: birinchi bayt versiya, qolgani ma'lumot
+COMPRESSION_RAW = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+COMPRESSION_MIN_SIZE = 256
+
+def compress_text(value):
+    data = value.encode("utf-8")
+    if len(data) < COMPRESSION_MIN_SIZE:
+        return bytes([COMPRESSION_RAW]) + data
+    if zstandard is not None:
+        return bytes([COMPRESSION_ZSTD]) + zstandard.ZstdCompressor(level=9).compress(data)
+    return bytes([COMPRESSION_ZLIB]) + zlib.compress(data, 6)
+
+def decompress_text(value):
+    # Migratsiya qilinmagan eski qatorlar oddiy matn ko'rinishida qoladi
+    if isinstance(value, str):
+        return value
+    version, data = value[0], bytes(value[1:])
+    if version == COMPRESSION_RAW:
+        return data.decode("utf-8")
+    if version == COMPRESSION_ZLIB:
+        return zlib.decompress(data).decode("utf-8")
+    if version == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstd bilan siqilgan ma'lumotni o'qish uchun zstandard paketi kerak")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    raise ValueError(f"Noma'lum siqish versiyasi: {version}")
+
+# SQL ichida (FTS triggerlari va ko'rinishlari) siqilgan ustunlarni o'qish uchun decompress_text() funksiyasi.
+# U faqat shu funksiya ro'yxatdan o'tkazilgan ulanishlarda mavjud: bazaga ilovadan tashqarida (skript,
+# cron) sqlite3 moduli bilan yozadigan kod ulanishni ochgach register_sql_functions(connection) ni chaqirishi kerak
+def register_sql_functions(dbapi_connection):
+    dbapi_connection.create_function("decompress_text", 1, lambda value: None if value is None else decompress_text(value), deterministic=True)
+
+@event.listens_for(engine, "connect")
+def _register_sql_functions(dbapi_connection, connection_record):
+    register_sql_functions(dbapi_connection)
+
+class CompressedText(TypeDecorator):
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decompress_text(value)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -23,6 +83,7 @@ class User(Base):
     consent = Column(String)
     interests = Column(String)
     admin_id = Column(String(6), unique=True)
+    latest_report_generation_id = Column(Integer, ForeignKey("report_generations.id", use_alter=True))
 
     parents = relationship("Parent", back_populates="student", foreign_keys="Parent.student_id")
     teachers = relationship("Teacher", back_populates="user")
@@ -32,6 +93,7 @@ class User(Base):
     chats = relationship("Chat", back_populates="user")
     test_results = relationship("TestResult", back_populates="user")
     reports = relationship("StudentReport", back_populates="user")
+    report_generations = relationship("ReportGeneration", back_populates="user", foreign_keys="ReportGeneration.user_id")
 
 class Parent(Base):
     __tablename__ = "parents"
@@ -59,11 +121,13 @@ class Subject(Base):
     name = Column(String)
     grade = Column(Integer)
     description = Column(Text)
-    book_text = Column(Text)
+    book_text = deferred(Column(CompressedText))
     video_link = Column(String)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     schedule_and_books = relationship("ScheduleAndBooks", back_populates="subject")
     progress = relationship("StudentProgress", back_populates="subject")
+    sections = relationship("BookSection", back_populates="subject", order_by="BookSection.position")
 
 class ScheduleAndBooks(Base):
     __tablename__ = "schedule_and_books"
@@ -72,20 +136,36 @@ class ScheduleAndBooks(Base):
     subject_id = Column(Integer, ForeignKey("subjects.id"))
     grade = Column(Integer)
     title = Column(String)
-    content = Column(Text)
+    content = deferred(Column(CompressedText))
     online_lesson_link = Column(String)
 
     subject = relationship("Subject", back_populates="schedule_and_books")
 
+class BookSection(Base):
+    __tablename__ = "book_sections"
+
+    id = Column(Integer, primary_key=True, index=True)
+    subject_id = Column(Integer, ForeignKey("subjects.id"), index=True)
+    source = Column(String)
+    position = Column(Integer)
+    heading = Column(String)
+    content = deferred(Column(CompressedText))
+    token_count = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    subject = relationship("Subject", back_populates="sections")
+
 class Test(Base):
     __tablename__ = "tests"
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     type = Column(String)
-    questions = Column(Text)
+    questions = deferred(Column(CompressedText))
     answers = Column(Text)
     results = Column(Text)
+    # Tuzilgan test: {"questions": [{"id", "text", "options", "answer", "subject", "points"}]}; bo'lsa natijalar mahalliy baholanadi
+    spec = Column(JSON)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="tests")
@@ -117,6 +197,8 @@ class PsychologicalAssessment(Base):
 
 class StudentProgress(Base):
     __tablename__ = "student_progress"
+    # Har bir o'quvchi va fan uchun bitta yozuv: ommaviy yuborish shu kalit bo'yicha upsert qiladi
+    __table_args__ = (Index("ix_student_progress_user_subject", "user_id", "subject_id", unique=True),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -131,7 +213,7 @@ class Chat(Base):
     __tablename__ = "chats"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     name = Column(String, default="Yangi chat")
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -143,21 +225,51 @@ class Message(Base):
     __tablename__ = "messages"
 
     id = Column(Integer, primary_key=True, index=True)
-    chat_id = Column(Integer, ForeignKey("chats.id"))
+    chat_id = Column(Integer, ForeignKey("chats.id"), index=True)
     role = Column(String)
-    content = Column(Text)
+    content = deferred(Column(CompressedText))
     timestamp = Column(DateTime, default=datetime.utcnow)
+    # Mijoz bergan javob identifikatori (WebSocket turn id yoki Idempotency-Key): qayta yuborilgan so'rov ikkinchi marta saqlanmaydi
+    turn_id = Column(String, nullable=True)
 
     chat = relationship("Chat", back_populates="messages")
 
+    __table_args__ = (Index("ix_messages_chat_turn", "chat_id", "role", "turn_id", unique=True),)
+
+class ReportGeneration(Base):
+    __tablename__ = "report_generations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    analysis = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    user = relationship("User", back_populates="report_generations", foreign_keys=[user_id])
+    reports = relationship("StudentReport", back_populates="generation")
+
 class StudentReport(Base):
     __tablename__ = "student_reports"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    generation_id = Column(Integer, ForeignKey("report_generations.id"), index=True)
     subject = Column(String)
     percentage = Column(Float)
     grade = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="reports")
+    generation = relationship("ReportGeneration", back_populates="reports")
+
+class AnalyticsRollup(Base):
+    __tablename__ = "analytics_rollups"
+    __table_args__ = (UniqueConstraint("metric", "grade", "subject"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    metric = Column(String)
+    grade = Column(Integer)
+    subject = Column(String)
+    count = Column(Integer, default=0)
+    total = Column(Float, default=0)
+    score_total = Column(Float, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
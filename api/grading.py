@@ -0,0 +1,219 @@
+import re
+import unicodedata
+from collections import defaultdict
+import numpy as np
+from sqlalchemy.orm import Session
+
+from database import Test, TestResult
+
+# 5 ballik baholash shkalasi: (minimal foiz, ball)
+GRADE_THRESHOLDS = ((86, 5), (71, 4), (56, 3))
+OPTION_LETTERS = "ABCDEFGHIJ"
+
+# Javob kodlari: variantli savollarda variant tartib raqami, ochiq savollarda 0 — to'g'ri, WRONG — noto'g'ri
+MISSING = -1
+WRONG = -2
+
+NUMBERED_ANSWER = re.compile(r"(\d{1,3})\s*[-.):=]?\s*([A-Ja-j])(?![A-Za-z'])")
+LETTER_SEQUENCE = re.compile(r"^[A-Ja-j](?:[\s,;]*[A-Ja-j])*$")
+
+def score_to_grade(percentage):
+    for minimum, grade in GRADE_THRESHOLDS:
+        if percentage >= minimum:
+            return grade
+    return 2
+
+def _normalize(text):
+    text = " ".join(unicodedata.normalize("NFC", str(text)).casefold().split())
+    # 3,5 va 3.5 bir xil javob hisoblanadi
+    return re.sub(r"(?<=\d),(?=\d)", ".", text).strip(" .")
+
+class Grader:
+    # Test kaliti bir marta massivlarga aylantiriladi; javoblar (o'quvchilar × savollar) matritsasi
+    # sifatida bitta amal bilan tekshiriladi va fanlar bo'yicha ballar matritsa ko'paytmasi bilan yig'iladi
+    def __init__(self, spec):
+        questions = (spec or {}).get("questions") or []
+        if not questions:
+            raise ValueError("Testda kamida bitta savol bo'lishi kerak")
+
+        self.ids, self.options, keys, points, subject_index = [], [], [], [], []
+        self.subjects = []
+        for number, question in enumerate(questions, start=1):
+            question_id = str(question.get("id") or number)
+            if question_id in self.ids:
+                raise ValueError(f"Savol identifikatori takrorlangan: {question_id}")
+            subject = (question.get("subject") or "").strip()
+            if not subject:
+                raise ValueError(f"{question_id}-savol uchun fan ko'rsatilmagan")
+            question_points = float(question.get("points", 1))
+            if question_points <= 0:
+                raise ValueError(f"{question_id}-savol bali musbat bo'lishi kerak")
+            options = [_normalize(option) for option in question.get("options") or []]
+            if len(options) > len(OPTION_LETTERS):
+                raise ValueError(f"{question_id}-savolda variantlar juda ko'p")
+            answer = question.get("answer")
+            answer_index = question.get("answer_index")
+            if answer_index is not None:
+                if not options:
+                    raise ValueError(f"{question_id}-savolda answer_index faqat variantlar bilan ishlatiladi")
+                if not 0 <= int(answer_index) < len(options):
+                    raise ValueError(f"{question_id}-savol answer_index variantlar sonidan tashqarida: {answer_index}")
+            elif answer is None or not str(answer).strip():
+                raise ValueError(f"{question_id}-savol uchun to'g'ri javob ko'rsatilmagan")
+
+            self.ids.append(question_id)
+            self.options.append(options)
+            if answer_index is not None:
+                keys.append(int(answer_index))
+            elif options:
+                key = self._option_code(options, answer, key=True)
+                if key < 0:
+                    raise ValueError(f"{question_id}-savol javobi variantlar orasida yo'q: {answer}")
+                keys.append(key)
+            else:
+                # Ochiq savol: kalit matni saqlanadi, kod esa doim 0
+                options.append(_normalize(answer))
+                keys.append(0)
+            if subject not in self.subjects:
+                self.subjects.append(subject)
+            subject_index.append(self.subjects.index(subject))
+            points.append(question_points)
+
+        self.open = [not question.get("options") for question in questions]
+        self.keys = np.array(keys, dtype=np.int16)
+        self.points = np.array(points, dtype=np.float64)
+        # (savollar × fanlar) bir-issiq matritsasi savol ballari bilan
+        self.weights = np.zeros((len(questions), len(self.subjects)))
+        self.weights[np.arange(len(questions)), subject_index] = self.points
+        self.possible = self.weights.sum(axis=0)
+
+    @staticmethod
+    def _option_code(options, answer, key=False):
+        # Kalit (key=True) avval variant matni bilan solishtiriladi: "4" kaliti ["2", "4", ...] da ikkinchi variant,
+        # to'rtinchi emas. O'quvchi javobida esa bitta harf ko'rsatilgan "A)" belgisini bildiradi.
+        # Tartib raqami faqat hech bir variant matniga mos kelmaganda ishlatiladi
+        answer = _normalize(answer)
+        if key and answer in options:
+            return options.index(answer)
+        if len(answer) == 1 and answer.upper() in OPTION_LETTERS:
+            index = OPTION_LETTERS.index(answer.upper())
+            return index if index < len(options) else WRONG
+        if answer in options:
+            return options.index(answer)
+        if answer.isdigit() and 1 <= int(answer) <= len(options):
+            return int(answer) - 1
+        return WRONG
+
+    def answers(self, submission):
+        # Javoblar {savol_id: javob} lug'ati, ro'yxat yoki erkin matn ("1-A, 2-C ..." yoki "A C B D") ko'rinishida bo'lishi mumkin
+        if isinstance(submission, dict):
+            return {str(key): value for key, value in submission.items() if value is not None and str(value).strip()}
+        if isinstance(submission, (list, tuple)):
+            return {question_id: value for question_id, value in zip(self.ids, submission) if value is not None and str(value).strip()}
+        text = str(submission or "").strip()
+        numbered = NUMBERED_ANSWER.findall(text)
+        if numbered:
+            return {self.ids[int(number) - 1]: letter.upper() for number, letter in numbered if 1 <= int(number) <= len(self.ids)}
+        if LETTER_SEQUENCE.match(text):
+            letters = [char.upper() for char in text if char.isalpha()]
+            return dict(zip(self.ids, letters))
+        return {}
+
+    def encode(self, answers):
+        codes = np.full(len(self.ids), MISSING, dtype=np.int16)
+        for position, question_id in enumerate(self.ids):
+            value = answers.get(question_id)
+            if value is None:
+                continue
+            if self.open[position]:
+                codes[position] = 0 if _normalize(value) == self.options[position][0] else WRONG
+            else:
+                codes[position] = self._option_code(self.options[position], value)
+        return codes
+
+    def grade_many(self, submissions):
+        parsed = [self.answers(submission) for submission in submissions]
+        if not parsed:
+            return []
+        matrix = np.stack([self.encode(answers) for answers in parsed])
+        correct = matrix == self.keys
+        earned = correct @ self.weights
+        subject_percentages = np.round(earned / self.possible * 100, 1)
+        totals = np.round(earned.sum(axis=1) / self.possible.sum() * 100, 1)
+        answered = (matrix != MISSING).sum(axis=1)
+
+        results = []
+        for row, answers in enumerate(parsed):
+            subjects = {}
+            for column, subject in enumerate(self.subjects):
+                percentage = float(subject_percentages[row, column])
+                subjects[subject] = {"foiz": percentage, "ball": score_to_grade(percentage),
+                                     "olingan": float(earned[row, column]), "maksimal": float(self.possible[column])}
+            results.append({
+                "javoblar": answers,
+                "baholash": {"foiz": float(totals[row]), "ball": score_to_grade(float(totals[row])),
+                             "togri": int(correct[row].sum()), "javob_berilgan": int(answered[row]),
+                             "savollar": len(self.ids), "fanlar": subjects},
+            })
+        return results
+
+    def grade(self, submission):
+        return self.grade_many([submission])[0]
+
+def _submission(result):
+    if not isinstance(result, dict):
+        return None
+    return result.get("answers", result.get("answer"))
+
+def grade_test_results(db: Session, rows):
+    # Tuzilgan (spec'li) testlarning natijalari saqlashdan oldin baholanadi; bir testning barcha
+    # natijalari bitta matritsa bilan tekshiriladi. Kalitsiz testlar natijasi o'zgarmaydi
+    by_test = defaultdict(list)
+    for row in rows:
+        if _submission(row.result) is not None:
+            by_test[row.test_id].append(row)
+    if not by_test:
+        return
+    with db.no_autoflush:
+        specs = dict(db.query(Test.id, Test.spec).filter(Test.id.in_(by_test)))
+    for test_id, spec in specs.items():
+        if not spec:
+            continue
+        grader = Grader(spec)
+        test_rows = by_test[test_id]
+        graded = grader.grade_many([_submission(row.result) for row in test_rows])
+        for row, result in zip(test_rows, graded):
+            row.result = {**row.result, **result}
+
+def subject_scores(db: Session, user_id: int):
+    # Har bir test uchun oxirgi baholangan natija olinadi va ballar fanlar bo'yicha jamlanadi
+    latest = {}
+    for row in db.query(TestResult).filter(TestResult.user_id == user_id).order_by(TestResult.id):
+        if isinstance(row.result, dict) and "baholash" in row.result:
+            latest[row.test_id] = row.result["baholash"]
+
+    earned, possible = defaultdict(float), defaultdict(float)
+    for grading in latest.values():
+        for subject, score in grading["fanlar"].items():
+            earned[subject] += score["olingan"]
+            possible[subject] += score["maksimal"]
+
+    scores = {}
+    for subject in possible:
+        percentage = round(earned[subject] / possible[subject] * 100, 1)
+        scores[subject] = {"foiz": percentage, "ball": score_to_grade(percentage)}
+    return scores
+
+def render_questions(spec):
+    # Kalitsiz, o'quvchiga ko'rsatiladigan matn
+    lines = []
+    for number, question in enumerate(spec["questions"], start=1):
+        lines.append(f"{number}. {question['text']}")
+        for letter, option in zip(OPTION_LETTERS, question.get("options") or []):
+            lines.append(f"   {letter}) {option}")
+    return "\n".join(lines)
+
+def public_spec(spec):
+    if not spec:
+        return spec
+    return {**spec, "questions": [{key: value for key, value in question.items() if key not in ("answer", "answer_index")} for question in spec["questions"]]}
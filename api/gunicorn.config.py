@@ -1,3 +1,28 @@
-bind = "0.0.0.0:8000"
-workers = 3
+import os
+import gc
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "3"))
 worker_class = "uvicorn.workers.UvicornWorker"
+# Ilova ishchilar sonini shu o'zgaruvchidan biladi (masalan, CACHE_URL'siz kesh faqat bitta ishchida yoqiladi)
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+# Ilova master jarayonda bir marta yuklanadi, ishchilar uni fork orqali copy-on-write bilan oladi.
+# Sxema ishga tushirishda emas, "python migrations.py schema" bilan yangilanadi
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+def pre_fork(server, worker):
+    # Oldindan yuklangan obyektlarni GC kuzatuvidan chiqarish: aks holda yig'ish sahifalarni nusxalaydi
+    gc.freeze()
+
+def post_fork(server, worker):
+    # Master jarayonda ochilgan SQLite ulanishlari ishchilarga o'tmasligi kerak
+    if preload_app:
+        from database import engine
+        engine.dispose(close=False)
+
+# Prometheus multiprocess rejimi: to'xtagan ishchining ko'rsatkich fayllarini tozalash
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,343 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+import anyio
+from fastapi.concurrency import run_in_threadpool
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Idempotency-Key sarlavhasi qabul qilinadigan POST marshrutlari (prefiks bo'yicha)
+IDEMPOTENCY_PATHS = tuple(path for path in os.environ.get("IDEMPOTENCY_PATHS", "/ai_assistant,/ai_hisobot,/tests,/test_results").split(",") if path)
+# Ombor: bo'sh bo'lsa alohida SQLite fayli (ishchilar orasida umumiy), redis://... bo'lsa Redis
+IDEMPOTENCY_URL = os.environ.get("IDEMPOTENCY_URL", "")
+IDEMPOTENCY_DB = os.environ.get("IDEMPOTENCY_DB", "idempotency.db")
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+# Shuncha vaqt yangilanmagan "bajarilmoqda" yozuvi tashlab ketilgan hisoblanadi (ishchi to'xtagan)
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.environ.get("IDEMPOTENCY_LOCK_TIMEOUT", "300"))
+# Takroriy so'rov birinchisining tugashini ko'pi bilan shuncha kutadi
+IDEMPOTENCY_WAIT = float(os.environ.get("IDEMPOTENCY_WAIT", "300"))
+POLL_INTERVAL = 0.05
+FLUSH_BYTES = 4096
+FLUSH_INTERVAL = 0.1
+MAX_KEY_LENGTH = 255
+
+# Marshrut xatoni 200 javob ichida qaytarganda (masalan oqim boshlangandan keyin) scope'ga shu belgini qo'yadi
+FAILED_SCOPE_KEY = "idempotency.failed"
+
+NEW = "new"
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+MISMATCH = "mismatch"
+
+class SQLiteIdempotencyStore:
+    # Alohida fayl: asosiy bazaning yozish qulfi bilan raqobatlashmaydi. Har bir jarayon o'z ulanishini ochadi
+    def __init__(self, path=IDEMPOTENCY_DB, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.begins = 0
+
+    @property
+    def db(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS idempotency_keys (key TEXT PRIMARY KEY, fingerprint TEXT, state TEXT, "
+                               "status INTEGER, headers TEXT, created_at REAL, updated_at REAL, expires_at REAL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS idempotency_chunks (key TEXT, seq INTEGER, data BLOB, PRIMARY KEY (key, seq))")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys (expires_at)")
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return connection
+
+    def begin(self, key, fingerprint):
+        now = time.time()
+        self.begins += 1
+        if self.begins % 100 == 1:
+            self.prune(now)
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT fingerprint, state, status, headers, updated_at, expires_at FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                stale = row[1] == IN_PROGRESS and row[4] < now - IDEMPOTENCY_LOCK_TIMEOUT
+                if row[5] > now and not stale:
+                    db.execute("COMMIT")
+                    if row[0] != fingerprint:
+                        return MISMATCH, None
+                    return row[1], self._record(row)
+                self._delete(key)
+            db.execute("INSERT INTO idempotency_keys (key, fingerprint, state, created_at, updated_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                       (key, fingerprint, IN_PROGRESS, now, now, now + self.ttl))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return NEW, None
+
+    def _record(self, row):
+        return {"state": row[1], "status": row[2], "headers": json.loads(row[3]) if row[3] else None}
+
+    def get(self, key):
+        row = self.db.execute("SELECT fingerprint, state, status, headers, updated_at, expires_at FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+        return self._record(row) if row is not None else None
+
+    def start(self, key, status, headers):
+        self.db.execute("UPDATE idempotency_keys SET status = ?, headers = ?, updated_at = ? WHERE key = ?",
+                        (status, json.dumps(headers), time.time(), key))
+
+    def append(self, key, seq, data):
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        db.execute("INSERT INTO idempotency_chunks (key, seq, data) VALUES (?, ?, ?)", (key, seq, data))
+        db.execute("UPDATE idempotency_keys SET updated_at = ? WHERE key = ?", (time.time(), key))
+        db.execute("COMMIT")
+
+    def chunks(self, key, start):
+        return [data for (data,) in self.db.execute("SELECT data FROM idempotency_chunks WHERE key = ? AND seq >= ? ORDER BY seq", (key, start))]
+
+    def complete(self, key):
+        self.db.execute("UPDATE idempotency_keys SET state = ?, updated_at = ? WHERE key = ?", (COMPLETED, time.time(), key))
+
+    def release(self, key):
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        self._delete(key)
+        db.execute("COMMIT")
+
+    def _delete(self, key):
+        self.db.execute("DELETE FROM idempotency_chunks WHERE key = ?", (key,))
+        self.db.execute("DELETE FROM idempotency_keys WHERE key = ?", (key,))
+
+    def prune(self, now):
+        # Muddati o'tgan yozuvlar va chegaradan ortiq eng eskilari o'chiriladi
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        db.execute("DELETE FROM idempotency_keys WHERE expires_at < ? OR key IN "
+                   "(SELECT key FROM idempotency_keys ORDER BY created_at DESC LIMIT -1 OFFSET ?)", (now, self.max_entries))
+        db.execute("DELETE FROM idempotency_chunks WHERE key NOT IN (SELECT key FROM idempotency_keys)")
+        db.execute("COMMIT")
+
+class RedisIdempotencyStore:
+    # Yozuv JSON sifatida <prefix><key>, javob bo'laklari esa <prefix><key>:chunks ro'yxatida; ikkalasi ham TTL bilan
+    def __init__(self, url, ttl=IDEMPOTENCY_TTL, prefix="idempotency:"):
+        if redis is None:
+            raise RuntimeError("IDEMPOTENCY_URL Redis uchun redis paketi o'rnatilishi kerak")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _load(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value else None
+
+    def _save(self, key, record):
+        self.client.set(self.prefix + key, json.dumps(record), keepttl=True, xx=True)
+
+    def begin(self, key, fingerprint):
+        now = time.time()
+        record = {"fingerprint": fingerprint, "state": IN_PROGRESS, "status": None, "headers": None, "updated_at": now}
+        if self.client.set(self.prefix + key, json.dumps(record), nx=True, ex=self.ttl):
+            return NEW, None
+        existing = self._load(key)
+        if existing is None or (existing["state"] == IN_PROGRESS and existing["updated_at"] < now - IDEMPOTENCY_LOCK_TIMEOUT):
+            # Yozuv muddati tugagan yoki egasi to'xtagan: qayta egallashga urinib ko'riladi
+            self.release(key)
+            return self.begin(key, fingerprint)
+        if existing["fingerprint"] != fingerprint:
+            return MISMATCH, None
+        return existing["state"], existing
+
+    def get(self, key):
+        return self._load(key)
+
+    def _update(self, key, **fields):
+        record = self._load(key)
+        if record is not None:
+            record.update(fields, updated_at=time.time())
+            self._save(key, record)
+
+    def start(self, key, status, headers):
+        self._update(key, status=status, headers=headers)
+
+    def append(self, key, seq, data):
+        chunks = self.prefix + key + ":chunks"
+        pipeline = self.client.pipeline()
+        pipeline.rpush(chunks, data)
+        pipeline.expire(chunks, self.ttl)
+        pipeline.execute()
+        self._update(key)
+
+    def chunks(self, key, start):
+        return self.client.lrange(self.prefix + key + ":chunks", start, -1)
+
+    def complete(self, key):
+        self._update(key, state=COMPLETED)
+
+    def release(self, key):
+        self.client.delete(self.prefix + key, self.prefix + key + ":chunks")
+
+def create_store():
+    if IDEMPOTENCY_URL.startswith(("redis://", "rediss://", "unix://")):
+        return RedisIdempotencyStore(IDEMPOTENCY_URL)
+    return SQLiteIdempotencyStore()
+
+class _ChunkWriter:
+    # Oqimli javob bo'laklari omborga guruhlab yoziladi: har bir token uchun alohida yozuv bo'lmaydi.
+    # Omborga murojaatlar (SQLite qulfi, tarmoq) oqimlar havzasida bajariladi, hodisalar sikli bloklanmaydi
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.seq = 0
+        self.buffer = []
+        self.size = 0
+        self.flushed_at = time.monotonic()
+
+    async def add(self, data, final):
+        if data:
+            self.buffer.append(data)
+            self.size += len(data)
+        if final or self.size >= FLUSH_BYTES or time.monotonic() - self.flushed_at >= FLUSH_INTERVAL:
+            await self.flush()
+
+    async def flush(self):
+        if self.buffer:
+            await run_in_threadpool(self.store.append, self.key, self.seq, b"".join(self.buffer))
+            self.seq += 1
+            self.buffer, self.size = [], 0
+        self.flushed_at = time.monotonic()
+
+def mark_failed(scope):
+    # Bunday javob saqlanmaydi va kalit bo'shatiladi: keyingi urinish so'rovni qaytadan bajaradi
+    scope[FAILED_SCOPE_KEY] = True
+
+async def _json_response(send, status, detail):
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1"))]})
+    await send({"type": "http.response.body", "body": body})
+
+class IdempotencyMiddleware:
+    # Idempotency-Key bilan kelgan POST so'rovi bir marta bajariladi. Takroriy so'rov saqlangan javobni,
+    # birinchisi hali bajarilayotgan bo'lsa esa uning oqimini ombordan kuzatib oladi.
+    # 5xx javoblar, mark_failed() bilan belgilangan javoblar va uzilgan oqimlar saqlanmaydi: keyingi urinish so'rovni qaytadan bajaradi
+    def __init__(self, app, store=None, paths=IDEMPOTENCY_PATHS):
+        self.app = app
+        self.store = store or create_store()
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(b"idempotency-key")
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            await _json_response(send, 400, f"Idempotency-Key 1-{MAX_KEY_LENGTH} belgidan iborat bo'lishi kerak")
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        # Kalit foydalanuvchi (token) va marshrut doirasida; barmoq izi esa so'rov tanasi bo'yicha
+        key = hashlib.sha256(b"\0".join((headers.get(b"authorization", b""), scope["path"].encode("utf-8"), idempotency_key))).hexdigest()
+        fingerprint = hashlib.sha256(scope.get("query_string", b"") + b"\0" + body).hexdigest()
+
+        while True:
+            state, record = await run_in_threadpool(self.store.begin, key, fingerprint)
+            if state == MISMATCH:
+                await _json_response(send, 422, "Bu Idempotency-Key boshqa so'rov uchun ishlatilgan")
+                return
+            if state == NEW:
+                await self.execute(key, scope, body, receive, send)
+                return
+            if await self.replay(key, send):
+                return
+            # Birinchi so'rov muvaffaqiyatsiz tugadi va kalit bo'shatildi: so'rov shu yerda bajariladi
+
+    async def execute(self, key, scope, body, receive, send):
+        body_sent = False
+        status = None
+        finished = False
+        writer = _ChunkWriter(self.store, key)
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        async def capture(message):
+            nonlocal status, finished
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if status < 500:
+                    await run_in_threadpool(self.store.start, key, status, [[name.decode("latin-1"), value.decode("latin-1")] for name, value in message.get("headers", [])])
+            elif message["type"] == "http.response.body" and status < 500:
+                final = not message.get("more_body", False)
+                await writer.add(message.get("body", b""), final)
+                finished = final
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture)
+        except BaseException:
+            # Mijoz uzilganda ham kalit bo'shatilishi kerak
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(self.store.release, key)
+            raise
+        if finished and not scope.get(FAILED_SCOPE_KEY):
+            await run_in_threadpool(self.store.complete, key)
+        else:
+            await run_in_threadpool(self.store.release, key)
+
+    async def replay(self, key, send):
+        # Saqlangan (yoki hali yozilayotgan) javob bo'laklari ombordan o'qib yuboriladi
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT
+        started = False
+        seq = 0
+        while True:
+            record = await run_in_threadpool(self.store.get, key)
+            if record is None:
+                if started:
+                    # Birinchi javob oqimi uzildi: takroriy javob ham shu yerda tugaydi
+                    await send({"type": "http.response.body", "body": b""})
+                    return True
+                return False
+            if not started and record["status"] is not None:
+                headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in record["headers"]]
+                await send({"type": "http.response.start", "status": record["status"],
+                            "headers": headers + [(b"idempotent-replayed", b"true")]})
+                started = True
+            if started:
+                for data in await run_in_threadpool(self.store.chunks, key, seq):
+                    seq += 1
+                    await send({"type": "http.response.body", "body": data, "more_body": True})
+            if record["state"] == COMPLETED and started:
+                await send({"type": "http.response.body", "body": b""})
+                return True
+            if time.monotonic() > deadline:
+                if started:
+                    await send({"type": "http.response.body", "body": b""})
+                else:
+                    await _json_response(send, 409, "Shu Idempotency-Key bilan so'rov hali bajarilmoqda")
+                return True
+            await asyncio.sleep(POLL_INTERVAL)
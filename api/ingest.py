@@ -0,0 +1,171 @@
+import os
+import re
+import sys
+import logging
+import argparse
+import unicodedata
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Subject, BookSection
+from tokens import estimate_tokens
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+# Bitta bo'limdagi taxminiy tokenlar chegarasi: prompt uchun material shu bo'laklar bo'yicha tanlanadi
+SECTION_MAX_TOKENS = int(os.environ.get("SECTION_MAX_TOKENS", "800"))
+FLUSH_EVERY = 100
+
+MARKDOWN_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*$")
+CHAPTER_HEADING = re.compile(r"^(\d+[-.]?\s*)?(bob|mavzu|dars|qism|chapter|глава|тема|§)\b", re.IGNORECASE)
+PAGE_NUMBER = re.compile(r"^[-–\s]*\d{1,4}[-–\s]*$")
+HEADING_MAX_LENGTH = 80
+SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+def read_lines(path):
+    # Fayl qatorma-qator o'qiladi; PDF esa (pypdf o'rnatilgan bo'lsa) sahifama-sahifa
+    if path.lower().endswith(".pdf"):
+        if PdfReader is None:
+            raise ValueError("PDF fayllar uchun pypdf o'rnatilishi kerak (yoki oldindan matnga aylantiring)")
+        for page in PdfReader(path).pages:
+            yield from (page.extract_text() or "").splitlines()
+            yield "\f"
+        return
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        yield from f
+
+def normalize_lines(lines):
+    # Unicode NFC, ortiqcha bo'shliqlar, sahifa raqamlari va PDF'dagi so'z ko'chirishlari tozalanadi.
+    # Bo'sh qator xatboshi chegarasi sifatida saqlanadi
+    pending = ""
+    for raw in lines:
+        for part in raw.split("\f"):
+            line = " ".join(unicodedata.normalize("NFC", part).replace("\ufeff", "").split())
+            if PAGE_NUMBER.match(line):
+                continue
+            if pending:
+                if not line:
+                    continue
+                line, pending = pending + line, ""
+            if len(line) > 1 and line.endswith("-") and line[-2].isalpha():
+                pending = line[:-1]
+                continue
+            yield line
+    if pending:
+        yield pending
+
+def _heading(line):
+    match = MARKDOWN_HEADING.match(line)
+    if match:
+        return match.group(2)
+    if len(line) <= HEADING_MAX_LENGTH and CHAPTER_HEADING.match(line):
+        return line
+    return None
+
+def _pieces(line, max_tokens):
+    # Xatboshisiz uzun qatorlar (PDF'dan olingan matnda ko'p uchraydi) gaplar, kerak bo'lsa so'zlar bo'yicha bo'linadi
+    line_tokens = estimate_tokens(line)
+    if line_tokens <= max_tokens:
+        yield line, line_tokens
+        return
+    units = SENTENCE_END.split(line)
+    if len(units) == 1:
+        units = line.split(" ")
+    piece, piece_tokens = [], 0
+    for unit in units:
+        unit_tokens = estimate_tokens(unit)
+        if piece and piece_tokens + unit_tokens > max_tokens:
+            yield " ".join(piece), piece_tokens
+            piece, piece_tokens = [], 0
+        if unit_tokens > max_tokens and len(units) > 1 and " " in unit:
+            yield from _pieces(unit, max_tokens)
+            continue
+        piece.append(unit)
+        piece_tokens += unit_tokens
+    if piece:
+        yield " ".join(piece), piece_tokens
+
+def split_sections(lines, max_tokens=SECTION_MAX_TOKENS):
+    # (sarlavha, matn, tokenlar) qaytariladi. Bo'lim chegarasi sarlavhada yoki token chegarasida,
+    # imkon qadar xatboshi oxirida qo'yiladi
+    heading = None
+    paragraphs = [[]]
+    tokens = 0
+    open_tokens = 0
+
+    def section(parts):
+        text = "\n\n".join(" ".join(paragraph) for paragraph in parts if paragraph)
+        return heading, text, estimate_tokens(text)
+
+    for line in lines:
+        title = _heading(line) if line else None
+        if title is not None:
+            if tokens:
+                yield section(paragraphs)
+            heading, paragraphs, tokens, open_tokens = title, [[]], 0, 0
+            continue
+        if not line:
+            if paragraphs[-1]:
+                paragraphs.append([])
+                open_tokens = 0
+            continue
+
+        for piece, piece_tokens in _pieces(line, max_tokens):
+            if tokens and tokens + piece_tokens > max_tokens:
+                done_tokens = tokens - open_tokens
+                if done_tokens >= max_tokens // 2:
+                    # Tugallangan xatboshilar saqlanadi, ochiq xatboshi keyingi bo'limga o'tadi
+                    yield section(paragraphs[:-1])
+                    paragraphs, tokens = [paragraphs[-1]], open_tokens
+                else:
+                    yield section(paragraphs)
+                    paragraphs, tokens, open_tokens = [[]], 0, 0
+            paragraphs[-1].append(piece)
+            tokens += piece_tokens
+            open_tokens += piece_tokens
+
+    if tokens:
+        yield section(paragraphs)
+
+def ingest_file(db: Session, subject_id: int, path: str, source: str = None, max_tokens: int = SECTION_MAX_TOKENS):
+    # Bir manbaning bo'limlari bitta tranzaksiyada almashtiriladi
+    source = source or os.path.basename(path)
+    db.query(BookSection).filter(BookSection.subject_id == subject_id, BookSection.source == source).delete(synchronize_session=False)
+
+    count = total_tokens = 0
+    for heading, text, tokens in split_sections(normalize_lines(read_lines(path)), max_tokens):
+        db.add(BookSection(subject_id=subject_id, source=source, position=count, heading=heading,
+                           content=text, token_count=tokens))
+        count += 1
+        total_tokens += tokens
+        if count % FLUSH_EVERY == 0:
+            db.flush()
+            db.expunge_all()
+    db.commit()
+    return count, total_tokens
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Darslik fayllarini (TXT, Markdown, PDF) fan bo'limlariga ajratib saqlash")
+    parser.add_argument("subject_id", type=int)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--source", help="Manba nomi (faqat bitta fayl uchun, standart: fayl nomi)")
+    parser.add_argument("--max-tokens", type=int, default=SECTION_MAX_TOKENS)
+    args = parser.parse_args()
+    if args.source and len(args.files) > 1:
+        parser.error("--source faqat bitta fayl bilan ishlatiladi")
+
+    db = SessionLocal()
+    try:
+        if db.query(Subject.id).filter(Subject.id == args.subject_id).first() is None:
+            print(f"Fan topilmadi: {args.subject_id}", file=sys.stderr)
+            sys.exit(1)
+        for path in args.files:
+            count, total_tokens = ingest_file(db, args.subject_id, path, args.source, args.max_tokens)
+            logger.info(f"{path}: {count} ta bo'lim, taxminan {total_tokens} token")
+    finally:
+        db.close()
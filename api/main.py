@@ -1,37 +1,65 @@
 import os
 import json
+import time
 import logging
+import importlib.util
 from datetime import timedelta
-from typing import List
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, status
-from fastapi.responses import StreamingResponse, JSONResponse
+from functools import partial
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Query, UploadFile, File, WebSocket, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, JSONResponse, Response, FileResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.orm import Session, undefer
 from sqlalchemy.exc import IntegrityError
 from fastapi.middleware.cors import CORSMiddleware
 import anthropic
 
-from database import SessionLocal, engine, Base, User, Chat, Message, Test, TestResult, StudentReport, Parent, Teacher, Subject, ScheduleAndBooks, PsychologicalAssessment, StudentProgress
+from database import SessionLocal, User, Chat, Message, Test, TestResult, StudentReport, Parent, Teacher, Subject, ScheduleAndBooks, PsychologicalAssessment, StudentProgress, BookSection
 from schemas import (UserCreate, UserResponse, ParentCreate, TeacherCreate, SubjectCreate,
                      ScheduleAndBookCreate, TestCreate, TestResultCreate, TestResultResponse,
                      PsychologicalAssessmentCreate, StudentProgressCreate, ChatCreate,
                      ChatResponse, MessageCreate, MessageResponse, Token, TokenData,
-                     AIQuery, StudentReportResponse)
+                     AIQuery, StudentReportResponse, SearchResult, DashboardEntry,
+                     RosterImportResult, BookSectionResponse, BatchResult, TestResponse, TestSubmission)
 from utils import (get_db, verify_password, get_password_hash, authenticate_user,
                    create_access_token, get_current_user, get_student_context,
-                   get_chat_history, create_new_chat, save_test, calculate_age)
-
-from sqladmin import Admin, ModelView
-from fastapi import FastAPI
-
-from prompts import get_ai_report_prompt, get_system_prompt
+                   get_chat_history, create_new_chat, save_chat_turn, find_chat_turn, save_test, calculate_age,
+                   ConditionalGet)
+
+
+from prompts import get_ai_report_prompt, get_ai_analysis_prompt, get_system_prompt, get_system_blocks, serialize_context
+from search import SEARCH_SCOPES, search_content
+from analytics import get_grade_dashboard, get_school_dashboard
+from compression import CompressionMiddleware
+from metrics import MetricsMiddleware, observe_llm_call, render_metrics, LLM_ERRORS
+from tracing import TracingMiddleware, span, start_span, end_span
+from profiling import ProfilingMiddleware, list_profiles, get_profile_path
+from idempotency import IdempotencyMiddleware, mark_failed
+from roster import import_roster
+from submissions import BATCH_MAX_ITEMS, submit_test_results, upsert_student_progress
+from budget import PromptBudget, PromptTooLarge
+from chat_socket import serve_chat
+from warmup import WARMUP_ON_LOGIN, PROMPT_CACHE_PRIME, student_context, warm_student_context
+from grading import Grader, grade_test_results, subject_scores, render_questions, public_spec
+from reports import save_report_generation, get_latest_reports, get_report_history, get_report_version, get_latest_report_time, compact_report_history
 
 # Environment o'zgaruvchilarini yuklash
 from dotenv import load_dotenv
 load_dotenv()
 
+# orjson o'rnatilgan bo'lsa javoblar tezroq seriyalanadi
+if importlib.util.find_spec("orjson") is not None:
+    from fastapi.responses import ORJSONResponse as DefaultJSONResponse
+else:
+    DefaultJSONResponse = JSONResponse
+
 # FastAPI ilovasi sozlamalari
-app = FastAPI(title="IqroAI API")
+app = FastAPI(title="IqroAI API", default_response_class=DefaultJSONResponse)
+
+# Idempotency-Key bilan qayta yuborilgan POST so'rovlar bir marta bajariladi (IDEMPOTENCY_URL, IDEMPOTENCY_PATHS)
+app.add_middleware(IdempotencyMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,6 +69,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Katta (oqimsiz) javoblarni gzip yoki brotli bilan siqish
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.environ.get("COMPRESSION_MIN_SIZE", "1024")))
+
+# So'rov, DB va model ko'rsatkichlari (/metrics)
+app.add_middleware(MetricsMiddleware)
+
+# Bosqichlar bo'yicha izlar (TRACE_EXPORTER, TRACE_FILE)
+app.add_middleware(TracingMiddleware)
+
+# Talab bo'yicha (PROFILING_ENABLED + X-Profile) va tanlab (PROFILE_SAMPLE_EVERY) profillash
+app.add_middleware(ProfilingMiddleware)
+
 # Autentifikatsiya sozlamalari
 SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
@@ -50,6 +90,8 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 api_key = os.environ.get('ANTHROPIC_API_KEY')
 anthropic_client = anthropic.Anthropic(api_key=api_key)
+# WebSocket chati uchun: asinxron oqimni bekor qilish HTTP ulanishini ham yopadi
+async_anthropic_client = anthropic.AsyncAnthropic(api_key=api_key)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -92,6 +134,18 @@ async def register_teacher(teacher: TeacherCreate, db: Session = Depends(get_db)
         raise HTTPException(status_code=400, detail="O'qituvchi allaqachon ro'yxatdan o'tgan")
     return db_teacher
 
+@app.post("/import/roster", response_model=RosterImportResult)
+async def import_roster_file(file: UploadFile = File(...), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Faqat adminlar ro'yxatni import qilishi mumkin")
+    if not file.filename.lower().endswith((".csv", ".xlsx")):
+        raise HTTPException(status_code=400, detail="Faqat CSV yoki XLSX fayllar qabul qilinadi")
+    # bcrypt va tranzaksiyalar uzoq davom etadi, shuning uchun import hodisalar siklini band qilmaydi
+    try:
+        return await run_in_threadpool(import_roster, db, file.file, file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/subjects", response_model=SubjectCreate)
 async def create_subject(subject: SubjectCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
@@ -103,8 +157,10 @@ async def create_subject(subject: SubjectCreate, db: Session = Depends(get_db),
     return db_subject
 
 @app.get("/subjects", response_model=List[SubjectCreate])
-async def get_subjects(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    subjects = db.query(Subject).all()
+async def get_subjects(current_user: User = Depends(get_current_user), db: Session = Depends(get_db), conditional: ConditionalGet = Depends()):
+    count, max_id, max_updated = db.query(func.count(Subject.id), func.max(Subject.id), func.max(Subject.updated_at)).one()
+    conditional.check(count, max_id, max_updated)
+    subjects = db.query(Subject).options(undefer(Subject.book_text)).all()
     return subjects
 
 @app.put("/subjects/{subject_id}", response_model=SubjectCreate)
@@ -131,6 +187,14 @@ async def delete_subject(subject_id: int, db: Session = Depends(get_db), current
     db.commit()
     return {"message": "Fan muvaffaqiyatli o'chirildi"}
 
+@app.get("/subjects/{subject_id}/sections", response_model=List[BookSectionResponse])
+async def get_subject_sections(subject_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    # Matnsiz ro'yxat: bo'limlar "python ingest.py" bilan yuklanadi
+    return (db.query(BookSection)
+            .filter(BookSection.subject_id == subject_id)
+            .order_by(BookSection.source, BookSection.position)
+            .all())
+
 @app.post("/schedule_and_books", response_model=ScheduleAndBookCreate)
 async def create_schedule_and_book(item: ScheduleAndBookCreate, db: Session = Depends(get_db)):
     db_item = ScheduleAndBooks(**item.dict())
@@ -139,45 +203,89 @@ async def create_schedule_and_book(item: ScheduleAndBookCreate, db: Session = De
     db.refresh(db_item)
     return db_item
 
-@app.post("/tests", response_model=TestCreate)
+def _test_data(test: TestCreate):
+    data = test.dict()
+    if data["spec"] is not None:
+        try:
+            Grader(data["spec"])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not data["questions"]:
+            data["questions"] = render_questions(data["spec"])
+    elif not data["questions"]:
+        raise HTTPException(status_code=400, detail="Savollar yoki tuzilgan test (spec) ko'rsatilishi kerak")
+    return data
+
+def _test_response(test: Test, current_user: User):
+    # O'quvchiga test kaliti ko'rsatilmaydi
+    response = {field: getattr(test, field) for field in TestResponse.__fields__}
+    if current_user.role == "student":
+        response["spec"] = public_spec(response["spec"])
+    return response
+
+@app.post("/tests", response_model=TestResponse)
 async def create_test(test: TestCreate, db: Session = Depends(get_db)):
-    db_test = Test(**test.dict())
+    db_test = Test(**_test_data(test))
     db.add(db_test)
     db.commit()
     db.refresh(db_test)
     return db_test
 
-@app.get("/tests", response_model=List[TestCreate])
+@app.get("/tests", response_model=List[TestResponse])
 async def get_tests(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    tests = db.query(Test).filter(Test.user_id == current_user.id).all()
-    return tests
+    tests = db.query(Test).options(undefer(Test.questions)).filter(Test.user_id == current_user.id).all()
+    return [_test_response(test, current_user) for test in tests]
 
-@app.get("/tests/{test_id}", response_model=TestCreate)
+@app.get("/tests/{test_id}", response_model=TestResponse)
 async def get_test(test_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     test = db.query(Test).filter(Test.id == test_id, Test.user_id == current_user.id).first()
     if not test:
         raise HTTPException(status_code=404, detail="Test topilmadi")
-    return test
+    return _test_response(test, current_user)
 
-@app.put("/tests/{test_id}", response_model=TestCreate)
+@app.put("/tests/{test_id}", response_model=TestResponse)
 async def update_test(test_id: int, test: TestCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     db_test = db.query(Test).filter(Test.id == test_id, Test.user_id == current_user.id).first()
     if not db_test:
         raise HTTPException(status_code=404, detail="Test topilmadi")
-    for key, value in test.dict().items():
+    for key, value in _test_data(test).items():
         setattr(db_test, key, value)
     db.commit()
     db.refresh(db_test)
-    return db_test
+    return _test_response(db_test, current_user)
+
+@app.post("/tests/{test_id}/submit", response_model=TestResultResponse)
+async def submit_test(test_id: int, submission: TestSubmission, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    # Javoblar kalit bo'yicha darhol baholanadi: foizlar model chaqirilmasdan hisoblanadi
+    test = db.query(Test).filter(Test.id == test_id, Test.user_id == current_user.id).first()
+    if not test:
+        raise HTTPException(status_code=404, detail="Test topilmadi")
+    if not test.spec:
+        raise HTTPException(status_code=400, detail="Bu test uchun javob kaliti mavjud emas")
+    db_test_result = TestResult(user_id=current_user.id, test_id=test.id, result={"answer": submission.answers})
+    grade_test_results(db, [db_test_result])
+    db.add(db_test_result)
+    db.commit()
+    db.refresh(db_test_result)
+    return db_test_result
 
 @app.post("/test_results", response_model=TestResultResponse)
 async def create_test_result(test_result: TestResultCreate, db: Session = Depends(get_db)):
     db_test_result = TestResult(**test_result.dict())
+    grade_test_results(db, [db_test_result])
     db.add(db_test_result)
     db.commit()
     db.refresh(db_test_result)
     return db_test_result
 
+@app.post("/test_results/batch", response_model=BatchResult)
+async def create_test_results_batch(test_results: List[TestResultCreate], db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.role != "teacher" and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Faqat o'qituvchilar va adminlar natijalarni ommaviy yuborishi mumkin")
+    if len(test_results) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Bir so'rovda ko'pi bilan {BATCH_MAX_ITEMS} ta element yuborish mumkin")
+    return submit_test_results(db, test_results)
+
 @app.get("/test_results/{user_id}", response_model=List[TestResultResponse])
 async def get_user_test_results(user_id: int, db: Session = Depends(get_db)):
     test_results = db.query(TestResult).filter(TestResult.user_id == user_id).all()
@@ -190,6 +298,7 @@ async def update_test_result(result_id: int, test_result: TestResultCreate, db:
         raise HTTPException(status_code=404, detail="Test natijasi topilmadi")
     for key, value in test_result.dict().items():
         setattr(db_test_result, key, value)
+    grade_test_results(db, [db_test_result])
     db.commit()
     db.refresh(db_test_result)
     return db_test_result
@@ -226,11 +335,19 @@ async def get_student_progress(student_id: int, db: Session = Depends(get_db)):
 async def create_student_progress(progress: StudentProgressCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role != "teacher" and current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Faqat o'qituvchilar va adminlar progress yozuvlarini yaratishi mumkin")
-    db_progress = StudentProgress(**progress.dict())
-    db.add(db_progress)
-    db.commit()
-    db.refresh(db_progress)
-    return db_progress
+    # (user_id, subject_id) bo'yicha bitta yozuv: mavjud bo'lsa yangilanadi
+    item = upsert_student_progress(db, [progress])["items"][0]
+    if item["status"] == "error":
+        raise HTTPException(status_code=400, detail=item["error"])
+    return db.query(StudentProgress).filter(StudentProgress.id == item["id"]).first()
+
+@app.post("/student_progress/batch", response_model=BatchResult)
+async def create_student_progress_batch(progress: List[StudentProgressCreate], db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.role != "teacher" and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Faqat o'qituvchilar va adminlar progress yozuvlarini yaratishi mumkin")
+    if len(progress) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Bir so'rovda ko'pi bilan {BATCH_MAX_ITEMS} ta element yuborish mumkin")
+    return upsert_student_progress(db, progress)
 
 @app.put("/student_progress/{progress_id}", response_model=StudentProgressCreate)
 async def update_student_progress(progress_id: int, progress: StudentProgressCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -241,12 +358,16 @@ async def update_student_progress(progress_id: int, progress: StudentProgressCre
         raise HTTPException(status_code=404, detail="Progress yozuvi topilmadi")
     for key, value in progress.dict().items():
         setattr(db_progress, key, value)
-    db.commit()
-    db.refresh(db_progress)
+    try:
+        db.commit()
+        db.refresh(db_progress)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Bu o'quvchi va fan uchun progress yozuvi allaqachon mavjud")
     return db_progress
 
 @app.post("/token")
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_for_access_token(background_tasks: BackgroundTasks, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     logger.info(f"Foydalanuvchi uchun login urinishi: {form_data.username}")
     user = authenticate_user(db, form_data.username, form_data.password)
     if not user:
@@ -261,21 +382,43 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         data={"sub": user.email}, expires_delta=access_token_expires
     )
     logger.info(f"Foydalanuvchi uchun login muvaffaqiyatli: {form_data.username}")
-    return {"access_token": access_token, "token_type": "bearer"}
+    if WARMUP_ON_LOGIN:
+        # Birinchi xabar kutmasligi uchun kontekst javobdan keyin fon rejimida tayyorlanadi
+        background_tasks.add_task(warm_session, user.id)
+    return {"access_token": access_token, "token_type": "bearer", "user_id": user.id}
 
-@app.post("/ai_assistant")
-async def query_ai_assistant(query: AIQuery, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    if query.chat_id:
-        chat = db.query(Chat).filter(Chat.id == query.chat_id, Chat.user_id == current_user.id).first()
-        if not chat:
-            raise HTTPException(status_code=404, detail="Chat topilmadi")
-    else:
-        chat = create_new_chat(current_user.id, db)
+@app.post("/session/warmup", status_code=status.HTTP_202_ACCEPTED)
+async def warmup_session(background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user)):
+    # Chat sahifasi ochilganda chaqiriladi: prompt keshi faqat chat qiladigan o'quvchi uchun to'ldiriladi
+    background_tasks.add_task(warm_session, current_user.id, PROMPT_CACHE_PRIME)
+    return {"message": "Kontekst tayyorlanmoqda"}
 
-    context = get_student_context(current_user.id, db)
+@app.post("/ai_assistant")
+async def query_ai_assistant(query: AIQuery, request: Request, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    with span("chat.lookup"):
+        if query.chat_id:
+            chat = db.query(Chat).filter(Chat.id == query.chat_id, Chat.user_id == current_user.id).first()
+            if not chat:
+                raise HTTPException(status_code=404, detail="Chat topilmadi")
+        else:
+            chat = create_new_chat(current_user.id, db)
+
+    # Idempotency-Key javob identifikatori sifatida saqlanadi. WebSocket uzilgandan keyin mijoz so'rovni
+    # shu turn id bilan takrorlaydi: javob allaqachon saqlangan bo'lsa, model qayta chaqirilmaydi
+    turn_id = request.headers.get("idempotency-key")
+    saved = find_chat_turn(db, chat.id, turn_id)
+    if saved is not None:
+        return StreamingResponse(iter([saved[1]]), media_type="text/plain")
+
+    context = student_context(db, current_user.id)
     chat_history = get_chat_history(chat.id, db)
     
-    system_prompt = get_system_prompt(json.dumps(context, indent=2))
+    with span("prompt.build"):
+        try:
+            context, chat_history = PromptBudget("ai_assistant").fit(get_system_prompt(""), context, chat_history, query.query)
+        except PromptTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        system_prompt = get_system_blocks(serialize_context(context))
 
     conversation_history = chat_history + [{"role": "user", "content": query.query}]
 
@@ -283,7 +426,13 @@ async def query_ai_assistant(query: AIQuery, current_user: User = Depends(get_cu
 
     def generate():
         nonlocal response_text
+        llm_finished = False
+        # Oqim bosqichlari generator ichida qo'lda ochilib yopiladi
+        ttft_span = generate_span = save_span = None
         try:
+            started = time.perf_counter()
+            first_token_at = None
+            ttft_span = start_span("llm.time_to_first_token")
             with anthropic_client.messages.stream(
                 model="claude-3-5-sonnet-20240620",
                 max_tokens=2000,
@@ -292,99 +441,139 @@ async def query_ai_assistant(query: AIQuery, current_user: User = Depends(get_cu
                 messages=conversation_history
             ) as stream:
                 for text in stream.text_stream:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        end_span(ttft_span)
+                        generate_span = start_span("llm.generate")
                     response_text += text
                     yield text
+                usage = stream.get_final_message().usage
+            llm_finished = True
+            # Model birorta ham matn bo'lagi qaytarmagan bo'lsa, birinchi token oralig'i ochiq qolgan
+            end_span(generate_span if first_token_at is not None else ttft_span)
+            observe_llm_call("ai_assistant", started, first_token_at, time.perf_counter(), usage)
+            save_span = start_span("db.save_turn")
 
-            # Foydalanuvchi xabarini saqlash
-            user_message = Message(chat_id=chat.id, role="user", content=query.query)
-            db.add(user_message)
-            
-            # Assistent javobini saqlash
-            assistant_message = Message(chat_id=chat.id, role="assistant", content=response_text)
-            db.add(assistant_message)
-            
-            # Oldingi xabar Bilimlarni baholash testi bo'lganligini tekshirish
-            last_message = db.query(Message).filter(Message.chat_id == chat.id).order_by(Message.timestamp.desc()).offset(1).first()
-            if last_message:
-                if "Bilimlarni baholash testi" in last_message.content:
-                    # Joriy so'rov foydalanuvchining akademik testga javobi
-                    test = db.query(Test).filter(Test.user_id == current_user.id, Test.type == "academic").order_by(Test.timestamp.desc()).first()
-                    if test:
-                        test_result = TestResult(user_id=current_user.id, test_id=test.id, result={"answer": query.query})
-                        db.add(test_result)
-                elif "Psixologik test" in last_message.content:
-                    # Joriy so'rov foydalanuvchining psixologik testga javobi
-                    test = db.query(Test).filter(Test.user_id == current_user.id, Test.type == "psychological").order_by(Test.timestamp.desc()).first()
-                    if test:
-                        test_result = TestResult(user_id=current_user.id, test_id=test.id, result={"answer": query.query})
-                        db.add(test_result)
-
-            # Joriy javobda yangi test borligini tekshirish
-            if "Bilimlarni baholash testi" in response_text:
-                new_test = Test(user_id=current_user.id, type="academic", questions=response_text)
-                db.add(new_test)
-            elif "Psixologik test" in response_text:
-                new_test = Test(user_id=current_user.id, type="psychological", questions=response_text)
-                db.add(new_test)
-            
-            db.commit()
+            save_chat_turn(current_user.id, chat.id, query.query, response_text, db, turn_id)
+            end_span(save_span)
 
         except Exception as e:
+            for open_span in (ttft_span, generate_span, save_span):
+                if open_span is not None and open_span.end is None:
+                    end_span(open_span, e)
+            if not llm_finished:
+                LLM_ERRORS.labels("ai_assistant").inc()
             logger.error(f"AI javob generatsiyasida xatolik: {str(e)}")
+            # Status allaqachon 200: xato javob Idempotency-Key bilan qayta o'ynalmasligi kerak
+            mark_failed(request.scope)
             yield "So'rovingizni qayta ishlashda xatolik yuz berdi."
 
     return StreamingResponse(generate(), media_type="text/plain")
 
-@app.post("/ai_hisobot")
-async def generate_ai_report(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # O'quvchi kontekstini olish
-    context = get_student_context(current_user.id, db)
-    
-    # AI model uchun so'rovni tayyorlash
-    system_prompt = get_ai_report_prompt(json.dumps(context, indent=2))
-
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    # Ulanish bir marta autentifikatsiya qilinadi; javoblar {"type": "delta"} bo'laklari bilan oqimlanadi.
+    # Baza sessiyalari har bir murojaat uchun alohida ochiladi (chat_socket.run_db)
+    await serve_chat(websocket, async_anthropic_client)
+
+def warm_session(user_id: int, prime: bool = False):
+    # Kontekst keshlanadi va (prime bo'lsa) provayderning prompt keshi bir tokenlik so'rov bilan to'ldiriladi
+    context = warm_student_context(user_id)
+    if context is None or not prime:
+        return
+    started = time.perf_counter()
     try:
         response = anthropic_client.messages.create(
             model="claude-3-5-sonnet-20240620",
-            max_tokens=2000,
-            temperature=0,
-            system=system_prompt,
-            messages=[{"role": "user", "content": "Ushbu o'quvchi uchun hisobot yarating."}]
+            max_tokens=1,
+            system=get_system_blocks(serialize_context(context)),
+            messages=[{"role": "user", "content": "."}]
         )
+    except Exception as e:
+        LLM_ERRORS.labels("warmup").inc()
+        logger.warning(f"Prompt keshini to'ldirishda xatolik: {str(e)}")
+        return
+    observe_llm_call("warmup", started, None, time.perf_counter(), response.usage)
 
-        report_data = json.loads(response.content[0].text)
+def compact_user_reports(user_id: int):
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if user and compact_report_history(db, user):
+            db.commit()
+    finally:
+        db.close()
 
-        db.query(StudentReport).filter(StudentReport.user_id == current_user.id).delete()
+@app.post("/ai_hisobot")
+async def generate_ai_report(background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    # O'quvchi kontekstini olish
+    context = get_student_context(current_user.id, db)
+    
+    # Tuzilgan testlar bo'yicha foizlar mahalliy hisoblangan bo'lsa, modeldan faqat tahlil matni so'raladi
+    scores = subject_scores(db, current_user.id)
+    if scores:
+        build_prompt = partial(get_ai_analysis_prompt, scores=serialize_context(scores))
+    else:
+        build_prompt = get_ai_report_prompt
 
-        # Yangi hisobotlar yaratish
-        for subject, data in report_data["Hisobot"].items():
-            new_report = StudentReport(
-                user_id=current_user.id,
-                subject=subject,
-                percentage=float(data["foiz"]),
-                grade=int(data["ball"])
-            )
-            db.add(new_report)
+    # AI model uchun so'rovni tayyorlash: kontekst bo'limlari byudjetga sig'diriladi
+    try:
+        context, _ = PromptBudget("ai_hisobot").fit(build_prompt(""), context)
+    except PromptTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    system_prompt = build_prompt(serialize_context(context))
 
-        db.commit()
+    try:
+        started = time.perf_counter()
+        try:
+            with span("llm.create"):
+                response = anthropic_client.messages.create(
+                    model="claude-3-5-sonnet-20240620",
+                    max_tokens=2000,
+                    temperature=0,
+                    system=system_prompt,
+                    messages=[{"role": "user", "content": "Ushbu o'quvchi uchun hisobot yarating."}]
+                )
+        except Exception:
+            LLM_ERRORS.labels("ai_hisobot").inc()
+            raise
+        observe_llm_call("ai_hisobot", started, None, time.perf_counter(), response.usage)
+
+        if scores:
+            report_data = {"Hisobot": scores, "Tahlil": response.content[0].text.strip()}
+        else:
+            report_data = json.loads(response.content[0].text)
+
+        # Eski hisobotlar o'chirilmaydi: har bir generatsiya alohida surat sifatida saqlanadi
+        with span("db.save_report"):
+            save_report_generation(db, current_user, report_data)
+            db.commit()
+
+        background_tasks.add_task(compact_user_reports, current_user.id)
 
-        return JSONResponse(content=report_data)
+        return DefaultJSONResponse(content=report_data)
 
     except Exception as e:
         logger.error(f"AI hisobot generatsiyasida xatolik: {str(e)}")
         raise HTTPException(status_code=500, detail="Hisobotni yaratishda xatolik yuz berdi")
 
 @app.get("/chats", response_model=List[ChatResponse])
-async def get_user_chats(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_user_chats(current_user: User = Depends(get_current_user), db: Session = Depends(get_db), conditional: ConditionalGet = Depends()):
+    # Versiya bitta agregat so'rov bilan hisoblanadi; o'zgarish bo'lmasa ro'yxat yuklanmaydi
+    count, max_id, max_updated = db.query(func.count(Chat.id), func.max(Chat.id), func.max(Chat.updated_at)).filter(Chat.user_id == current_user.id).one()
+    conditional.check(current_user.id, count, max_id, max_updated)
     chats = db.query(Chat).filter(Chat.user_id == current_user.id).all()
     return chats
 
 @app.get("/chats/{chat_id}/messages", response_model=List[MessageResponse])
-async def get_chat_messages(chat_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_chat_messages(chat_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db), conditional: ConditionalGet = Depends()):
     chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_id == current_user.id).first()
     if not chat:
         raise HTTPException(status_code=404, detail="Chat topilmadi")
-    return chat.messages
+    count, max_id, max_timestamp = db.query(func.count(Message.id), func.max(Message.id), func.max(Message.timestamp)).filter(Message.chat_id == chat_id).one()
+    conditional.check(count, max_id, max_timestamp)
+    messages = db.query(Message).options(undefer(Message.content)).filter(Message.chat_id == chat_id).all()
+    return messages
 
 @app.post("/chats/{chat_id}/messages", response_model=MessageResponse)
 async def add_message_to_chat(chat_id: int, message: MessageCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
@@ -418,7 +607,8 @@ async def delete_chat(chat_id: int, current_user: User = Depends(get_current_use
     return {"message": "Chat muvaffaqiyatli o'chirildi"}
 
 @app.get("/users/me/", response_model=UserResponse)
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: User = Depends(get_current_user), conditional: ConditionalGet = Depends()):
+    conditional.check(*(getattr(current_user, field) for field in UserResponse.__fields__))
     return current_user
 
 @app.put("/users/me", response_model=UserResponse)
@@ -440,121 +630,66 @@ async def update_user(
     return current_user
 
 @app.get("/student_reports", response_model=List[StudentReportResponse])
-async def get_student_reports(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    reports = db.query(StudentReport).filter(StudentReport.user_id == current_user.id).all()
-    return reports
+async def get_student_reports(current_user: User = Depends(get_current_user), db: Session = Depends(get_db), conditional: ConditionalGet = Depends()):
+    conditional.check(current_user.id, *get_report_version(db, current_user), last_modified=get_latest_report_time(db, current_user))
+    return get_latest_reports(db, current_user)
+
+@app.get("/student_reports/history", response_model=List[StudentReportResponse])
+async def get_student_report_history(current_user: User = Depends(get_current_user), db: Session = Depends(get_db), conditional: ConditionalGet = Depends()):
+    conditional.check(current_user.id, *get_report_version(db, current_user))
+    return get_report_history(db, current_user)
+
+@app.get("/search", response_model=List[SearchResult])
+async def search(q: str, scope: Optional[List[str]] = Query(None), limit: int = 20, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    if scope and any(item not in SEARCH_SCOPES for item in scope):
+        raise HTTPException(status_code=400, detail=f"Qidiruv doirasi quyidagilardan biri bo'lishi kerak: {', '.join(SEARCH_SCOPES)}")
+    return search_content(db, current_user, q, scope, min(limit, 100))
+
+@app.get("/dashboard/grades/{grade}", response_model=List[DashboardEntry])
+async def get_grade_dashboard_view(grade: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    if current_user.role != "teacher" and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Faqat o'qituvchilar va adminlar sinf ko'rsatkichlarini ko'rishi mumkin")
+    return get_grade_dashboard(db, grade)
+
+@app.get("/dashboard/school", response_model=List[DashboardEntry])
+async def get_school_dashboard_view(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    if current_user.role != "teacher" and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Faqat o'qituvchilar va adminlar maktab ko'rsatkichlarini ko'rishi mumkin")
+    return get_school_dashboard(db)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/profiles", include_in_schema=False)
+async def get_profiles(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Faqat adminlar profillarni ko'rishi mumkin")
+    return list_profiles()
+
+@app.get("/profiles/{name:path}", include_in_schema=False)
+async def download_profile(name: str, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Faqat adminlar profillarni yuklab olishi mumkin")
+    path = get_profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profil topilmadi")
+    return FileResponse(path, filename=os.path.basename(path))
 
 @app.on_event("startup")
 async def startup_event():
-    Base.metadata.create_all(bind=engine)
-    logger.info("Ma'lumotlar bazasi ishga tushirildi.")
-
-class UserAdmin(ModelView, model=User):
-    column_list = [User.id, User.first_name, User.last_name, User.email, User.role, User.grade, User.interests]
-    column_searchable_list = [User.first_name, User.last_name, User.email, User.interests]
-    column_filters = [User.role, User.grade]
-    can_create = True
-    can_edit = True
-    can_delete = True
-
-class ParentAdmin(ModelView, model=Parent):
-    column_list = [Parent.id, Parent.user_id, Parent.student_id]
-    can_create = True
-    can_edit = True
-    can_delete = True
-
-class TeacherAdmin(ModelView, model=Teacher):
-    column_list = [Teacher.id, Teacher.user_id, Teacher.subjects]
-    can_create = True
-    can_edit = True
-    can_delete = True
-
-class SubjectAdmin(ModelView, model=Subject):
-    column_list = [Subject.id, Subject.name, Subject.grade, Subject.description]
-    column_searchable_list = [Subject.name]
-    column_filters = [Subject.grade]
-    can_create = True
-    can_edit = True
-    can_delete = True
-
-class ScheduleAndBooksAdmin(ModelView, model=ScheduleAndBooks):
-    column_list = [ScheduleAndBooks.id, ScheduleAndBooks.subject_id, ScheduleAndBooks.grade, ScheduleAndBooks.title]
-    can_create = True
-    can_edit = True
-    can_delete = True
-
-class TestAdmin(ModelView, model=Test):
-    column_list = [Test.id, Test.user_id, Test.type, Test.timestamp]
-    column_searchable_list = [Test.user_id, Test.type]
-    column_filters = [Test.type, Test.timestamp]
-    can_create = True
-    can_edit = True
-    can_delete = True
-
-class TestResultAdmin(ModelView, model=TestResult):
-    column_list = [TestResult.id, TestResult.user_id, TestResult.test_id, TestResult.created_at]
-    column_searchable_list = [TestResult.user_id, TestResult.test_id]
-    column_filters = [TestResult.created_at]
-    can_create = True
-    can_edit = True
-    can_delete = True
-
-class PsychologicalAssessmentAdmin(ModelView, model=PsychologicalAssessment):
-    column_list = [PsychologicalAssessment.id, PsychologicalAssessment.user_id, PsychologicalAssessment.timestamp]
-    column_searchable_list = [PsychologicalAssessment.user_id]
-    column_filters = [PsychologicalAssessment.timestamp]
-    can_create = True
-    can_edit = True
-    can_delete = True
-
-class StudentProgressAdmin(ModelView, model=StudentProgress):
-    column_list = [StudentProgress.id, StudentProgress.user_id, StudentProgress.subject_id, StudentProgress.progress, StudentProgress.last_updated]
-    column_searchable_list = [StudentProgress.user_id, StudentProgress.subject_id]
-    column_filters = [StudentProgress.last_updated]
-    can_create = True
-    can_edit = True
-    can_delete = True
-
-class ChatAdmin(ModelView, model=Chat):
-    column_list = [Chat.id, Chat.user_id, Chat.name, Chat.created_at, Chat.updated_at]
-    column_searchable_list = [Chat.user_id, Chat.name]
-    column_filters = [Chat.created_at, Chat.updated_at]
-    can_create = True
-    can_edit = True
-    can_delete = True
-
-class MessageAdmin(ModelView, model=Message):
-    column_list = [Message.id, Message.chat_id, Message.role, Message.timestamp]
-    column_searchable_list = [Message.chat_id, Message.content]
-    column_filters = [Message.role, Message.timestamp]
-    can_create = True
-    can_edit = True
-    can_delete = True
-
-class StudentReportAdmin(ModelView, model=StudentReport):
-    column_list = [StudentReport.id, StudentReport.user_id, StudentReport.subject, StudentReport.percentage, StudentReport.grade, StudentReport.created_at]
-    column_searchable_list = [StudentReport.user_id, StudentReport.subject]
-    column_filters = [StudentReport.grade, StudentReport.created_at]
-    can_create = True
-    can_edit = True
-    can_delete = True
-
-# Admin panelni yaratish
-admin = Admin(app, engine)
-
-# Admin modellarini qo'shish
-admin.add_view(UserAdmin)
-admin.add_view(ParentAdmin)
-admin.add_view(TeacherAdmin)
-admin.add_view(SubjectAdmin)
-admin.add_view(ScheduleAndBooksAdmin)
-admin.add_view(TestAdmin)
-admin.add_view(TestResultAdmin)
-admin.add_view(PsychologicalAssessmentAdmin)
-admin.add_view(StudentProgressAdmin)
-admin.add_view(ChatAdmin)
-admin.add_view(MessageAdmin)
-admin.add_view(StudentReportAdmin)
+    # Sxema har bir ishchida emas, "python migrations.py schema" bilan bir marta yangilanadi.
+    # Mahalliy ishlab chiqish uchun DB_AUTO_MIGRATE=1 uni ishga tushirishda bajaradi
+    if os.environ.get("DB_AUTO_MIGRATE", "0") == "1":
+        from migrations import upgrade_schema
+        upgrade_schema()
+    logger.info("Ilova ishga tushirildi.")
+
+# Admin paneli ixtiyoriy quyi ilova sifatida /admin ga ulanadi
+if os.environ.get("ADMIN_ENABLED", "1") == "1":
+    from admin import create_admin
+    create_admin(app)
 
 
 if __name__ == "__main__":
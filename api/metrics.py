@@ -0,0 +1,128 @@
+import os
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from prometheus_client import (Counter, Gauge, Histogram, CollectorRegistry, REGISTRY,
+                               generate_latest, CONTENT_TYPE_LATEST)
+from prometheus_client import multiprocess
+
+from database import engine
+
+# Joriy so'rov scope'i: DB so'rovlarini marshrut bo'yicha ajratish uchun
+current_scope = ContextVar("current_scope", default=None)
+
+REQUEST_LATENCY = Histogram(
+    "iqroai_request_duration_seconds", "HTTP so'rov davomiyligi (oqim tugaguncha)",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "iqroai_requests_in_flight", "Hozir bajarilayotgan so'rovlar", multiprocess_mode="livesum",
+)
+DB_QUERIES = Counter("iqroai_db_queries_total", "Bajarilgan SQL so'rovlar soni", ["route"])
+DB_QUERY_DURATION = Histogram(
+    "iqroai_db_query_duration_seconds", "SQL so'rov davomiyligi", ["route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+PASSWORD_HASH_DURATION = Histogram(
+    "iqroai_password_hash_duration_seconds", "bcrypt xeshlash va tekshirish davomiyligi", ["operation"],
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 1, 2),
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "iqroai_llm_time_to_first_token_seconds", "Modeldan birinchi tokengacha vaqt", ["endpoint"],
+    buckets=(0.25, 0.5, 1, 1.5, 2, 3, 5, 10, 20),
+)
+LLM_DURATION = Histogram(
+    "iqroai_llm_duration_seconds", "Model chaqiruvining umumiy davomiyligi", ["endpoint"],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120),
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "iqroai_llm_output_tokens_per_second", "Chiqish tokenlari tezligi", ["endpoint"],
+    buckets=(5, 10, 20, 30, 50, 75, 100, 150, 200),
+)
+DB_LOCK_ERRORS = Counter("iqroai_db_lock_errors_total", "SQLite 'database is locked' xatolari", ["route"])
+LLM_TOKENS = Counter("iqroai_llm_tokens_total", "Model tokenlari", ["endpoint", "kind"])
+LLM_ERRORS = Counter("iqroai_llm_errors_total", "Model chaqiruvidagi xatolar", ["endpoint"])
+
+LLM_USAGE_FIELDS = {
+    "input": "input_tokens",
+    "output": "output_tokens",
+    "cache_read": "cache_read_input_tokens",
+    "cache_creation": "cache_creation_input_tokens",
+}
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    scope = current_scope.get()
+    route = _route_label(scope) if scope is not None else "background"
+    DB_QUERIES.labels(route).inc()
+    DB_QUERY_DURATION.labels(route).observe(time.perf_counter() - started)
+
+@event.listens_for(engine, "handle_error")
+def _handle_error(exception_context):
+    # Xato bo'lgan so'rovning boshlanish vaqti stekdan olib tashlanadi
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+    if "database is locked" in str(exception_context.original_exception):
+        scope = current_scope.get()
+        DB_LOCK_ERRORS.labels(_route_label(scope) if scope is not None else "background").inc()
+
+def observe_llm_call(endpoint, started, first_token_at, finished, usage):
+    if first_token_at is not None:
+        LLM_TIME_TO_FIRST_TOKEN.labels(endpoint).observe(first_token_at - started)
+    LLM_DURATION.labels(endpoint).observe(finished - started)
+    if usage is None:
+        return
+    for kind, field in LLM_USAGE_FIELDS.items():
+        LLM_TOKENS.labels(endpoint, kind).inc(getattr(usage, field, None) or 0)
+    generation_start = first_token_at if first_token_at is not None else started
+    if usage.output_tokens and finished > generation_start:
+        LLM_TOKENS_PER_SECOND.labels(endpoint).observe(usage.output_tokens / (finished - generation_start))
+
+def _route_label(scope):
+    # Yuqori kardinallikdan qochish uchun URL emas, marshrut shabloni ishlatiladi
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+        # Router scope'ni joyida yangilaydi, shuning uchun marshrut shabloni keyinroq o'qiladi
+        token = current_scope.set(scope)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_LATENCY.labels(scope["method"], _route_label(scope), str(status_code)).observe(time.perf_counter() - started)
+            current_scope.reset(token)
+
+def render_metrics():
+    # gunicorn ishchilari uchun PROMETHEUS_MULTIPROC_DIR berilsa barcha jarayonlar birlashtiriladi
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
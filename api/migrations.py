@@ -0,0 +1,137 @@
+import sys
+import logging
+from sqlalchemy import text, inspect, func
+from sqlalchemy.orm import undefer
+
+from database import engine, compress_text, SessionLocal, Base, StudentProgress, BookSection
+from search import create_search_index, rebuild_search_index
+from analytics import rebuild_analytics
+from tokens import estimate_tokens
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def dedupe_student_progress():
+    # Unikal indeksdan oldin takroriy (user_id, subject_id) yozuvlaridan eng oxirgisi qoldiriladi.
+    # ORM orqali o'chiriladi, shunda analitika agregatlari ham yangilanadi
+    db = SessionLocal()
+    try:
+        duplicates = (db.query(StudentProgress)
+                      .filter(StudentProgress.id.notin_(
+                          db.query(func.max(StudentProgress.id)).group_by(StudentProgress.user_id, StudentProgress.subject_id)))
+                      .all())
+        for progress in duplicates:
+            db.delete(progress)
+        db.commit()
+    finally:
+        db.close()
+    if duplicates:
+        logger.info(f"{len(duplicates)} ta takroriy progress yozuvi o'chirildi")
+
+def upgrade_schema():
+    Base.metadata.create_all(bind=engine)
+    dedupe_student_progress()
+
+    # create_all mavjud jadvallarga yangi ustun qo'shmaydi, shuning uchun ularni qo'lda qo'shamiz
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                logger.info(f"{table.name}.{column.name} ustuni qo'shildi")
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    create_search_index()
+    logger.info("Ma'lumotlar bazasi sxemasi yangilandi.")
+
+# Siqilgan ustunlar: (jadval, ustun)
+COMPRESSED_COLUMNS = [
+    ("subjects", "book_text"),
+    ("schedule_and_books", "content"),
+    ("tests", "questions"),
+    ("messages", "content"),
+]
+
+BATCH_SIZE = 500
+
+def compress_existing_rows():
+    # Faqat hali matn ko'rinishida saqlangan qatorlarni siqamiz, shuning uchun qayta ishga tushirish xavfsiz
+    for table, column in COMPRESSED_COLUMNS:
+        total = 0
+        last_id = 0
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(
+                    text(f"SELECT id, {column} FROM {table} "
+                         f"WHERE id > :last_id AND typeof({column}) = 'text' ORDER BY id LIMIT :limit"),
+                    {"last_id": last_id, "limit": BATCH_SIZE}
+                ).fetchall()
+                if not rows:
+                    break
+                conn.execute(
+                    text(f"UPDATE {table} SET {column} = :value WHERE id = :id"),
+                    [{"id": row[0], "value": compress_text(row[1])} for row in rows]
+                )
+            last_id = rows[-1][0]
+            total += len(rows)
+        logger.info(f"{table}.{column}: {total} ta qator siqildi")
+
+    # Bo'shagan sahifalarni qaytarish uchun faylni qayta yozish
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+    logger.info("Ma'lumotlar bazasi fayli ixchamlashtirildi.")
+
+def build_search_index():
+    create_search_index()
+    db = SessionLocal()
+    try:
+        rebuild_search_index(db)
+    finally:
+        db.close()
+    logger.info("To'liq matnli qidiruv indeksi qayta qurildi.")
+
+def recount_section_tokens():
+    # Token taxmini (tokens.py) o'zgargandan keyin darslik bo'limlarining token_count qiymatlari qayta hisoblanadi
+    db = SessionLocal()
+    total = 0
+    last_id = 0
+    try:
+        while True:
+            sections = (db.query(BookSection).options(undefer(BookSection.content))
+                        .filter(BookSection.id > last_id).order_by(BookSection.id).limit(BATCH_SIZE).all())
+            if not sections:
+                break
+            for section in sections:
+                section.token_count = estimate_tokens(section.content or "")
+            db.commit()
+            last_id = sections[-1].id
+            total += len(sections)
+    finally:
+        db.close()
+    logger.info(f"{total} ta darslik bo'limining tokenlari qayta hisoblandi")
+
+def build_analytics():
+    db = SessionLocal()
+    try:
+        rebuild_analytics(db)
+    finally:
+        db.close()
+    logger.info("Analitika agregatlari qayta hisoblandi.")
+
+COMMANDS = {
+    "schema": upgrade_schema,
+    "compress": compress_existing_rows,
+    "search": build_search_index,
+    "analytics": build_analytics,
+    "tokens": recount_section_tokens,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in COMMANDS:
+        print(f"Foydalanish: python migrations.py [{'|'.join(COMMANDS)}]")
+        sys.exit(1)
+    COMMANDS[sys.argv[1]]()
@@ -0,0 +1,159 @@
+import os
+import re
+import time
+import secrets
+import itertools
+from jose import jwt, JWTError
+from fastapi.concurrency import run_in_threadpool
+
+from database import SessionLocal
+from utils import SECRET_KEY, ALGORITHM, get_principal
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+# Profil sozlamalari. PROFILING_ENABLED=1 bo'lsa admin "X-Profile: 1" sarlavhasi bilan bitta so'rovni
+# profillay oladi. PROFILE_SAMPLE_EVERY=N esa PROFILE_PATHS dagi har N-so'rovni profillaydi
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_EVERY = int(os.environ.get("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_PATHS = tuple(path for path in os.environ.get("PROFILE_PATHS", "/ai_assistant,/ai_hisobot").split(",") if path)
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_NAME_PATTERN = re.compile(r"^(sampled/)?[\w.-]+\.(html|prof)$")
+
+_request_counter = itertools.count(1)
+# Bir vaqtda faqat bitta profil (cProfile ikkinchi profilni qabul qilmaydi)
+_active = False
+
+class _CProfileRecorder:
+    # pyinstrument o'rnatilmaganda ishlatiladi. cProfile butun oqimni profillaydi: shu paytda bajarilgan boshqa
+    # so'rovlar ham profilga aralashadi, oqimlar havzasidagi ish (sinxron marshrutlar, baza) esa kirmaydi.
+    # Natija faqat bir vaqtda bitta so'rov bajarilganda ishonchli
+    extension = "prof"
+
+    def __init__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self, path):
+        self.profile.disable()
+        self.profile.dump_stats(path)
+
+class _PyinstrumentRecorder:
+    extension = "html"
+
+    def __init__(self):
+        # async_mode bir vaqtdagi boshqa so'rovlarni shu profilga aralashtirmaydi
+        self.profiler = Profiler(async_mode="enabled")
+
+    def start(self):
+        self.profiler.start()
+
+    def stop(self, path):
+        self.profiler.stop()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.profiler.output_html())
+
+def _new_recorder():
+    return _PyinstrumentRecorder() if Profiler is not None else _CProfileRecorder()
+
+def _is_admin(scope):
+    # Sinxron baza so'rovi: middleware uni oqimlar havzasida chaqiradi
+    headers = dict(scope["headers"])
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        email = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return False
+    db = SessionLocal()
+    try:
+        principal = get_principal(db, email)
+        return principal is not None and principal["role"] == "admin"
+    finally:
+        db.close()
+
+def _prune(directory, keep):
+    files = sorted((entry for entry in os.scandir(directory) if entry.is_file()), key=lambda entry: entry.stat().st_mtime)
+    for entry in files[:-keep] if keep > 0 else files:
+        os.remove(entry.path)
+
+def list_profiles():
+    profiles = []
+    for subdir in ("", "sampled"):
+        directory = os.path.join(PROFILE_DIR, subdir)
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            if entry.is_file():
+                stat = entry.stat()
+                profiles.append({"name": f"{subdir}/{entry.name}" if subdir else entry.name,
+                                 "size": stat.st_size, "created_at": stat.st_mtime})
+    return sorted(profiles, key=lambda item: item["created_at"], reverse=True)
+
+def get_profile_path(name: str):
+    # Faqat PROFILE_DIR ichidagi fayllar qaytariladi
+    if not PROFILE_NAME_PATTERN.match(name) or ".." in name:
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def _mode(self, scope):
+        if _active:
+            return None
+        headers = dict(scope["headers"])
+        if PROFILING_ENABLED and headers.get(PROFILE_HEADER) == b"1" and await run_in_threadpool(_is_admin, scope):
+            return "requested"
+        if PROFILE_SAMPLE_EVERY > 0 and scope["path"].startswith(PROFILE_PATHS):
+            if next(_request_counter) % PROFILE_SAMPLE_EVERY == 0:
+                return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        global _active
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        mode = await self._mode(scope)
+        # Admin tekshiruvi paytida boshqa so'rov profillashni boshlagan bo'lishi mumkin
+        if mode is None or _active:
+            await self.app(scope, receive, send)
+            return
+
+        recorder = _new_recorder()
+        route = scope["path"].strip("/").replace("/", "_") or "root"
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{route}-{secrets.token_hex(4)}.{recorder.extension}"
+        if mode == "sampled":
+            name = f"sampled/{name}"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and mode == "requested":
+                message = {**message, "headers": [*message["headers"], (b"x-profile-id", name.encode("latin-1"))]}
+            await send(message)
+
+        _active = True
+        recorder.start()
+        try:
+            # Oqimli javoblar ham profilga kiradi: ilova javob tugaguncha qaytmaydi
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            path = os.path.join(PROFILE_DIR, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            recorder.stop(path)
+            _active = False
+            if mode == "sampled":
+                _prune(os.path.dirname(path), PROFILE_KEEP)
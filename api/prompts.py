@@ -1,10 +1,16 @@
+import json
 from datetime import datetime
 
 # Hozirgi vaqt, kun, oy va yilni olish
 
-def get_system_prompt(context):
-    current_time = datetime.now()
+def serialize_context(context):
+    # Ixcham va barqaror (tartiblangan kalitli) JSON: bo'sh joylarga token sarflanmaydi
+    # va bir xil kontekst har doim bir xil matn beradi
+    return json.dumps(context, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
 
+def get_system_prompt(context):
+    # Joriy vaqt bu matnga kiritilmaydi (qarang: get_time_prompt), shuning uchun bir xil kontekst uchun
+    # prompt o'zgarmaydi va provayderning prompt keshidan foydalanish mumkin
     return f"""
 # IqroAI: Personalized Uzbek Education Assistant and Emotional Support Tutor
 
@@ -66,7 +72,7 @@ You are the AI assistant for the IqroAI educational platform, designed to provid
 
 Time Awareness
 
-You are aware of the current time and date: {current_time}
+You are aware of the current time and date: they are given at the very end of these instructions.
 Use this time information to contextualize your responses and tailor your assistance to the student's current situation (e.g., school hours, exam periods, holidays).
 
 ## Interaction Guidelines
@@ -98,6 +104,16 @@ The primary merit and fundamental purpose of IqroAI is rooted in its dedication
 By focusing on these core principles, IqroAI aims to be more than just an educational tool – it strives to be a catalyst for positive change and intellectual growth in Uzbekistan, contributing to a brighter and more prosperous future for the nation.
     """
 
+def get_time_prompt():
+    return f"Current time and date: {datetime.now()}"
+
+def get_system_blocks(context):
+    # O'zgarmas qism (ko'rsatmalar va kontekst) kesh belgisi bilan, vaqt esa undan keyin alohida blokda
+    return [
+        {"type": "text", "text": get_system_prompt(context), "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": get_time_prompt()},
+    ]
+
 def get_ai_report_prompt(context):
     return f"""
     You are an AI analyst for the IqroAI educational platform. Your task is to analyze the student's test results and prepare a comprehensive report based on their performance. Here is the information about the current student:
@@ -126,3 +142,20 @@ def get_ai_report_prompt(context):
        }}
     6. Do not include any additional text outside of this JSON object.
     """
+
+def get_ai_analysis_prompt(context, scores):
+    return f"""
+    You are an AI analyst for the IqroAI educational platform. The student's test answers have already been graded against the answer keys. Here is the information about the current student:
+    
+    {context}
+    
+    Graded results per subject (percentage and score on a scale from 2 to 5):
+    
+    {scores}
+    
+    Instructions:
+    1. Do not re-grade the tests or change the scores above; treat them as final.
+    2. Provide a brief analysis of the student's strengths and areas that need improvement, based on these scores and the rest of the student's context.
+    3. Suggest concrete next steps for the weakest subjects.
+    4. Respond with the analysis text only, in Uzbek, without JSON or any additional formatting.
+    """
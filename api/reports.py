@@ -0,0 +1,81 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import User, ReportGeneration, StudentReport
+
+# Hisobot tarixini saqlash siyosati
+REPORT_KEEP_RECENT = int(os.environ.get("REPORT_KEEP_RECENT", "10"))
+REPORT_RETENTION_DAYS = int(os.environ.get("REPORT_RETENTION_DAYS", "730"))
+
+def save_report_generation(db: Session, user: User, report_data: dict):
+    generation = ReportGeneration(user_id=user.id, analysis=report_data.get("Tahlil"))
+    db.add(generation)
+    db.flush()
+
+    for subject, data in report_data["Hisobot"].items():
+        db.add(StudentReport(
+            user_id=user.id,
+            generation_id=generation.id,
+            subject=subject,
+            percentage=float(data["foiz"]),
+            grade=int(data["ball"])
+        ))
+    db.flush()
+
+    # Ko'rsatkich oxirgi bo'lib o'zgaradi, shunda o'quvchilar hech qachon yarim yozilgan hisobotni ko'rmaydi
+    user.latest_report_generation_id = generation.id
+    return generation
+
+def get_latest_reports(db: Session, user: User):
+    query = db.query(StudentReport).filter(StudentReport.user_id == user.id)
+    if user.latest_report_generation_id is None:
+        # Tarix joriy qilinishidan oldingi hisobotlar
+        return query.filter(StudentReport.generation_id.is_(None)).all()
+    return query.filter(StudentReport.generation_id == user.latest_report_generation_id).all()
+
+def get_report_version(db: Session, user: User):
+    # Hisobotlar faqat qo'shiladi yoki siqiladi, shuning uchun soni va oxirgi id versiya uchun yetarli
+    count, max_id = db.query(func.count(StudentReport.id), func.max(StudentReport.id)).filter(StudentReport.user_id == user.id).one()
+    return user.latest_report_generation_id, count, max_id
+
+def get_latest_report_time(db: Session, user: User):
+    # Oxirgi generatsiya yaratilgandan keyin o'zgarmaydi (siqish faqat eskilariga tegadi) va har bir yangisi
+    # keyinroq yaratiladi: bu vaqt faqat o'sadi, shuning uchun Last-Modified sifatida ishlatish mumkin
+    if user.latest_report_generation_id is None:
+        return None
+    return db.query(ReportGeneration.created_at).filter(ReportGeneration.id == user.latest_report_generation_id).scalar()
+
+def get_report_history(db: Session, user: User):
+    return (db.query(StudentReport)
+            .filter(StudentReport.user_id == user.id)
+            .order_by(StudentReport.created_at.asc(), StudentReport.id.asc())
+            .all())
+
+def compact_report_history(db: Session, user: User, now: datetime = None):
+    # Oxirgi REPORT_KEEP_RECENT ta generatsiya to'liq saqlanadi, eskilari oyiga bittagacha
+    # qisqartiriladi, REPORT_RETENTION_DAYS kundan eskilari esa o'chiriladi
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=REPORT_RETENTION_DAYS)
+    generations = (db.query(ReportGeneration)
+                   .filter(ReportGeneration.user_id == user.id)
+                   .order_by(ReportGeneration.created_at.desc(), ReportGeneration.id.desc())
+                   .all())
+
+    kept_months = set()
+    removed = []
+    for index, generation in enumerate(generations):
+        if generation.id == user.latest_report_generation_id or index < REPORT_KEEP_RECENT:
+            continue
+        month = (generation.created_at.year, generation.created_at.month)
+        if generation.created_at < cutoff or month in kept_months:
+            removed.append(generation)
+        else:
+            kept_months.add(month)
+
+    for generation in removed:
+        for report in generation.reports:
+            db.delete(report)
+        db.delete(generation)
+    return len(removed)
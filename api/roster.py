@@ -0,0 +1,239 @@
+import io
+import os
+import csv
+import sys
+import logging
+import argparse
+import multiprocessing
+from datetime import date, datetime
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, User, Parent, Teacher
+from schemas import UserCreate
+from utils import pwd_context
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+logger = logging.getLogger(__name__)
+
+# Ommaviy import sozlamalari: bitta tranzaksiyadagi qatorlar soni va bcrypt jarayonlari soni
+ROSTER_BATCH_SIZE = int(os.environ.get("ROSTER_BATCH_SIZE", "500"))
+ROSTER_HASH_WORKERS = int(os.environ.get("ROSTER_HASH_WORKERS", "0")) or os.cpu_count() or 1
+
+ROSTER_ROLES = ("student", "parent", "teacher")
+USER_FIELDS = ("first_name", "last_name", "email", "password", "birth_date", "phone_number", "grade", "consent", "interests")
+
+def _hash_password(password):
+    # Jarayonlar havzasida bajariladi, shuning uchun modul darajasidagi funksiya
+    return pwd_context.hash(password)
+
+def _cell(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, date) or value is None:
+        return value
+    value = str(value).strip()
+    return value or None
+
+def read_rows(stream, filename):
+    # Fayl to'liq xotiraga yuklanmaydi: (qator raqami, qiymatlar) juftliklari birma-bir qaytariladi
+    if filename.lower().endswith(".xlsx"):
+        if openpyxl is None:
+            raise ValueError("XLSX fayllar uchun openpyxl o'rnatilishi kerak")
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(name).strip() if name is not None else "" for name in next(rows, ())]
+            for number, values in enumerate(rows, start=2):
+                row = {name: _cell(value) for name, value in zip(header, values) if name}
+                if any(value is not None for value in row.values()):
+                    yield number, row
+        finally:
+            workbook.close()
+        return
+
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        for number, row in enumerate(csv.DictReader(text), start=2):
+            yield number, {name.strip(): _cell(value) for name, value in row.items() if name}
+    finally:
+        # Yuklangan fayl chaqiruvchiga tegishli, shuning uchun uni yopmaymiz
+        text.detach()
+
+def _parse_row(row):
+    role = (row.get("role") or "").lower()
+    if role not in ROSTER_ROLES:
+        raise ValueError(f"Rol quyidagilardan biri bo'lishi kerak: {', '.join(ROSTER_ROLES)}")
+    user = UserCreate(role=role, **{field: row.get(field) for field in USER_FIELDS})
+    if role == "student" and user.grade is None:
+        raise ValueError("O'quvchi uchun sinf (grade) ko'rsatilishi kerak")
+    student_emails = [email.strip().lower() for email in (row.get("student_emails") or "").split(";") if email.strip()]
+    return {"user": user, "subjects": row.get("subjects") or "", "student_emails": student_emails}
+
+def _error_message(error):
+    errors = getattr(error, "errors", None)
+    if callable(errors):
+        return "; ".join(f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in errors())
+    return str(error)
+
+def _save_rows(db: Session, rows):
+    users = []
+    for number, entry, hashed in rows:
+        user = User(**entry["user"].dict(exclude={"password"}))
+        user.email = user.email.lower()
+        user.password = hashed
+        db.add(user)
+        users.append((number, entry, user))
+    db.flush()
+    for number, entry, user in users:
+        if user.role == "teacher":
+            db.add(Teacher(user_id=user.id, subjects=entry["subjects"]))
+    db.flush()
+    # Commit'dan keyin obyektlar eskiradi, shuning uchun kerakli qiymatlar oldindan olinadi
+    return [(number, entry, user.id, user.email, user.role) for number, entry, user in users]
+
+class RosterImport:
+    def __init__(self, db: Session, hash_workers=ROSTER_HASH_WORKERS, batch_size=ROSTER_BATCH_SIZE):
+        self.db = db
+        self.hash_workers = hash_workers
+        self.batch_size = batch_size
+        self.result = {"students": 0, "parents": 0, "teachers": 0, "links": 0, "errors": []}
+        # Shu importda yaratilgan foydalanuvchilar: email -> id
+        self.created = {}
+        self.pending_links = []
+        self.seen = set()
+        self.pool = None
+
+    def error(self, number, email, message):
+        self.result["errors"].append({"row": number, "email": email, "error": message})
+
+    def run(self, rows):
+        batch = []
+        try:
+            for number, row in rows:
+                try:
+                    entry = _parse_row(row)
+                except ValueError as e:
+                    self.error(number, row.get("email"), _error_message(e))
+                    continue
+                user = entry["user"]
+                keys = (user.email.lower(), user.phone_number)
+                if self.seen.intersection(keys):
+                    self.error(number, user.email, "Email yoki telefon raqami faylda takrorlangan")
+                    continue
+                self.seen.update(keys)
+                batch.append((number, entry))
+                if len(batch) >= self.batch_size:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+        self.link_parents()
+        self.result["errors"].sort(key=lambda item: item["row"])
+        return self.result
+
+    def hash_passwords(self, passwords):
+        if self.hash_workers <= 1 or len(passwords) < 2:
+            return [_hash_password(password) for password in passwords]
+        if self.pool is None:
+            # spawn: ishchi jarayonlar (uvicorn oqimlari bilan birga) fork qilinmaydi
+            self.pool = ProcessPoolExecutor(max_workers=self.hash_workers, mp_context=multiprocessing.get_context("spawn"))
+        chunksize = max(1, len(passwords) // (self.hash_workers * 4))
+        return list(self.pool.map(_hash_password, passwords, chunksize=chunksize))
+
+    def import_batch(self, batch):
+        emails = [entry["user"].email.lower() for _, entry in batch]
+        phones = [entry["user"].phone_number for _, entry in batch]
+        existing = set()
+        for email, phone in self.db.query(User.email, User.phone_number).filter(or_(User.email.in_(emails), User.phone_number.in_(phones))):
+            existing.update((email.lower() if email else None, phone))
+
+        accepted = []
+        for number, entry in batch:
+            user = entry["user"]
+            if user.email.lower() in existing or user.phone_number in existing:
+                self.error(number, user.email, "Email yoki telefon raqami allaqachon ro'yxatdan o'tgan")
+            else:
+                accepted.append((number, entry))
+        if not accepted:
+            return
+
+        hashes = self.hash_passwords([entry["user"].password for _, entry in accepted])
+        rows = [(number, entry, hashed) for (number, entry), hashed in zip(accepted, hashes)]
+        try:
+            saved = _save_rows(self.db, rows)
+            self.db.commit()
+        except IntegrityError:
+            # Parallel ro'yxatdan o'tish bilan to'qnashuv: xato qatorni topish uchun qatorma-qator saqlaymiz
+            self.db.rollback()
+            saved = []
+            for row in rows:
+                try:
+                    row_saved = _save_rows(self.db, [row])
+                    self.db.commit()
+                    saved.extend(row_saved)
+                except IntegrityError:
+                    self.db.rollback()
+                    self.error(row[0], row[1]["user"].email, "Email yoki telefon raqami allaqachon ro'yxatdan o'tgan")
+
+        for number, entry, user_id, email, role in saved:
+            self.result[f"{role}s"] += 1
+            self.created[email] = user_id
+            for student_email in entry["student_emails"]:
+                self.pending_links.append((number, email, user_id, student_email))
+
+    def link_parents(self):
+        # Ota-onalar fayldagi o'quvchilardan oldin kelishi mumkin, shuning uchun bog'lanishlar oxirida hal qilinadi
+        if not self.pending_links:
+            return
+        missing = {student_email for _, _, _, student_email in self.pending_links if student_email not in self.created}
+        known = {}
+        if missing:
+            known = {email.lower(): user_id for user_id, email in
+                     self.db.query(User.id, User.email).filter(User.email.in_(missing), User.role == "student")}
+        parent_ids = {parent_id for _, _, parent_id, _ in self.pending_links}
+        linked = set(self.db.query(Parent.user_id, Parent.student_id).filter(Parent.user_id.in_(parent_ids)))
+
+        for number, parent_email, parent_id, student_email in self.pending_links:
+            student_id = self.created.get(student_email) or known.get(student_email)
+            if student_id is None:
+                self.error(number, parent_email, f"O'quvchi topilmadi: {student_email}")
+                continue
+            if (parent_id, student_id) in linked:
+                continue
+            linked.add((parent_id, student_id))
+            self.db.add(Parent(user_id=parent_id, student_id=student_id))
+            self.result["links"] += 1
+        self.db.commit()
+
+def import_roster(db: Session, stream, filename, hash_workers=ROSTER_HASH_WORKERS):
+    return RosterImport(db, hash_workers).run(read_rows(stream, filename))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="O'quvchilar, ota-onalar va o'qituvchilarni CSV/XLSX fayldan import qilish")
+    parser.add_argument("file")
+    parser.add_argument("--workers", type=int, default=ROSTER_HASH_WORKERS, help="bcrypt jarayonlari soni")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        with open(args.file, "rb") as f:
+            result = import_roster(db, f, args.file, args.workers)
+    finally:
+        db.close()
+    for error in result["errors"]:
+        print(f"{error['row']}-qator ({error['email'] or '-'}): {error['error']}", file=sys.stderr)
+    logger.info(f"O'quvchilar: {result['students']}, ota-onalar: {result['parents']}, o'qituvchilar: {result['teachers']}, "
+                f"bog'lanishlar: {result['links']}, xatolar: {len(result['errors'])}")
@@ -1,6 +1,6 @@
 # schemas.py
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Dict, Union
 from datetime import date, datetime
 
 class UserCreate(BaseModel):
@@ -44,6 +44,17 @@ class SubjectCreate(BaseModel):
     book_text: str
     video_link: Optional[str] = None
 
+class BookSectionResponse(BaseModel):
+    id: int
+    subject_id: int
+    source: Optional[str]
+    position: int
+    heading: Optional[str]
+    token_count: int
+
+    class Config:
+        orm_mode = True
+
 class ScheduleAndBookCreate(BaseModel):
     subject_id: int
     grade: int
@@ -51,12 +62,42 @@ class ScheduleAndBookCreate(BaseModel):
     content: str
     online_lesson_link: Optional[str] = None
 
+class TestQuestion(BaseModel):
+    id: Optional[str] = None
+    text: str
+    options: List[str] = []
+    # Variantli savollarda kalitni answer_index (0 dan boshlanadigan tartib raqami) bilan berish aniqroq
+    answer: Optional[str] = None
+    answer_index: Optional[int] = None
+    subject: str
+    points: float = 1
+
+class TestSpec(BaseModel):
+    questions: List[TestQuestion]
+
 class TestCreate(BaseModel):
     user_id: int
     type: str
-    questions: str
+    questions: Optional[str] = None
     answers: Optional[str] = None
     results: Optional[str] = None
+    spec: Optional[TestSpec] = None
+
+class TestResponse(BaseModel):
+    id: int
+    user_id: int
+    type: str
+    questions: Optional[str]
+    answers: Optional[str]
+    results: Optional[str]
+    spec: Optional[dict]
+    timestamp: datetime
+
+    class Config:
+        orm_mode = True
+
+class TestSubmission(BaseModel):
+    answers: Union[Dict[str, str], List[Optional[str]], str]
 
 class TestResultCreate(BaseModel):
     user_id: int
@@ -84,6 +125,18 @@ class StudentProgressCreate(BaseModel):
     subject_id: int
     progress: float
 
+class BatchItemStatus(BaseModel):
+    index: int
+    status: str
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+class BatchResult(BaseModel):
+    created: int
+    updated: int
+    errors: int
+    items: List[BatchItemStatus]
+
 class ChatCreate(BaseModel):
     user_id: int
     name: str = "Yangi chat"
@@ -116,6 +169,7 @@ class MessageResponse(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    user_id: Optional[int] = None
 
 class TokenData(BaseModel):
     email: Optional[str] = None
@@ -127,6 +181,7 @@ class AIQuery(BaseModel):
 class StudentReportResponse(BaseModel):
     id: int
     user_id: int
+    generation_id: Optional[int] = None
     subject: str
     percentage: float
     grade: int
@@ -135,6 +190,33 @@ class StudentReportResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class SearchResult(BaseModel):
+    type: str
+    id: int
+    title: str
+    snippet: str
+    rank: float
+
+class DashboardEntry(BaseModel):
+    metric: str
+    grade: int
+    subject: Optional[str]
+    count: int
+    average: Optional[float]
+    average_score: Optional[float]
+
+class RosterImportError(BaseModel):
+    row: int
+    email: Optional[str] = None
+    error: str
+
+class RosterImportResult(BaseModel):
+    students: int
+    parents: int
+    teachers: int
+    links: int
+    errors: List[RosterImportError]
+
 
 class TokenData(BaseModel):
     email: Optional[str] = None
@@ -0,0 +1,143 @@
+import re
+from sqlalchemy import text, or_
+from sqlalchemy.orm import Session
+
+from database import engine, CompressedText, User, Subject, ScheduleAndBooks, Message
+
+# FTS5 jadvallari: asosiy jadval, indekslanadigan ustunlar va ORM modeli
+FTS_TABLES = {
+    "messages": ("messages_fts", ["content"], Message),
+    "subjects": ("subjects_fts", ["name", "description", "book_text"], Subject),
+    "books": ("schedule_and_books_fts", ["title", "content"], ScheduleAndBooks),
+    "users": ("users_fts", ["first_name", "last_name", "email", "interests"], User),
+}
+
+SEARCH_SCOPES = ["messages", "subjects", "books"]
+
+def _is_sqlite(bind):
+    return bind.dialect.name == "sqlite"
+
+def _column_sql(model, column, row):
+    # Siqilgan ustunlar indeksga ochilgan matn sifatida beriladi
+    if isinstance(model.__table__.c[column].type, CompressedText):
+        return f"decompress_text({row}.{column})"
+    return f"{row}.{column}"
+
+def create_search_index():
+    # Tashqi kontentli FTS5 jadvallari: matn nusxasi saqlanmaydi, faqat indeks. Matn (snippet uchun)
+    # ochilgan ustunlarni ko'rsatuvchi ko'rinishdan o'qiladi; indeks SQL triggerlar bilan sinxronlanadi.
+    # Diqqat: triggerlar va ko'rinishlar ilova ro'yxatdan o'tkazadigan decompress_text() funksiyasini chaqiradi.
+    # messages, subjects va schedule_and_books jadvallariga funksiyasiz ulanishdan (sqlite3 CLI, boshqa jarayon)
+    # yozish "no such function: decompress_text" bilan rad etiladi: bunday yozuvlar ilova orqali yoki
+    # database.register_sql_functions() chaqirilgan ulanishda bajariladi. Zaxira nusxa (.backup, VACUUM INTO)
+    # triggerlarni ishga tushirmaydi va funksiyasiz ham ishlaydi
+    if not _is_sqlite(engine):
+        return
+    with engine.begin() as conn:
+        for fts_table, columns, model in FTS_TABLES.values():
+            table = model.__tablename__
+            source = f"{fts_table}_source"
+            names = ", ".join(columns)
+            existing = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": fts_table}).scalar()
+            rebuild = existing is None or "content=" not in existing
+            if existing is not None and rebuild:
+                # Eski FTS jadvali matnning to'liq nusxasini saqlagan
+                conn.execute(text(f"DROP TABLE {fts_table}"))
+
+            conn.execute(text(f"DROP VIEW IF EXISTS {source}"))
+            conn.execute(text(
+                f"CREATE VIEW {source} AS SELECT id, "
+                f"{', '.join(_column_sql(model, column, table) + ' AS ' + column for column in columns)} FROM {table}"
+            ))
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5("
+                f"{names}, content='{source}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            ))
+
+            new_values = ", ".join(_column_sql(model, column, "new") for column in columns)
+            old_values = ", ".join(_column_sql(model, column, "old") for column in columns)
+            insert = f"INSERT INTO {fts_table}(rowid, {names}) VALUES (new.id, {new_values}); "
+            delete = f"INSERT INTO {fts_table}({fts_table}, rowid, {names}) VALUES ('delete', old.id, {old_values}); "
+            for suffix, trigger in (("ai", f"AFTER INSERT ON {table} BEGIN {insert}END"),
+                                    ("ad", f"AFTER DELETE ON {table} BEGIN {delete}END"),
+                                    ("au", f"AFTER UPDATE OF {names} ON {table} BEGIN {delete}{insert}END")):
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}"))
+                conn.execute(text(f"CREATE TRIGGER {fts_table}_{suffix} {trigger}"))
+            if rebuild:
+                conn.execute(text(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')"))
+
+def rebuild_search_index(db: Session):
+    # Indeks asosiy jadvallardan (ko'rinish orqali) qaytadan quriladi
+    for fts_table, _, _ in FTS_TABLES.values():
+        db.execute(text(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')"))
+    db.commit()
+
+def build_match_query(query: str):
+    # Har bir so'zni tirnoqqa olib, FTS5 sintaksisidagi maxsus belgilardan himoyalaymiz
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+def fts_filter(model, term: str):
+    fts_table = next(fts for fts, _, fts_model in FTS_TABLES.values() if fts_model is model)
+    match = build_match_query(term)
+    if match is None:
+        return model.id.in_([])
+    return model.id.in_(
+        text(f"SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH :match").bindparams(match=match)
+    )
+
+def admin_search_query(stmt, model, term: str):
+    # sqladmin qidiruv oynasi uchun LIKE o'rniga FTS indeksidan foydalanish
+    expressions = [fts_filter(model, term)]
+    if term.isdigit() and hasattr(model, "chat_id"):
+        expressions.append(model.chat_id == int(term))
+    return stmt.filter(or_(*expressions))
+
+def search_content(db: Session, current_user: User, query: str, scopes=None, limit: int = 20):
+    match = build_match_query(query)
+    if match is None:
+        return []
+    scopes = scopes or SEARCH_SCOPES
+    results = []
+
+    if "messages" in scopes:
+        sql = ("SELECT m.id, m.chat_id, snippet(messages_fts, 0, '[', ']', '…', 12) AS snippet, messages_fts.rank AS rank "
+               "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+               "JOIN chats c ON c.id = m.chat_id "
+               "WHERE messages_fts MATCH :match")
+        params = {"match": match, "limit": limit}
+        # Adminlardan boshqa foydalanuvchilar faqat o'z suhbatlarida qidiradi
+        if current_user.role != "admin":
+            sql += " AND c.user_id = :user_id"
+            params["user_id"] = current_user.id
+        for row in db.execute(text(sql + " ORDER BY rank LIMIT :limit"), params):
+            results.append({"type": "message", "id": row.id, "title": f"Chat #{row.chat_id}",
+                            "snippet": row.snippet, "rank": row.rank})
+
+    grade_filter = ""
+    params = {"match": match, "limit": limit}
+    if current_user.role == "student":
+        grade_filter = " AND t.grade = :grade"
+        params["grade"] = current_user.grade
+
+    if "subjects" in scopes:
+        sql = ("SELECT t.id, COALESCE(t.name, '') AS title, snippet(subjects_fts, -1, '[', ']', '…', 12) AS snippet, subjects_fts.rank AS rank "
+               "FROM subjects_fts JOIN subjects t ON t.id = subjects_fts.rowid "
+               "WHERE subjects_fts MATCH :match" + grade_filter + " ORDER BY rank LIMIT :limit")
+        for row in db.execute(text(sql), params):
+            results.append({"type": "subject", "id": row.id, "title": row.title,
+                            "snippet": row.snippet, "rank": row.rank})
+
+    if "books" in scopes:
+        sql = ("SELECT t.id, COALESCE(t.title, '') AS title, snippet(schedule_and_books_fts, -1, '[', ']', '…', 12) AS snippet, "
+               "schedule_and_books_fts.rank AS rank "
+               "FROM schedule_and_books_fts JOIN schedule_and_books t ON t.id = schedule_and_books_fts.rowid "
+               "WHERE schedule_and_books_fts MATCH :match" + grade_filter + " ORDER BY rank LIMIT :limit")
+        for row in db.execute(text(sql), params):
+            results.append({"type": "book", "id": row.id, "title": row.title,
+                            "snippet": row.snippet, "rank": row.rank})
+
+    results.sort(key=lambda result: result["rank"])
+    return results[:limit]
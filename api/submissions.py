@@ -0,0 +1,95 @@
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import User, Subject, Test, TestResult, StudentProgress
+from grading import grade_test_results
+
+# Bitta so'rovdagi elementlar soni chegarasi
+BATCH_MAX_ITEMS = 1000
+
+def _summary(statuses):
+    counts = {"created": 0, "updated": 0, "error": 0}
+    for status in statuses:
+        counts[status["status"]] += 1
+    return {"created": counts["created"], "updated": counts["updated"], "errors": counts["error"], "items": statuses}
+
+def _existing_ids(db: Session, column, ids):
+    return {value for (value,) in db.query(column).filter(column.in_(ids))} if ids else set()
+
+def submit_test_results(db: Session, items):
+    # Barcha elementlar bitta o'tishda tekshiriladi va bitta tranzaksiyada saqlanadi
+    users = _existing_ids(db, User.id, {item.user_id for item in items})
+    tests = _existing_ids(db, Test.id, {item.test_id for item in items})
+
+    statuses, rows = [], []
+    for index, item in enumerate(items):
+        status = {"index": index, "status": "created"}
+        if item.user_id not in users:
+            status.update(status="error", error="Foydalanuvchi topilmadi")
+        elif item.test_id not in tests:
+            status.update(status="error", error="Test topilmadi")
+        else:
+            row = TestResult(user_id=item.user_id, test_id=item.test_id, result=item.result)
+            db.add(row)
+            rows.append((status, row))
+        statuses.append(status)
+
+    # Bir testning barcha javoblari bitta matritsa bilan baholanadi
+    grade_test_results(db, [row for _, row in rows])
+    db.flush()
+    for status, row in rows:
+        status["id"] = row.id
+    db.commit()
+    return _summary(statuses)
+
+def _upsert_progress(db: Session, items):
+    users = _existing_ids(db, User.id, {item.user_id for item in items})
+    subject_ids = {item.subject_id for item in items}
+    existing = {}
+    if users:
+        existing = {(row.user_id, row.subject_id): row for row in
+                    db.query(StudentProgress).filter(StudentProgress.user_id.in_(users), StudentProgress.subject_id.in_(subject_ids))}
+    subjects = _existing_ids(db, Subject.id, subject_ids)
+
+    now = datetime.utcnow()
+    statuses, rows, seen = [], [], set()
+    for index, item in enumerate(items):
+        key = (item.user_id, item.subject_id)
+        status = {"index": index}
+        if item.user_id not in users:
+            status.update(status="error", error="O'quvchi topilmadi")
+        elif item.subject_id not in subjects:
+            status.update(status="error", error="Fan topilmadi")
+        elif not 0 <= item.progress <= 100:
+            status.update(status="error", error="Progress 0 va 100 oralig'ida bo'lishi kerak")
+        elif key in seen:
+            status.update(status="error", error="Shu o'quvchi va fan so'rovda takrorlangan")
+        else:
+            seen.add(key)
+            row = existing.get(key)
+            if row is None:
+                row = StudentProgress(user_id=item.user_id, subject_id=item.subject_id, progress=item.progress, last_updated=now)
+                db.add(row)
+                status["status"] = "created"
+            else:
+                row.progress = item.progress
+                row.last_updated = now
+                status["status"] = "updated"
+            rows.append((status, row))
+        statuses.append(status)
+
+    # Bitta flush: analitika agregatlari ham bitta executemany bilan yangilanadi
+    db.flush()
+    for status, row in rows:
+        status["id"] = row.id
+    db.commit()
+    return _summary(statuses)
+
+def upsert_student_progress(db: Session, items):
+    # (user_id, subject_id) unikal indeksi parallel yozuvlarni to'xtatadi; bunda yangi holat bilan qayta urinamiz
+    try:
+        return _upsert_progress(db, items)
+    except IntegrityError:
+        db.rollback()
+        return _upsert_progress(db, items)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modullar api/ papkasidan to'g'ridan-to'g'ri import qilinadi (main.py kabi)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+import cache as cache_module
+
+fakeredis = pytest.importorskip("fakeredis")
+
+@pytest.fixture
+def pair(monkeypatch):
+    # Bitta (soxta) Redis serveriga ulangan ikki jarayon keshi
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(cache_module.Cache, "connect", lambda self: fakeredis.FakeRedis(server=server))
+    first = cache_module.Cache(url="redis://test", prefix="test:")
+    second = cache_module.Cache(url="redis://test", prefix="test:")
+    assert first.shared is not None and second.shared is not None
+    time.sleep(0.2)
+    return first, second
+
+def _eventually(check):
+    deadline = time.monotonic() + 2
+    while not check():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+def _set(cache, key, value):
+    return cache.set(key, value, 60, version=cache.version(key))
+
+def test_invalidation_reaches_other_instance(pair):
+    first, second = pair
+    _set(first, "context:1", {"v": 1})
+    _set(first, "context:2", {"v": 2})
+    assert second.get("context:1") == {"v": 1}
+    assert second.local.get("context:1") is not None
+    first.delete("context:1")
+    _eventually(lambda: second.local.get("context:1") is None)
+    assert second.get("context:1") is None
+    first.delete(prefixes=("context:",))
+    _eventually(lambda: second.get("context:2") is None)
+
+def test_stale_write_rejected_across_instances(pair):
+    first, second = pair
+    version = second.version("context:7")
+    first.delete("context:7")
+    second.set("context:7", "eski", 60, version=version)
+    assert first.get("context:7") is None and second.get("context:7") is None
+    version = second.version("context:7")
+    first.delete(prefixes=("context:",))
+    second.set("context:7", "eski", 60, version=version)
+    assert second.get("context:7") is None
+    _set(second, "context:7", "yangi")
+    assert first.get("context:7") == "yangi"
+
+def test_stale_write_rejected_locally():
+    cache = cache_module.Cache(url="", workers=1)
+    version = cache.version("principal:a@b.uz")
+    cache.delete("principal:a@b.uz")
+    cache.set("principal:a@b.uz", {"role": "admin"}, 60, version=version)
+    assert cache.get("principal:a@b.uz") is None
+    _set(cache, "principal:a@b.uz", {"role": "student"})
+    assert cache.get("principal:a@b.uz") == {"role": "student"}
+
+def test_unknown_version_is_not_cached(pair):
+    first, _ = pair
+    first.set("context:3", 1, 60, version=None)
+    assert first.get("context:3") is None
+
+def test_disabled_without_shared_tier_for_many_workers():
+    cache = cache_module.Cache(url="", workers=4)
+    _set(cache, "context:1", 1)
+    assert cache.get("context:1") is None
@@ -0,0 +1,31 @@
+import pytest
+
+from grading import Grader, public_spec
+
+def _spec(options, **key):
+    return {"questions": [{"text": "2 + 2 = ?", "subject": "Matematika", "options": options, **key}]}
+
+def test_numeric_option_text_is_not_read_as_position():
+    grader = Grader(_spec(["2", "4", "6", "8"], answer="4"))
+    assert grader.grade(["B"])["baholash"]["foiz"] == 100.0
+    assert grader.grade(["D"])["baholash"]["foiz"] == 0.0
+    assert grader.grade(["4"])["baholash"]["foiz"] == 100.0
+
+def test_letter_option_text_key():
+    # Kalit "A" — to'rtinchi variantning matni; o'quvchi uni "D)" belgisi bilan tanlaydi
+    grader = Grader(_spec(["D", "C", "B", "A"], answer="A"))
+    assert grader.grade(["D"])["baholash"]["foiz"] == 100.0
+    assert grader.grade(["A"])["baholash"]["foiz"] == 0.0
+
+def test_letter_and_position_keys_still_work():
+    assert Grader(_spec(["uch", "to'rt"], answer="B")).grade("1-B")["baholash"]["foiz"] == 100.0
+    assert Grader(_spec(["uch", "to'rt"], answer="2")).grade(["B"])["baholash"]["foiz"] == 100.0
+
+def test_answer_index():
+    spec = _spec(["2", "4", "6", "8"], answer_index=1)
+    grader = Grader(spec)
+    assert grader.grade(["B"])["baholash"]["foiz"] == 100.0
+    assert grader.grade(["D"])["baholash"]["foiz"] == 0.0
+    assert "answer_index" not in public_spec(spec)["questions"][0]
+    with pytest.raises(ValueError):
+        Grader(_spec(["2", "4"], answer_index=2))
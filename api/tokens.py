@@ -0,0 +1,34 @@
+import re
+import math
+
+# Oflayn token taxmini: har bir tinish belgisi alohida token, so'zlar esa yozuvga qarab bo'linadi.
+# Ingliz matni uchun ~4 belgi/token o'zbekcha (lotin) so'zlar, raqamlar va JSON kalitlarini kam sanaydi;
+# kirill va boshqa ASCII bo'lmagan harflar yanada kichik bo'laklarga bo'linadi. Nisbatlar ataylab
+# yuqoriga (ko'proq tokenga) og'ishgan: chegaradan oshib ketgandan ko'ra ortiqcha qisqartirish xavfsizroq
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+ASCII_CHARS_PER_TOKEN = 3
+NON_ASCII_CHARS_PER_TOKEN = 2
+
+def _piece_tokens(piece):
+    if not (piece[0].isalnum() or piece[0] == "_"):
+        return 1
+    if piece.isascii():
+        return math.ceil(len(piece) / ASCII_CHARS_PER_TOKEN)
+    ascii_chars = len(piece.encode("ascii", "ignore"))
+    return math.ceil(ascii_chars / ASCII_CHARS_PER_TOKEN + (len(piece) - ascii_chars) / NON_ASCII_CHARS_PER_TOKEN)
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return sum(_piece_tokens(piece) for piece in TOKEN_PATTERN.findall(text))
+
+def truncate_tokens(text, max_tokens):
+    # Matn taxminan max_tokens tokenga sig'adigan joyda, token chegarasida kesiladi
+    if max_tokens <= 0 or not text:
+        return ""
+    used = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import random
+import secrets
+import asyncio
+import argparse
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+from sqlalchemy import event
+
+from database import engine
+
+# Iz (trace) sozlamalari: sekin so'rovlar to'liq yoziladi, qolganlari TRACE_SAMPLE_RATE ehtimoli bilan
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "jsonl")
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", "1000"))
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+
+current_trace = ContextVar("current_trace", default=None)
+_export_lock = threading.Lock()
+
+class Trace:
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+        self.stack = []
+
+class Span:
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start = time.time()
+        self.end = None
+        self.status = "ok"
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": (self.end - self.start) * 1000,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+def start_span(name, **attributes):
+    # Faol iz bo'lmasa (fon vazifalari, CLI) None qaytariladi
+    trace = current_trace.get()
+    if trace is None:
+        return None
+    parent_id = trace.stack[-1].span_id if trace.stack else None
+    span = Span(trace, name, parent_id, attributes)
+    trace.stack.append(span)
+    return span
+
+def end_span(span, error=None):
+    if span is None:
+        return
+    span.end = time.time()
+    if error is not None:
+        span.status = "error"
+        span.attributes["error"] = str(error)
+    trace = span.trace
+    if span in trace.stack:
+        trace.stack.remove(span)
+    trace.spans.append(span)
+
+@contextmanager
+def span(name, **attributes):
+    current = start_span(name, **attributes)
+    try:
+        yield current or _NoopSpan()
+    except BaseException as e:
+        end_span(current, e)
+        raise
+    else:
+        end_span(current)
+
+def traced(name):
+    # Funksiyani span bilan o'rash; functools.wraps FastAPI bog'liqlik imzosini saqlaydi
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def export_trace(trace):
+    if TRACE_EXPORTER == "none" or not trace.spans:
+        return
+    lines = "".join(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n" for span in trace.spans)
+    with _export_lock:
+        if TRACE_EXPORTER == "console":
+            sys.stderr.write(lines)
+        else:
+            # Har bir iz bitta yozuv bilan qo'shiladi, shuning uchun gunicorn ishchilari satrlarni aralashtirmaydi
+            fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, lines.encode("utf-8"))
+            finally:
+                os.close(fd)
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("trace_spans", []).append(start_span("db.query", statement=statement[:200]))
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    end_span(conn.info["trace_spans"].pop())
+
+@event.listens_for(engine, "handle_error")
+def _handle_error(exception_context):
+    spans = exception_context.connection.info.get("trace_spans") if exception_context.connection else None
+    if spans:
+        end_span(spans.pop(), exception_context.original_exception)
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        token = current_trace.set(trace)
+        root = start_span(f"{scope['method']} {scope['path']}", method=scope["method"])
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute("status", message["status"])
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
+            end_span(root, error)
+            current_trace.reset(token)
+            duration_ms = (root.end - root.start) * 1000
+            if duration_ms >= TRACE_SLOW_MS or random.random() < TRACE_SAMPLE_RATE:
+                export_trace(trace)
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summarize(path, name_filter=None):
+    traces = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                traces[record["trace_id"]].append(record)
+
+    # Ildiz span nomi bo'yicha guruhlash, keyin har bir bosqichning ulushini hisoblash
+    groups = defaultdict(lambda: {"roots": [], "phases": defaultdict(list)})
+    for spans in traces.values():
+        root = next((span for span in spans if span["parent_id"] is None), None)
+        if root is None or (name_filter and name_filter not in root["name"]):
+            continue
+        group = groups[root["name"]]
+        group["roots"].append(root["duration_ms"])
+        totals = defaultdict(float)
+        for span in spans:
+            if span["parent_id"] == root["span_id"]:
+                totals[span["name"]] += span["duration_ms"]
+        for name, total in totals.items():
+            group["phases"][name].append(total)
+
+    for name, group in sorted(groups.items(), key=lambda item: -sum(item[1]["roots"])):
+        roots = group["roots"]
+        print(f"{name}: {len(roots)} ta iz, p50 {_percentile(roots, 0.5):.1f} ms, "
+              f"p95 {_percentile(roots, 0.95):.1f} ms, max {max(roots):.1f} ms")
+        total_root = sum(roots)
+        for phase, durations in sorted(group["phases"].items(), key=lambda item: -sum(item[1])):
+            print(f"    {phase:<40} o'rtacha {sum(durations) / len(durations):8.1f} ms  "
+                  f"p95 {_percentile(durations, 0.95):8.1f} ms  ulush {100 * sum(durations) / total_root:5.1f}%")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Eksport qilingan izlar bo'yicha bosqichlar hisobotini chiqarish")
+    parser.add_argument("file", nargs="?", default=TRACE_FILE)
+    parser.add_argument("--name", help="Faqat shu matnni o'z ichiga olgan ildiz spanlar (masalan /ai_assistant)")
+    args = parser.parse_args()
+    summarize(args.file, args.name)
@@ -1,17 +1,30 @@
 import os
-from datetime import datetime, timedelta
+import hashlib
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from typing import Optional
 from jose import jwt, JWTError
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from database import SessionLocal, User, Test, PsychologicalAssessment, StudentProgress, Subject, TestResult, StudentReport, Chat, Message
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, undefer, object_session
+from database import SessionLocal, User, Test, PsychologicalAssessment, StudentProgress, Subject, TestResult, StudentReport, Chat, Message, BookSection
 from schemas import TokenData
+from reports import get_latest_reports
+from metrics import PASSWORD_HASH_DURATION
+from tracing import traced
+from grading import grade_test_results
+from cache import cache, invalidate_on_commit
+from budget import SECTION_BUDGETS, allocate_shares, curriculum_overhead
+from tokens import estimate_tokens, truncate_tokens
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+PRINCIPAL_CACHE_TTL = int(os.environ.get("PRINCIPAL_CACHE_TTL", "300"))
+PRINCIPAL_PREFIX = "principal:"
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -24,10 +37,12 @@ def get_db():
         db.close()
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    with PASSWORD_HASH_DURATION.labels("verify").time():
+        return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    with PASSWORD_HASH_DURATION.labels("hash").time():
+        return pwd_context.hash(password)
 
 def authenticate_user(db: Session, email: str, password: str):
     user = db.query(User).filter(User.email == email).first()
@@ -45,6 +60,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+@traced("auth.get_current_user")
 async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -64,18 +80,135 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         raise credentials_exception
     return user
 
+def get_principal(db: Session, email: str):
+    # Token egasining identifikatori va roli (ORM obyektisiz); barcha ishchilar uchun umumiy keshda saqlanadi
+    key = f"{PRINCIPAL_PREFIX}{email}"
+    principal = cache.get(key)
+    if principal is None:
+        version = cache.version(key)
+        row = db.query(User.id, User.role).filter(User.email == email).first()
+        if row is None:
+            return None
+        principal = cache.set(key, {"id": row.id, "role": row.role}, PRINCIPAL_CACHE_TTL, version=version)
+    return principal
+
+def _invalidate_principal(target, email):
+    session = object_session(target)
+    if session is not None and email:
+        invalidate_on_commit(session, f"{PRINCIPAL_PREFIX}{email}")
+
+for _name in ("after_insert", "after_update", "after_delete"):
+    event.listen(User, _name, lambda mapper, connection, target: _invalidate_principal(target, target.email))
+
+# Email o'zgarsa eski kalit ham tozalanadi (active_history eski qiymatni commit'dan keyin ham yuklaydi)
+@event.listens_for(User.email, "set", active_history=True)
+def _email_changed(target, value, oldvalue, initiator):
+    if oldvalue != value and isinstance(oldvalue, str):
+        _invalidate_principal(target, oldvalue)
+
+def compute_etag(*parts):
+    return '"' + hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20] + '"'
+
+def _opaque_tag(tag):
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def etag_matches(request: Request, etag: str):
+    # If-None-Match kuchsiz solishtiriladi: siqilgan javobning W/"..." tegi asl ETag'ga mos keladi
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or _opaque_tag(etag) in [_opaque_tag(tag) for tag in header.split(",")]
+
+class ConditionalGet:
+    # O'qish marshrutlari uchun ETag/Last-Modified bog'liqligi: versiya o'zgarmagan bo'lsa 304 qaytariladi.
+    # last_modified faqat monoton (hech qachon orqaga qaytmaydigan) vaqt uchun beriladi, masalan oxirgi hisobot
+    # generatsiyasi. Ro'yxatlarda max(updated_at) qator o'chirilganda o'zgarmaydi, ular faqat ETag bilan tekshiriladi
+    def __init__(self, request: Request, response: Response):
+        self.request = request
+        self.response = response
+
+    def check(self, *version, last_modified: Optional[datetime] = None):
+        etag = compute_etag(self.request.url.path, *version)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        # Shu soniya ichida yana o'zgarishi mumkin bo'lgan vaqt yuborilmaydi: sarlavha soniyagacha aniq
+        if last_modified is not None and last_modified < datetime.utcnow() - timedelta(seconds=1):
+            headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+        if self.request.headers.get("if-none-match") is not None:
+            not_modified = etag_matches(self.request, etag)
+        else:
+            not_modified = self._not_modified_since(last_modified)
+        if not_modified:
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        self.response.headers.update(headers)
+
+    def _not_modified_since(self, last_modified):
+        header = self.request.headers.get("if-modified-since")
+        if not header or last_modified is None:
+            return False
+        try:
+            since = parsedate_to_datetime(header)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        return last_modified.replace(microsecond=0) <= since
+
 def calculate_age(birth_date):
     today = datetime.today()
     return today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
 
+def get_curriculum(db: Session, grade, budget: int = SECTION_BUDGETS["curriculum"]):
+    # O'quv materiali darslik bo'limlaridan (BookSection) yig'iladi: har bir fanga byudjetdan teng ulush ajratiladi
+    # va bo'limlar token_count bo'yicha tartib bilan, butunligicha tanlanadi. Faqat tanlangan bo'limlar matni o'qiladi.
+    # Bo'limlari yo'q fanlar uchun Subject.book_text ishlatiladi (ulushidan oshsa kesiladi)
+    subjects = db.query(Subject).filter(Subject.grade == grade).all()
+    sections = {}
+    rows = (db.query(BookSection.id, BookSection.subject_id, BookSection.heading, BookSection.token_count)
+            .filter(BookSection.subject_id.in_([subject.id for subject in subjects]))
+            .order_by(BookSection.subject_id, BookSection.source, BookSection.position))
+    for row in rows:
+        sections.setdefault(row.subject_id, []).append((row.id, (row.token_count or 0) + estimate_tokens(row.heading or "")))
+    fallback = dict(db.query(Subject.id, Subject.book_text)
+                    .filter(Subject.id.in_([subject.id for subject in subjects if subject.id not in sections])))
+
+    curriculum = [{"name": subject.name, "description": subject.description, "book_text": "", "video_link": subject.video_link} for subject in subjects]
+    sizes = {subject.id: sum(size for _, size in sections[subject.id]) if subject.id in sections else estimate_tokens(fallback.get(subject.id) or "")
+             for subject in subjects}
+    shares = allocate_shares(sizes, budget - curriculum_overhead(curriculum))
+
+    chosen = {}
+    for subject_id, subject_sections in sections.items():
+        used = 0
+        for section_id, size in subject_sections:
+            if used + size <= shares.get(subject_id, 0):
+                chosen[section_id] = subject_id
+                used += size
+    texts = {}
+    if chosen:
+        rows = (db.query(BookSection.id, BookSection.heading, BookSection.content)
+                .filter(BookSection.id.in_(list(chosen)))
+                .order_by(BookSection.subject_id, BookSection.source, BookSection.position))
+        for row in rows:
+            texts.setdefault(chosen[row.id], []).append(f"{row.heading}\n{row.content}" if row.heading else row.content)
+
+    for subject, entry in zip(subjects, curriculum):
+        if subject.id in sections:
+            entry["book_text"] = "\n\n".join(texts.get(subject.id, []))
+        else:
+            text = fallback.get(subject.id) or ""
+            entry["book_text"] = text if sizes[subject.id] <= shares.get(subject.id, 0) else truncate_tokens(text, shares.get(subject.id, 0))
+    return curriculum
+
+@traced("context.get_student_context")
 def get_student_context(student_id: int, db: Session):
     student = db.query(User).filter(User.id == student_id).first()
     tests = db.query(Test).filter(Test.user_id == student_id).all()
     psych_assessments = db.query(PsychologicalAssessment).filter(PsychologicalAssessment.user_id == student_id).all()
     progress = db.query(StudentProgress).filter(StudentProgress.user_id == student_id).all()
-    subjects = db.query(Subject).filter(Subject.grade == student.grade).all()
     test_results = db.query(TestResult).filter(TestResult.user_id == student_id).all()
-    reports = db.query(StudentReport).filter(StudentReport.user_id == student_id).all()
+    reports = get_latest_reports(db, student)
     
     context = {
         "student_info": {
@@ -86,14 +219,17 @@ def get_student_context(student_id: int, db: Session):
         },
         "test_results": [{"id": result.id, "test_id": result.test_id, "result": result.result} for result in test_results],
         "psychological_assessments": [assessment.results for assessment in psych_assessments],
-        "progress": {prog.subject_id: prog.progress for prog in progress},
-        "subjects": [{"name": subject.name, "description": subject.description, "book_text": subject.book_text, "video_link": subject.video_link} for subject in subjects],
+        # Kalitlar satr: JSON'da baribir satrga aylanadi va sort_keys aralash turlarda xato bermaydi.
+        # Fani ko'rsatilmagan eski yozuvlar tashlanadi
+        "progress": {str(prog.subject_id): prog.progress for prog in progress if prog.subject_id is not None},
+        "subjects": get_curriculum(db, student.grade),
         "reports": [{"subject": report.subject, "percentage": report.percentage, "grade": report.grade} for report in reports]
     }
     return context
 
+@traced("context.get_chat_history")
 def get_chat_history(chat_id: int, db: Session):
-    messages = db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.timestamp.asc()).all()
+    messages = db.query(Message).options(undefer(Message.content)).filter(Message.chat_id == chat_id).order_by(Message.timestamp.asc()).all()
     return [{"role": msg.role, "content": msg.content} for msg in messages]
 
 def create_new_chat(user_id: int, db: Session):
@@ -108,3 +244,59 @@ def save_test(user_id: int, test_content: str, db: Session):
     new_test = Test(user_id=user_id, type=test_type, questions=test_content)
     db.add(new_test)
     db.commit()
+
+def find_chat_turn(db: Session, chat_id: int, turn_id: Optional[str]):
+    # Shu identifikator bilan saqlangan assistent javobi (id, matn) yoki None
+    if not turn_id:
+        return None
+    row = (db.query(Message.id, Message.content)
+           .filter(Message.chat_id == chat_id, Message.role == "assistant", Message.turn_id == turn_id).first())
+    return (row.id, row.content) if row is not None else None
+
+def save_chat_turn(user_id: int, chat_id: int, query: str, response_text: str, db: Session, turn_id: Optional[str] = None):
+    # turn_id bilan saqlangan javob qayta yozilmaydi (masalan WebSocket uzilgandan keyin HTTP orqali takrorlangan so'rov)
+    saved = find_chat_turn(db, chat_id, turn_id)
+    if saved is not None:
+        return saved[0]
+
+    # Oldingi assistent xabari test bo'lgan bo'lsa, joriy so'rov o'sha testga javob hisoblanadi.
+    # U yangi xabarlar qo'shilishidan oldin olinadi
+    last_message = db.query(Message).filter(Message.chat_id == chat_id, Message.role == "assistant").order_by(Message.timestamp.desc()).first()
+
+    # Foydalanuvchi xabarini saqlash
+    db.add(Message(chat_id=chat_id, role="user", content=query, turn_id=turn_id))
+
+    # Assistent javobini saqlash
+    assistant_message = Message(chat_id=chat_id, role="assistant", content=response_text, turn_id=turn_id)
+    db.add(assistant_message)
+
+    if last_message:
+        if "Bilimlarni baholash testi" in last_message.content:
+            # Joriy so'rov foydalanuvchining akademik testga javobi
+            test = db.query(Test).filter(Test.user_id == user_id, Test.type == "academic").order_by(Test.timestamp.desc()).first()
+            if test:
+                test_result = TestResult(user_id=user_id, test_id=test.id, result={"answer": query})
+                grade_test_results(db, [test_result])
+                db.add(test_result)
+        elif "Psixologik test" in last_message.content:
+            # Joriy so'rov foydalanuvchining psixologik testga javobi
+            test = db.query(Test).filter(Test.user_id == user_id, Test.type == "psychological").order_by(Test.timestamp.desc()).first()
+            if test:
+                db.add(TestResult(user_id=user_id, test_id=test.id, result={"answer": query}))
+
+    # Joriy javobda yangi test borligini tekshirish
+    if "Bilimlarni baholash testi" in response_text:
+        db.add(Test(user_id=user_id, type="academic", questions=response_text))
+    elif "Psixologik test" in response_text:
+        db.add(Test(user_id=user_id, type="psychological", questions=response_text))
+
+    try:
+        db.commit()
+    except IntegrityError:
+        # Parallel so'rov shu javobni birinchi bo'lib saqladi
+        db.rollback()
+        saved = find_chat_turn(db, chat_id, turn_id)
+        if saved is None:
+            raise
+        return saved[0]
+    return assistant_message.id
@@ -0,0 +1,85 @@
+import os
+import time
+import logging
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from database import SessionLocal, User, Test, TestResult, StudentProgress, StudentReport, PsychologicalAssessment, Subject, BookSection
+from budget import PromptBudget
+from cache import cache, invalidate_on_commit
+from prompts import get_system_prompt
+from utils import get_student_context
+
+logger = logging.getLogger(__name__)
+
+# Tayyorlangan o'quvchi konteksti umumiy keshda (cache.py) saqlanadi: login bir ishchida bo'lsa ham,
+# birinchi xabarni qaysi ishchi qabul qilmasin kontekst tayyor bo'ladi
+CONTEXT_CACHE_TTL = int(os.environ.get("CONTEXT_CACHE_TTL", "300"))
+WARMUP_ON_LOGIN = os.environ.get("WARMUP_ON_LOGIN", "1") == "1"
+# Provayder prompt keshini to'ldirish pullik so'rov: login'da emas, faqat chat sahifasi ochilganda (/session/warmup)
+PROMPT_CACHE_PRIME = os.environ.get("PROMPT_CACHE_PRIME", "0") == "1"
+CONTEXT_PREFIX = "context:"
+
+_warming = set()
+_lock = threading.Lock()
+
+def _build(db: Session, user_id: int):
+    context = get_student_context(user_id, db)
+    context, _ = PromptBudget("warmup").fit(get_system_prompt(""), context)
+    return context
+
+def student_context(db: Session, user_id: int):
+    # Kesh bo'lsa darhol qaytariladi, aks holda kontekst shu yerda quriladi va keshlanadi
+    key = f"{CONTEXT_PREFIX}{user_id}"
+    context = cache.get(key)
+    if context is None:
+        version = cache.version(key)
+        context = cache.set(key, _build(db, user_id), CONTEXT_CACHE_TTL, version=version)
+    return context
+
+def warm_student_context(user_id: int):
+    # Fon vazifasi: bir foydalanuvchi uchun bir vaqtda faqat bitta tayyorlash ishlaydi
+    with _lock:
+        if user_id in _warming:
+            return None
+        _warming.add(user_id)
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        context = student_context(db, user_id)
+        logger.info(f"Foydalanuvchi {user_id} konteksti tayyorlandi ({time.perf_counter() - started:.3f} s)")
+        return context
+    except Exception as e:
+        logger.error(f"Kontekstni oldindan tayyorlashda xatolik: {str(e)}")
+        return None
+    finally:
+        db.close()
+        with _lock:
+            _warming.discard(user_id)
+
+# O'quvchi ma'lumotlari o'zgarsa kesh commit'dan keyin tozalanadi; fanlar yoki darslik bo'limlari
+# (get_curriculum) o'zgarsa — butunlay
+def _mark(target, user_id):
+    session = object_session(target)
+    if session is None:
+        return
+    if user_id is None:
+        invalidate_on_commit(session, prefixes=(CONTEXT_PREFIX,))
+    else:
+        invalidate_on_commit(session, f"{CONTEXT_PREFIX}{user_id}")
+
+for _model in (Test, TestResult, StudentProgress, StudentReport, PsychologicalAssessment):
+    for _name in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _name, lambda mapper, connection, target: _mark(target, target.user_id))
+
+for _name in ("after_insert", "after_update", "after_delete"):
+    event.listen(User, _name, lambda mapper, connection, target: _mark(target, target.id))
+    event.listen(Subject, _name, lambda mapper, connection, target: _mark(target, None))
+    event.listen(BookSection, _name, lambda mapper, connection, target: _mark(target, None))
+
+@event.listens_for(Session, "after_bulk_delete")
+def _bulk_deleted(delete_context):
+    # ingest bo'limlarni query.delete() bilan o'chiradi: bu mapper hodisalarini chaqirmaydi
+    if delete_context.mapper.class_ in (Subject, BookSection):
+        invalidate_on_commit(delete_context.session, prefixes=(CONTEXT_PREFIX,))
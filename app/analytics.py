@@ -0,0 +1,74 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import plotly.express as px
+
+MOVING_AVERAGE_WINDOW = 3
+# Har bir yangi hisobot generatsiyasi yangi kesh kaliti beradi: eskilari server yashaguncha to'planmasligi uchun
+# yozuvlar soni va yashash vaqti chegaralanadi (kesh barcha Streamlit sessiyalari uchun umumiy)
+REPORT_CACHE_ENTRIES = 256
+REPORT_CACHE_TTL = 3600
+
+def report_key(reports):
+    return tuple(sorted(report["id"] for report in reports))
+
+@st.cache_data(show_spinner=False, max_entries=REPORT_CACHE_ENTRIES, ttl=REPORT_CACHE_TTL)
+def build_report_history(report_ids, _reports):
+    # Kesh faqat hisobot id'lari bo'yicha kalitlanadi; _reports xeshlanmaydi
+    df = pd.DataFrame(_reports, columns=["id", "generation_id", "subject", "percentage", "grade", "created_at"])
+    df["created_at"] = pd.to_datetime(df["created_at"])
+    df["percentage"] = pd.to_numeric(df["percentage"], errors="coerce")
+    df["grade"] = pd.to_numeric(df["grade"], errors="coerce")
+    # Har bir generatsiya bitta surat; generatsiyasiz eski hisobotlar daqiqa bo'yicha guruhlanadi
+    generation_start = df.groupby("generation_id")["created_at"].transform("min")
+    df["snapshot"] = generation_start.fillna(df["created_at"].dt.floor("min"))
+
+    percentages = df.pivot_table(index="snapshot", columns="subject", values="percentage", aggfunc="mean").sort_index()
+    grades = df.pivot_table(index="snapshot", columns="subject", values="grade", aggfunc="mean").sort_index()
+    moving_average = percentages.rolling(MOVING_AVERAGE_WINDOW, min_periods=1).mean()
+
+    latest_grades = grades.ffill().iloc[-1]
+    latest = percentages.ffill().iloc[-1]
+    previous = percentages.ffill().shift(1).iloc[-1]
+
+    summary = pd.DataFrame({
+        "subject": percentages.columns,
+        "percentage": latest.to_numpy(),
+        "grade": latest_grades.to_numpy(),
+        "delta": (latest - previous).to_numpy(),
+        "moving_average": moving_average.ffill().iloc[-1].to_numpy(),
+        "trend": _trend_slopes(percentages.to_numpy()),
+    })
+    return percentages, summary
+
+def _trend_slopes(values):
+    # Har bir fan uchun chiziqli regressiya qiyaligi, NaN qiymatlar hisobga olinmaydi
+    mask = ~np.isnan(values)
+    x = np.arange(values.shape[0], dtype=float)[:, None]
+    counts = mask.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = np.where(mask, x, 0).sum(axis=0) / counts
+        y_mean = np.where(mask, values, 0).sum(axis=0) / counts
+        dx = np.where(mask, x - x_mean, 0)
+        dy = np.where(mask, values - y_mean, 0)
+        slopes = (dx * dy).sum(axis=0) / (dx * dx).sum(axis=0)
+    return np.where(counts > 1, slopes, np.nan)
+
+@st.cache_data(show_spinner=False, max_entries=REPORT_CACHE_ENTRIES, ttl=REPORT_CACHE_TTL)
+def build_report_figures(report_ids, language, _percentages, _summary, _lang):
+    fig_percentage = px.bar(_summary, x="subject", y="percentage",
+                            title=f"{_lang['subject_performance']} ({_lang['percentage']})")
+    fig_percentage.update_xaxes(title_text=_lang['subject'])
+    fig_percentage.update_yaxes(title_text=_lang['percentage'])
+
+    fig_grade = px.line(_summary, x="subject", y="grade",
+                        title=f"{_lang['subject_performance']} ({_lang['grade']})", markers=True)
+    fig_grade.update_xaxes(title_text=_lang['subject'])
+    fig_grade.update_yaxes(title_text=_lang['grade'])
+
+    history = _percentages.reset_index().melt(id_vars="snapshot", var_name="subject", value_name="percentage").dropna()
+    fig_history = px.line(history, x="snapshot", y="percentage", color="subject",
+                          title=_lang['progress_over_time'], markers=True)
+    fig_history.update_yaxes(title_text=_lang['percentage'])
+
+    return fig_percentage, fig_grade, fig_history
@@ -0,0 +1,157 @@
+import json
+import time
+import uuid
+import streamlit as st
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+# Uzilgan ulanish, vaqt chegarasi yoki buzilgan kadr
+SOCKET_ERRORS = (OSError, ValueError) + ((websocket.WebSocketException,) if websocket is not None else ())
+
+# FastAPI backend URL
+API_URL = "http://localhost:8000"
+WS_URL = API_URL.replace("http", "ws", 1)
+
+# (ulanish, o'qish) vaqt chegaralari, soniyalarda
+DEFAULT_TIMEOUT = (3.05, 30)
+STREAM_TIMEOUT = (3.05, 120)
+POOL_SIZE = 20
+CACHE_FRESH_SECONDS = 30
+# Server Idempotency-Key sarlavhasini qabul qiladigan POST marshrutlari
+IDEMPOTENT_PATHS = ("/ai_assistant", "/ai_hisobot", "/tests", "/test_results")
+
+@st.cache_resource
+def get_http_session():
+    # Barcha Streamlit sessiyalari uchun bitta keep-alive ulanishlar havzasi
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def auth_headers():
+    token = st.session_state.get("access_token")
+    if not token:
+        return {}
+    if st.session_state.get("auth_headers_token") != token:
+        st.session_state.auth_headers = {"Authorization": f"Bearer {token}"}
+        st.session_state.auth_headers_token = token
+    return st.session_state.auth_headers
+
+def _cache():
+    if "api_cache" not in st.session_state:
+        st.session_state.api_cache = {}
+    return st.session_state.api_cache
+
+def _idempotency_fingerprint(path, payload):
+    return path + "\0" + json.dumps(payload, sort_keys=True, default=str)
+
+def idempotency_key(path, payload=None):
+    # Bir xil so'rov (marshrut va tana) javobi olinguncha bir xil kalit bilan yuboriladi: Streamlit qayta
+    # ishga tushishi yoki takroriy bosish serverda ikkinchi marta bajarilmaydi, birinchi javob qaytariladi
+    keys = st.session_state.setdefault("idempotency_keys", {})
+    return keys.setdefault(_idempotency_fingerprint(path, payload), uuid.uuid4().hex)
+
+def forget_idempotency_key(path, payload=None):
+    # Javob to'liq olingandan keyin chaqiriladi: keyingi xuddi shunday so'rov yangi so'rov hisoblanadi
+    st.session_state.get("idempotency_keys", {}).pop(_idempotency_fingerprint(path, payload), None)
+
+def api_request(method, path, timeout=DEFAULT_TIMEOUT, **kwargs):
+    headers = {**auth_headers(), **kwargs.pop("headers", {})}
+    idempotent = method == "POST" and path.startswith(IDEMPOTENT_PATHS)
+    if idempotent and "Idempotency-Key" not in headers:
+        headers["Idempotency-Key"] = idempotency_key(path, kwargs.get("json"))
+    response = get_http_session().request(method, f"{API_URL}{path}", headers=headers, timeout=timeout, **kwargs)
+    if idempotent and not kwargs.get("stream"):
+        # Oqimli javobda kalitni chaqiruvchi oqim tugagach unutadi
+        forget_idempotency_key(path, kwargs.get("json"))
+    return response
+
+def cached_get(path, params=None):
+    # Idempotent GET javoblari sessiya davomida keshlanadi. CACHE_FRESH_SECONDS ichida so'rov
+    # umuman yuborilmaydi, keyin esa If-None-Match bilan tekshiriladi va 304 bo'lsa kesh qayta ishlatiladi
+    key = (path, tuple(sorted((params or {}).items())))
+    cache = _cache()
+    entry = cache.get(key)
+    if entry and time.monotonic() - entry["checked_at"] < CACHE_FRESH_SECONDS:
+        return entry["response"]
+
+    headers = {"If-None-Match": entry["etag"]} if entry and entry["etag"] else {}
+    response = api_request("GET", path, params=params, headers=headers)
+    if response.status_code == 304 and entry:
+        entry["checked_at"] = time.monotonic()
+        return entry["response"]
+    if response.status_code == 200:
+        cache[key] = {"response": response, "etag": response.headers.get("ETag"), "checked_at": time.monotonic()}
+    else:
+        cache.pop(key, None)
+    return response
+
+def invalidate(*prefixes):
+    cache = _cache()
+    if not prefixes:
+        cache.clear()
+        return
+    for key in [key for key in cache if key[0].startswith(prefixes)]:
+        del cache[key]
+
+def chat_socket():
+    # Streamlit sessiyasi uchun bitta WebSocket ulanishi (websocket-client o'rnatilgan bo'lsa).
+    # Token o'zgarsa yoki ulanish uzilsa qayta ochiladi; ochib bo'lmasa None va HTTP oqimi ishlatiladi
+    token = st.session_state.get("access_token")
+    if websocket is None or not token:
+        return None
+    ws = st.session_state.get("chat_socket")
+    if ws is not None and ws.connected and st.session_state.get("chat_socket_token") == token:
+        return ws
+    if ws is not None:
+        ws.close()
+    try:
+        ws = websocket.create_connection(f"{WS_URL}/ws/chat", timeout=STREAM_TIMEOUT[1])
+        ws.send(json.dumps({"type": "auth", "token": token}))
+        ready = json.loads(ws.recv())
+    except SOCKET_ERRORS:
+        return None
+    if ready.get("type") != "ready":
+        ws.close()
+        return None
+    st.session_state.chat_socket = ws
+    st.session_state.chat_socket_token = token
+    return ws
+
+def drop_chat_socket():
+    ws = st.session_state.pop("chat_socket", None)
+    if ws is not None:
+        try:
+            ws.close()
+        except SOCKET_ERRORS:
+            pass
+
+def socket_events(ws, turn_id):
+    # Berilgan javobning hodisalari; boshqa javoblarning kechikkan hodisalari o'tkazib yuboriladi
+    while True:
+        event = json.loads(ws.recv())
+        if event.get("id") != turn_id:
+            continue
+        yield event
+        if event["type"] in ("done", "cancelled", "error"):
+            return
+
+def cancel_pending_turn():
+    # Oldingi ishga tushirish javob tugamasdan uzilgan bo'lsa (foydalanuvchi boshqa tugmani bosgan),
+    # generatsiya serverda to'xtatiladi
+    turn_id = st.session_state.pop("pending_turn", None)
+    ws = st.session_state.get("chat_socket")
+    if turn_id is None or ws is None or not ws.connected:
+        return
+    try:
+        ws.send(json.dumps({"type": "cancel", "id": turn_id}))
+        for _ in socket_events(ws, turn_id):
+            pass
+    except SOCKET_ERRORS:
+        drop_chat_socket()
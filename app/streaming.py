@@ -0,0 +1,38 @@
+import codecs
+import time
+
+# Markdown qayta chizilishlari orasidagi minimal vaqt, soniyalarda
+RENDER_INTERVAL = 0.1
+CURSOR = "▌"
+
+class StreamRenderer:
+    def __init__(self, placeholder, interval=RENDER_INTERVAL):
+        self.placeholder = placeholder
+        self.interval = interval
+        # Bo'laklar chegarasida bo'lingan ko'p baytli belgilar keyingi bo'lak kelguncha saqlanadi
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.parts = []
+        self.last_render = 0.0
+
+    def feed(self, chunk):
+        text = self.decoder.decode(chunk)
+        if not text:
+            return
+        self.parts.append(text)
+        now = time.monotonic()
+        if now - self.last_render >= self.interval:
+            self.placeholder.markdown(self.text + CURSOR)
+            self.last_render = now
+
+    @property
+    def text(self):
+        if len(self.parts) > 1:
+            self.parts = ["".join(self.parts)]
+        return self.parts[0] if self.parts else ""
+
+    def finish(self):
+        tail = self.decoder.decode(b"", final=True)
+        if tail:
+            self.parts.append(tail)
+        self.placeholder.markdown(self.text)
+        return self.text
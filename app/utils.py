@@ -2,12 +2,10 @@ import streamlit as st
 import requests
 import json
 from datetime import datetime
-import pandas as pd
-import plotly.express as px
-import numpy as np
-
-# FastAPI backend URL
-API_URL = "http://localhost:8000"
+from analytics import report_key, build_report_history, build_report_figures
+from api_client import (api_request, cached_get, invalidate, chat_socket, drop_chat_socket, socket_events, cancel_pending_turn,
+                        idempotency_key, forget_idempotency_key, SOCKET_ERRORS, STREAM_TIMEOUT)
+from streaming import StreamRenderer
 
 # Language dictionaries
 languages = {
@@ -42,7 +40,11 @@ languages = {
         "percentage": "Percentage",
         "subject": "Subject",
         "report_table": "Report Table",
-        "grade_performance": "Grade Performance"
+        "grade_performance": "Grade Performance",
+        "progress_over_time": "Progress Over Time",
+        "change": "Change",
+        "moving_average": "Moving Average",
+        "trend": "Trend"
     },
     "uz": {
         "title": "IqroAI O'quv Yordamchisi",
@@ -75,7 +77,11 @@ languages = {
         "percentage": "Foiz",
         "subject": "Fan",
         "report_table": "Hisobot jadvali",
-        "grade_performance": "Baho ko'rsatkichi"
+        "grade_performance": "Baho ko'rsatkichi",
+        "progress_over_time": "Vaqt bo'yicha o'sish",
+        "change": "O'zgarish",
+        "moving_average": "O'rtacha (sirpanuvchi)",
+        "trend": "Tendensiya"
     },
     "ru": {
         "title": "Обучающий ассистент IqroAI",
@@ -108,7 +114,11 @@ languages = {
         "percentage": "Процент",
         "subject": "Предмет",
         "report_table": "Таблица отчета",
-        "grade_performance": "Показатель успеваемости"
+        "grade_performance": "Показатель успеваемости",
+        "progress_over_time": "Прогресс во времени",
+        "change": "Изменение",
+        "moving_average": "Скользящее среднее",
+        "trend": "Тренд"
     }
 }
 def set_page_config():
@@ -169,26 +179,27 @@ def initialize_session_state():
         st.session_state.language = "en"
 
 def login_user(email, password):
-    response = requests.post(f"{API_URL}/token", data={"username": email, "password": password})
+    response = api_request("POST", "/token", data={"username": email, "password": password})
     if response.status_code == 200:
         data = response.json()
+        invalidate()
         st.session_state.access_token = data["access_token"]
-        st.session_state.user_id = get_user_info()["id"]
+        # Token javobida id bo'lsa /users/me/ ga qo'shimcha so'rov yuborilmaydi
+        st.session_state.user_id = data.get("user_id") or get_user_info()["id"]
         st.success("Login successful!")
         st.rerun()
     else:
         st.error("Invalid credentials. Please try again.")
 
 def register_user(user_data):
-    response = requests.post(f"{API_URL}/register_student", json=user_data)
+    response = api_request("POST", "/register_student", json=user_data)
     if response.status_code == 200:
         st.success("Registration successful! Please log in.")
     else:
         st.error(f"Registration failed: {response.json()['detail']}")
 
 def get_user_info():
-    headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-    response = requests.get(f"{API_URL}/users/me/", headers=headers)
+    response = cached_get("/users/me/")
     if response.status_code == 200:
         return response.json()
     else:
@@ -196,8 +207,7 @@ def get_user_info():
         return None
 
 def get_user_chats():
-    headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-    response = requests.get(f"{API_URL}/chats", headers=headers)
+    response = cached_get("/chats")
     if response.status_code == 200:
         return response.json()
     else:
@@ -205,8 +215,7 @@ def get_user_chats():
         return []
 
 def get_chat_messages(chat_id):
-    headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-    response = requests.get(f"{API_URL}/chats/{chat_id}/messages", headers=headers)
+    response = cached_get(f"/chats/{chat_id}/messages")
     if response.status_code == 200:
         return response.json()
     else:
@@ -214,17 +223,17 @@ def get_chat_messages(chat_id):
         return []
 
 def update_chat_name(chat_id, new_name):
-    headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-    response = requests.put(f"{API_URL}/chats/{chat_id}", params={"name": new_name}, headers=headers)
+    response = api_request("PUT", f"/chats/{chat_id}", params={"name": new_name})
     if response.status_code == 200:
+        invalidate("/chats")
         st.success("Chat name updated successfully")
     else:
         st.error("Failed to update chat name")
 
 def delete_chat(chat_id):
-    headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-    response = requests.delete(f"{API_URL}/chats/{chat_id}", headers=headers)
+    response = api_request("DELETE", f"/chats/{chat_id}")
     if response.status_code == 200:
+        invalidate("/chats")
         st.success("Chat deleted successfully")
         st.session_state.chat_id = None
         st.session_state.messages = []
@@ -233,24 +242,31 @@ def delete_chat(chat_id):
         st.error("Failed to delete chat")
 
 def generate_report():
-    headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
     with st.spinner("Generating report... This may take a moment."):
-        response = requests.post(f"{API_URL}/ai_hisobot", headers=headers)
+        response = api_request("POST", "/ai_hisobot", timeout=STREAM_TIMEOUT)
     if response.status_code == 200:
+        invalidate("/student_reports")
         st.session_state.report_data = response.json()
         st.success("Report generated successfully!")
     else:
         st.error("Failed to generate report")
 
 def get_student_reports():
-    headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-    response = requests.get(f"{API_URL}/student_reports", headers=headers)
+    response = cached_get("/student_reports")
     if response.status_code == 200:
         return response.json()
     else:
         st.error("Failed to fetch student reports")
         return []
 
+def get_student_report_history():
+    response = cached_get("/student_reports/history")
+    if response.status_code == 200:
+        return response.json()
+    else:
+        st.error("Failed to fetch report history")
+        return []
+
 def language_selector():
     cols = st.columns(3)
     if cols[0].button("🇺🇿 O'zbek"):
@@ -263,8 +279,54 @@ def language_selector():
         st.session_state.language = "ru"
         st.rerun()
 
+def stream_over_socket(ws, renderer, data, turn_id):
+    # Javob WebSocket orqali oqimlanadi; yangi chat identifikatori "chat" hodisasida keladi.
+    # Ulanish uzilsa None qaytariladi va so'rov HTTP orqali shu turn id bilan takrorlanadi: server javobni
+    # saqlab ulgurgan bo'lsa, uni qaytaradi, aks holda qaytadan generatsiya qiladi (ikki marta saqlanmaydi)
+    st.session_state.pending_turn = turn_id
+    try:
+        ws.send(json.dumps({"type": "message", "id": turn_id, **data}))
+        for event in socket_events(ws, turn_id):
+            if event["type"] == "chat":
+                st.session_state.chat_id = event["chat_id"]
+            elif event["type"] == "delta":
+                renderer.feed(event["text"].encode("utf-8"))
+            elif event["type"] == "error":
+                st.error(event["detail"])
+    except SOCKET_ERRORS:
+        drop_chat_socket()
+        return None
+    finally:
+        st.session_state.pop("pending_turn", None)
+    return renderer.finish()
+
+def stream_over_http(renderer, data, turn_id):
+    # Idempotency-Key sifatida turn id yuboriladi: server javobni shu identifikator bilan saqlaydi
+    with api_request("POST", "/ai_assistant", json=data, stream=True, timeout=STREAM_TIMEOUT,
+                     headers={"Idempotency-Key": turn_id}) as r:
+        if r.status_code != 200:
+            st.error("Failed to get response from AI assistant")
+            full_response = ""
+        else:
+            for chunk in r.iter_content(chunk_size=None):
+                renderer.feed(chunk)
+            full_response = renderer.finish()
+    return full_response
+
+def warm_chat_session():
+    # Chat sahifasi birinchi marta ochilganda server kontekstni (va yoqilgan bo'lsa prompt keshini) tayyorlaydi
+    if st.session_state.get("chat_warmed"):
+        return
+    st.session_state.chat_warmed = True
+    try:
+        api_request("POST", "/session/warmup")
+    except requests.RequestException:
+        pass
+
 def display_chat_interface(lang):
     st.subheader(lang["chat"])
+    cancel_pending_turn()
+    warm_chat_session()
     
     with st.sidebar:
         st.subheader(lang["chat"])
@@ -303,29 +365,35 @@ def display_chat_interface(lang):
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            message_placeholder = st.empty()
-            full_response = ""
-            headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
+            placeholder = st.empty()
             data = {
                 "query": prompt,
                 "chat_id": st.session_state.chat_id
             }
-            with requests.post(f"{API_URL}/ai_assistant", json=data, headers=headers, stream=True) as r:
-                if r.status_code != 200:
-                    st.error("Failed to get response from AI assistant")
-                else:
-                    for chunk in r.iter_content(chunk_size=1024):
-                        if chunk:
-                            full_response += chunk.decode()
-                            message_placeholder.markdown(full_response + "▌")
-                    message_placeholder.markdown(full_response)
+            new_chat = not st.session_state.chat_id
+            # Bir xil so'rov javob olinguncha (Streamlit qayta ishga tushsa ham) bir xil turn id bilan yuboriladi
+            turn_id = idempotency_key("/ai_assistant", data)
+            ws = chat_socket()
+            full_response = stream_over_socket(ws, StreamRenderer(placeholder), data, turn_id) if ws is not None else None
+            try:
+                if full_response is None:
+                    # WebSocket yo'q yoki uzildi; uzilishdan oldin yaratilgan chat bo'lsa, javob o'sha chatga yoziladi
+                    full_response = stream_over_http(StreamRenderer(placeholder), {**data, "chat_id": st.session_state.chat_id}, turn_id)
+                # Javob to'liq olindi; oqim uzilgan bo'lsa (qayta ishga tushish) keyingi urinish shu kalit bilan boradi
+                forget_idempotency_key("/ai_assistant", data)
+            except requests.RequestException:
+                st.error("Failed to get response from AI assistant")
+                full_response = ""
         
         st.session_state.messages.append({"role": "assistant", "content": full_response})
+        invalidate("/chats")
 
-        if not st.session_state.chat_id:
-            st.session_state.chats = get_user_chats()
-            if st.session_state.chats:
-                st.session_state.chat_id = st.session_state.chats[-1]["id"]
+        if new_chat:
+            if not st.session_state.chat_id:
+                # HTTP oqimida yangi chat identifikatori ro'yxatdan aniqlanadi
+                st.session_state.chats = get_user_chats()
+                if st.session_state.chats:
+                    st.session_state.chat_id = st.session_state.chats[-1]["id"]
             st.rerun()
 
 def display_profile(lang):
@@ -355,9 +423,9 @@ def display_profile(lang):
                     "grade": grade,
                     "interests": interests
                 }
-                headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-                response = requests.put(f"{API_URL}/users/me", json=updated_data, headers=headers)
+                response = api_request("PUT", "/users/me", json=updated_data)
                 if response.status_code == 200:
+                    invalidate("/users/me")
                     st.success(lang["profile_updated"])
                 else:
                     st.error(f"{lang['profile_update_failed']}{response.json()['detail']}")
@@ -368,7 +436,7 @@ def display_reports(lang):
     if st.button(lang["generate_report"]):
         generate_report()
 
-    reports = get_student_reports()
+    reports = get_student_report_history()
     
     if reports:
         display_report_charts(reports, lang)
@@ -377,38 +445,21 @@ def display_reports(lang):
 
 def display_report_charts(report_data, lang):
     if report_data:
-        df = pd.DataFrame(report_data)
-        
-        # Assuming the original column names are 'subject', 'percentage', and 'grade'
-        subject_col = 'subject'
-        percentage_col = 'percentage'
-        grade_col = 'grade'
-        
-        # Check if the assumed column names exist, if not, try to find similar columns
-        if subject_col not in df.columns:
-            subject_col = df.columns[0]  # Assume the first column is the subject
-        if percentage_col not in df.columns:
-            percentage_col = df.select_dtypes(include=[np.number]).columns[0]  # Assume the first numeric column is percentage
-        if grade_col not in df.columns:
-            grade_col = df.select_dtypes(include=[np.number]).columns[-1]  # Assume the last numeric column is grade
-        
-        fig_percentage = px.bar(df, x=subject_col, y=percentage_col, 
-                                title=f"{lang['subject_performance']} ({lang['percentage']})")
-        fig_percentage.update_xaxes(title_text=lang['subject'])
-        fig_percentage.update_yaxes(title_text=lang['percentage'])
+        report_ids = report_key(report_data)
+        percentages, summary = build_report_history(report_ids, report_data)
+        fig_percentage, fig_grade, fig_history = build_report_figures(
+            report_ids, st.session_state.language, percentages, summary, lang)
+
         st.plotly_chart(fig_percentage, use_container_width=True)
-        
-        fig_grade = px.line(df, x=subject_col, y=grade_col, 
-                            title=f"{lang['subject_performance']} ({lang['grade']})", markers=True)
-        fig_grade.update_xaxes(title_text=lang['subject'])
-        fig_grade.update_yaxes(title_text=lang['grade'])
         st.plotly_chart(fig_grade, use_container_width=True)
-        
+        st.plotly_chart(fig_history, use_container_width=True)
+
         st.subheader(lang["report_table"])
-        
-        # Create a new DataFrame with translated column names for display
-        display_df = df[[subject_col, percentage_col, grade_col]].copy()
-        display_df.columns = [lang['subject'], lang['percentage'], lang['grade']]
+
+        # Tarjima qilingan ustun nomlari bilan jadval
+        display_df = summary[["subject", "percentage", "grade", "delta", "moving_average", "trend"]].round(2)
+        display_df.columns = [lang['subject'], lang['percentage'], lang['grade'],
+                              lang['change'], lang['moving_average'], lang['trend']]
         st.table(display_df)
     else:
         st.warning(lang["no_reports"])
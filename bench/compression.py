@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+
+# API modullari nisbiy import qilinadi (main.py kabi)
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+sys.path.insert(0, API_DIR)
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from compression import CompressionMiddleware, brotli
+
+def make_payloads():
+    book = "Kvadrat tenglama ax² + bx + c = 0 ko'rinishida yoziladi. Diskriminant D = b² - 4ac. " * 400
+    now = datetime.utcnow().isoformat()
+    return {
+        "/subjects": [{"name": f"Fan {i}", "grade": 10, "description": "Tavsif " * 30, "book_text": book,
+                       "video_link": None} for i in range(8)],
+        "/chats/1/messages": [{"id": i, "chat_id": 1, "role": "assistant" if i % 2 else "user",
+                               "content": "Javob matni, батафсил изоҳ bilan. " * 20, "timestamp": now} for i in range(300)],
+        "/student_reports/history": [{"id": i, "user_id": 1, "generation_id": i // 8, "subject": f"Fan {i % 8}",
+                                      "percentage": 50.0 + i % 40, "grade": 2 + i % 4, "created_at": now} for i in range(400)],
+    }
+
+def build_app(payloads, minimum_size):
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=minimum_size)
+    for path, payload in payloads.items():
+        app.add_api_route(path, lambda payload=payload: payload, methods=["GET"])
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Javoblarni siqish benchmarki: uzatilgan baytlar va sekin tarmoqdagi kechikish")
+    parser.add_argument("--bandwidth-kbit", type=float, default=1000, help="Tarmoq tezligi, kbit/s")
+    parser.add_argument("--rtt-ms", type=float, default=150, help="Aylanma kechikish, ms")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    payloads = make_payloads()
+    encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+    print(f"Tarmoq: {args.bandwidth_kbit:.0f} kbit/s, RTT {args.rtt_ms:.0f} ms")
+    with TestClient(build_app(payloads, minimum_size=1024)) as client:
+        for path in payloads:
+            print(path)
+            for encoding in encodings:
+                client.get(path, headers={"Accept-Encoding": encoding})
+                started = time.perf_counter()
+                for _ in range(args.repeat):
+                    response = client.get(path, headers={"Accept-Encoding": encoding})
+                server_ms = (time.perf_counter() - started) / args.repeat * 1000
+                # Haqiqiy tarmoqdagi baytlar: httpx javobni ochadi, shuning uchun Content-Length ishlatiladi
+                wire_bytes = int(response.headers["content-length"])
+                transfer_ms = wire_bytes * 8 / args.bandwidth_kbit
+                print(f"  {encoding:<9} {wire_bytes:>9} bayt  server {server_ms:7.2f} ms  "
+                      f"jami ~{server_ms + args.rtt_ms + transfer_ms:9.1f} ms")
+
+if __name__ == "__main__":
+    main()
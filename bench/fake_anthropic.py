@@ -0,0 +1,97 @@
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Anthropic Messages API'ning oflayn o'rinbosari: API ANTHROPIC_BASE_URL orqali shu serverga yo'naltiriladi.
+# Tokenlar deterministik, kechikishlar esa sozlanadi
+WORDS = ("Keling ", "bu ", "masalani ", "bosqichma-bosqich ", "ko'rib ", "chiqamiz. ", "Avval ", "berilganlarni ",
+         "yozamiz, ", "keyin ", "formulani ", "qo'llaymiz. ")
+REPORT_SUBJECTS = ("Matematika", "Fizika", "Ona tili", "Ingliz tili", "Tarix")
+
+class FakeAnthropicHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings = {"first_token_ms": 300, "token_ms": 15, "tokens": 120}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        input_tokens = len(json.dumps(body, ensure_ascii=False)) // 4
+        if body.get("stream"):
+            self._stream(input_tokens)
+        else:
+            self._create(input_tokens)
+
+    def _message(self, input_tokens, output_tokens, content):
+        return {"id": "msg_bench", "type": "message", "role": "assistant", "model": "claude-bench",
+                "content": content, "stop_reason": None if not content else "end_turn", "stop_sequence": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}}
+
+    def _create(self, input_tokens):
+        report = {"Hisobot": {name: {"foiz": 60 + 7 * index, "ball": 3 + index % 3} for index, name in enumerate(REPORT_SUBJECTS)},
+                  "Tahlil": "".join(WORDS)}
+        time.sleep((self.settings["first_token_ms"] + self.settings["token_ms"] * self.settings["tokens"]) / 1000)
+        payload = json.dumps(self._message(input_tokens, self.settings["tokens"],
+                                           [{"type": "text", "text": json.dumps(report, ensure_ascii=False)}])).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _event(self, name, data):
+        chunk = f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, input_tokens):
+        tokens = self.settings["tokens"]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        time.sleep(self.settings["first_token_ms"] / 1000)
+        self._event("message_start", {"type": "message_start", "message": self._message(input_tokens, 1, [])})
+        self._event("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        for index in range(tokens):
+            if index:
+                time.sleep(self.settings["token_ms"] / 1000)
+            self._event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                "delta": {"type": "text_delta", "text": WORDS[index % len(WORDS)]}})
+        self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self._event("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                      "usage": {"output_tokens": tokens}})
+        self._event("message_stop", {"type": "message_stop"})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def start_fake_anthropic(port=0, first_token_ms=300, token_ms=15, tokens=120):
+    # Server fon oqimida ishga tushadi; haqiqiy port server.server_address[1] da
+    handler = type("Handler", (FakeAnthropicHandler,), {
+        "settings": {"first_token_ms": first_token_ms, "token_ms": token_ms, "tokens": tokens}})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarklar uchun soxta Anthropic serveri")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--first-token-ms", type=int, default=300)
+    parser.add_argument("--token-ms", type=int, default=15)
+    parser.add_argument("--tokens", type=int, default=120)
+    args = parser.parse_args()
+
+    server = start_fake_anthropic(args.port, args.first_token_ms, args.token_ms, args.tokens)
+    print(f"ANTHROPIC_BASE_URL=http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+from fake_anthropic import start_fake_anthropic
+
+API_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+# Standart trafik aralashmasi (og'irliklar): kirish, chat, hisobot va ro'yxat ko'rinishlari
+DEFAULT_MIX = "login=1,chat=3,report=1,list=5"
+LIST_PATHS = ("/chats", "/subjects", "/users/me/", "/student_reports", "/student_reports/history")
+CHAT_ERROR_TEXT = "So'rovingizni qayta ishlashda xatolik yuz berdi."
+PASSWORD = "bench-parol"
+SLOW_QUERY_SECONDS = 0.1
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - {"login", "chat", "report", "list"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Noma'lum amallar: {', '.join(sorted(unknown))}")
+    return mix
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class Server:
+    # Har bir ishchi soni uchun alohida vaqtinchalik katalog, toza baza va gunicorn jarayoni
+    def __init__(self, workers, anthropic_url, env=None):
+        self.workers = workers
+        self.directory = tempfile.mkdtemp(prefix=f"iqroai-load-{workers}w-")
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = {**os.environ,
+                    "ANTHROPIC_BASE_URL": anthropic_url,
+                    "ANTHROPIC_API_KEY": "bench",
+                    "PROMETHEUS_MULTIPROC_DIR": os.path.join(self.directory, "prometheus"),
+                    "TRACE_EXPORTER": "none",
+                    **(env or {})}
+        os.makedirs(self.env["PROMETHEUS_MULTIPROC_DIR"])
+        self.process = None
+
+    def migrate(self):
+        subprocess.run([sys.executable, os.path.join(API_DIR, "migrations.py"), "schema"],
+                       cwd=self.directory, env=self.env, check=True, capture_output=True)
+
+    def launch(self):
+        self.log = open(os.path.join(self.directory, "gunicorn.log"), "wb")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", os.path.join(API_DIR, "gunicorn.config.py"),
+             "--workers", str(self.workers), "--bind", f"127.0.0.1:{self.port}", "--pythonpath", API_DIR, "main:app"],
+            cwd=self.directory, env=self.env, stdout=self.log, stderr=subprocess.STDOUT)
+
+    def start(self, timeout=60):
+        self.migrate()
+        self.launch()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn to'xtadi (kod {self.process.returncode})")
+            try:
+                if requests.get(f"{self.url}/metrics", timeout=5).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("gunicorn belgilangan vaqtda tayyor bo'lmadi")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+            self.log.close()
+
+    def seed(self, users, subjects_per_grade, grades=(9, 10, 11)):
+        session = requests.Session()
+        emails = []
+        for index in range(users + 1):
+            email = f"bench{index}@iqroai.uz"
+            response = session.post(f"{self.url}/register_student", json={
+                "first_name": f"O'quvchi{index}", "last_name": "Bench", "email": email, "password": PASSWORD,
+                "role": "student", "birth_date": "2010-01-01", "phone_number": f"+99890{index:07d}",
+                "grade": grades[index % len(grades)], "consent": "true", "interests": "matematika, fizika"})
+            response.raise_for_status()
+            emails.append(email)
+
+        # Birinchi foydalanuvchi admin qilinadi va fanlarni yaratadi
+        admin_email = emails.pop(0)
+        with sqlite3.connect(os.path.join(self.directory, "iqroai.db")) as connection:
+            connection.execute("UPDATE users SET role = 'admin' WHERE email = ?", (admin_email,))
+        headers = {"Authorization": f"Bearer {login(session, self.url, admin_email)}"}
+        book_text = "Kvadrat tenglama ax² + bx + c = 0 ko'rinishida yoziladi. Diskriminant D = b² - 4ac. " * 200
+        for grade in grades:
+            for index in range(subjects_per_grade):
+                session.post(f"{self.url}/subjects", headers=headers, json={
+                    "name": f"Fan {index}", "grade": grade, "description": "Fan tavsifi " * 10,
+                    "book_text": book_text}).raise_for_status()
+        return emails
+
+    def scrape_db_metrics(self):
+        text = requests.get(f"{self.url}/metrics", timeout=10).text
+        stats = {"queries": 0.0, "seconds": 0.0, "fast": 0.0, "lock_errors": 0.0}
+        for family in text_string_to_metric_families(text):
+            for sample in family.samples:
+                if sample.name == "iqroai_db_query_duration_seconds_count":
+                    stats["queries"] += sample.value
+                elif sample.name == "iqroai_db_query_duration_seconds_sum":
+                    stats["seconds"] += sample.value
+                elif (sample.name == "iqroai_db_query_duration_seconds_bucket"
+                      and float(sample.labels["le"]) == SLOW_QUERY_SECONDS):
+                    stats["fast"] += sample.value
+                elif sample.name == "iqroai_db_lock_errors_total":
+                    stats["lock_errors"] += sample.value
+        # SQLite'da blokirovka kutish busy_timeout ichida o'tadi, shuning uchun sekin so'rovlar kutishlarni ko'rsatadi
+        stats["slow"] = stats["queries"] - stats.pop("fast")
+        return stats
+
+def login(session, url, email):
+    response = session.post(f"{url}/token", data={"username": email, "password": PASSWORD}, timeout=60)
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+class VirtualUser:
+    def __init__(self, url, email, rng):
+        self.url = url
+        self.email = email
+        self.rng = rng
+        self.session = requests.Session()
+        self.headers = {"Authorization": f"Bearer {login(self.session, url, email)}"}
+        self.chat_ids = []
+
+    def login(self):
+        self.headers = {"Authorization": f"Bearer {login(self.session, self.url, self.email)}"}
+        return None
+
+    def chat(self):
+        # Yarmi yangi chat, yarmi mavjud chatning davomi
+        chat_id = self.rng.choice(self.chat_ids) if self.chat_ids and self.rng.random() < 0.5 else None
+        started = time.perf_counter()
+        first_chunk_at = None
+        body = []
+        with self.session.post(f"{self.url}/ai_assistant", headers=self.headers, stream=True, timeout=120,
+                               json={"query": "Kvadrat tenglamani qanday yechaman?", "chat_id": chat_id}) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=None):
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                body.append(chunk)
+        if CHAT_ERROR_TEXT in b"".join(body).decode("utf-8", errors="replace"):
+            raise RuntimeError("chat xatosi")
+        return first_chunk_at - started if first_chunk_at is not None else None
+
+    def report(self):
+        self.session.post(f"{self.url}/ai_hisobot", headers=self.headers, timeout=120).raise_for_status()
+        return None
+
+    def list(self):
+        path = self.rng.choice(LIST_PATHS)
+        response = self.session.get(f"{self.url}{path}", headers=self.headers, timeout=30)
+        response.raise_for_status()
+        if path == "/chats":
+            self.chat_ids = [chat["id"] for chat in response.json()]
+        return None
+
+def run_load(url, emails, mix, concurrency, duration, seed, snapshot=None):
+    # snapshot() o'lchanadigan oyna boshlanishida chaqiriladi (masalan DB hisoblagichlari) va natijasi qaytariladi
+    results = defaultdict(lambda: {"latencies": [], "first_chunk": [], "errors": 0})
+    lock = threading.Lock()
+    operations, weights = zip(*mix.items())
+    stop_at = None
+    login_errors = []
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        try:
+            user = VirtualUser(url, emails[index % len(emails)], rng)
+        except Exception as e:
+            user = None
+            with lock:
+                login_errors.append(f"{emails[index % len(emails)]}: {e}")
+        # bcrypt bilan kirish o'lchanadigan oynaga tushmasligi uchun hamma shu yerda kutadi
+        logged_in.wait()
+        if user is None:
+            return
+        ready.wait()
+        while time.monotonic() < stop_at:
+            operation = rng.choices(operations, weights)[0]
+            started = time.perf_counter()
+            try:
+                first_chunk = getattr(user, operation)()
+                error = False
+            except Exception:
+                first_chunk, error = None, True
+            elapsed = time.perf_counter() - started
+            with lock:
+                result = results[operation]
+                if error:
+                    result["errors"] += 1
+                else:
+                    result["latencies"].append(elapsed)
+                    if first_chunk is not None:
+                        result["first_chunk"].append(first_chunk)
+
+    logged_in = threading.Barrier(concurrency + 1)
+    ready = threading.Event()
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    # Vaqt barcha virtual foydalanuvchilar kirishni (muvaffaqiyatli yoki xato bilan) tugatgandan keyin hisoblanadi
+    logged_in.wait()
+    for error in login_errors:
+        print(f"  Kirish xatosi: {error}")
+    baseline = snapshot() if snapshot is not None else None
+    started = time.monotonic()
+    stop_at = started + duration
+    ready.set()
+    for thread in threads:
+        thread.join()
+    return dict(results), time.monotonic() - started, len(login_errors), baseline
+
+def metrics_delta(after, before):
+    # Hisoblagichlar faqat o'sadi: oyna uchun qiymat ikki o'lchov farqi
+    return {name: value - before.get(name, 0) for name, value in after.items()}
+
+def summarize(workers, results, elapsed, login_errors, db):
+    completed = sum(len(result["latencies"]) for result in results.values())
+    errors = sum(result["errors"] for result in results.values())
+    all_latencies = [latency for result in results.values() for latency in result["latencies"]]
+    summary = {"workers": workers, "throughput": completed / elapsed, "completed": completed, "errors": errors, "login_errors": login_errors,
+               "p50": percentile(all_latencies, 0.5), "p95": percentile(all_latencies, 0.95),
+               "p99": percentile(all_latencies, 0.99), "db": db, "operations": {}}
+    for operation, result in sorted(results.items()):
+        summary["operations"][operation] = {
+            "count": len(result["latencies"]), "errors": result["errors"],
+            "p50": percentile(result["latencies"], 0.5), "p95": percentile(result["latencies"], 0.95),
+            "p99": percentile(result["latencies"], 0.99),
+            "first_chunk_p50": percentile(result["first_chunk"], 0.5) if result["first_chunk"] else None,
+        }
+    return summary
+
+def print_summary(summary):
+    db = summary["db"]
+    print(f"\n{summary['workers']} ishchi: {summary['throughput']:.1f} so'rov/s, {summary['completed']} bajarildi, "
+          f"{summary['errors']} xato | p50 {summary['p50'] * 1000:.0f} ms  p95 {summary['p95'] * 1000:.0f} ms  "
+          f"p99 {summary['p99'] * 1000:.0f} ms")
+    if summary["login_errors"]:
+        print(f"  Kira olmagan virtual foydalanuvchilar: {summary['login_errors']}")
+    print(f"  DB: {db['queries']:.0f} so'rov, jami {db['seconds']:.2f} s, >{SLOW_QUERY_SECONDS * 1000:.0f} ms "
+          f"(blokirovka kutish) {db['slow']:.0f}, 'database is locked' {db['lock_errors']:.0f}")
+    for operation, stats in summary["operations"].items():
+        first_chunk = f"  birinchi bo'lak p50 {stats['first_chunk_p50'] * 1000:.0f} ms" if stats["first_chunk_p50"] else ""
+        print(f"  {operation:<8} {stats['count']:6d} ta  {stats['errors']:4d} xato  p50 {stats['p50'] * 1000:7.0f} ms  "
+              f"p95 {stats['p95'] * 1000:7.0f} ms  p99 {stats['p99'] * 1000:7.0f} ms{first_chunk}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Soxta Anthropic serveri bilan gunicorn ishchilari bo'yicha yuklama testi")
+    parser.add_argument("--workers", default="1,2,4", help="Vergul bilan ajratilgan gunicorn ishchilari soni")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--subjects", type=int, default=5, help="Har bir sinf uchun fanlar soni")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--first-token-ms", type=int, default=300)
+    parser.add_argument("--token-ms", type=int, default=15)
+    parser.add_argument("--tokens", type=int, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Natijalarni regressiyalarni solishtirish uchun JSON faylga yozish")
+    args = parser.parse_args()
+
+    fake = start_fake_anthropic(0, args.first_token_ms, args.token_ms, args.tokens)
+    anthropic_url = f"http://127.0.0.1:{fake.server_address[1]}"
+    print(f"Aralashma {args.mix}, {args.concurrency} parallel foydalanuvchi, {args.duration:.0f} s, "
+          f"model: {args.first_token_ms} ms + {args.tokens} x {args.token_ms} ms")
+
+    summaries = []
+    for workers in [int(value) for value in args.workers.split(",")]:
+        server = Server(workers, anthropic_url)
+        try:
+            server.start()
+            emails = server.seed(args.users, args.subjects)
+            # Seed va kirish (bcrypt, ommaviy yozuvlar) DB ko'rsatkichlariga kirmaydi: hisoblagichlar oyna boshida olinadi
+            results, elapsed, login_errors, db_before = run_load(server.url, emails, args.mix, args.concurrency, args.duration,
+                                                                 args.seed, snapshot=server.scrape_db_metrics)
+            summary = summarize(workers, results, elapsed, login_errors, metrics_delta(server.scrape_db_metrics(), db_before))
+        finally:
+            server.stop()
+        print_summary(summary)
+        summaries.append(summary)
+
+    fake.shutdown()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+from datetime import datetime
+
+# API modullari nisbiy import qilinadi (main.py kabi)
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+sys.path.insert(0, API_DIR)
+os.chdir(tempfile.mkdtemp(prefix="iqroai-bench-"))
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.testclient import TestClient
+from typing import List
+
+from schemas import MessageResponse
+from prompts import serialize_context
+import json
+
+def make_messages(count):
+    text = "Kvadrat tenglamani diskriminant orqali yechamiz: D = b² - 4ac. Квадратное уравнение. " * 4
+    now = datetime.utcnow()
+    return [MessageResponse(id=i, chat_id=1, role="assistant" if i % 2 else "user", content=text, timestamp=now)
+            for i in range(count)]
+
+def build_app(response_class, messages):
+    app = FastAPI(default_response_class=response_class)
+
+    @app.get("/messages", response_model=List[MessageResponse])
+    async def get_messages():
+        return messages
+
+    return app
+
+def measure(client, repeat):
+    client.get("/messages")
+    started = time.perf_counter()
+    for _ in range(repeat):
+        response = client.get("/messages")
+    elapsed = (time.perf_counter() - started) / repeat
+    return elapsed, len(response.content)
+
+def main():
+    parser = argparse.ArgumentParser(description="Katta xabarlar ro'yxati uchun JSON seriyalash benchmarki")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    print(f"{args.messages} ta xabar, {args.repeat} marta takrorlash")
+    for name, response_class in [("JSONResponse", JSONResponse), ("ORJSONResponse", ORJSONResponse)]:
+        with TestClient(build_app(response_class, messages)) as client:
+            elapsed, size = measure(client, args.repeat)
+        print(f"  {name:<16} {elapsed * 1000:8.2f} ms/so'rov  {size} bayt")
+
+    context = {"student_info": {"name": "Ali Valiyev", "age": 15, "grade": 10, "interests": "matematika"},
+               "subjects": [{"name": f"Fan {i}", "description": "Tavsif " * 20, "book_text": "Matn " * 200} for i in range(10)],
+               "progress": {i: 50.0 + i for i in range(10)}}
+    pretty = json.dumps(context, indent=2)
+    compact = serialize_context(context)
+    print(f"Prompt konteksti: indent=2 {len(pretty)} belgi, ixcham {len(compact)} belgi "
+          f"({100 * (1 - len(compact) / len(pretty)):.1f}% kam)")
+
+if __name__ == "__main__":
+    main()
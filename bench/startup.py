@@ -0,0 +1,75 @@
+import os
+import time
+import argparse
+
+from loadtest import Server
+
+# Solishtiriladigan ishga tushirish sozlamalari
+CONFIGS = {
+    "preload": {"GUNICORN_PRELOAD": "1", "ADMIN_ENABLED": "1"},
+    "preload-no-admin": {"GUNICORN_PRELOAD": "1", "ADMIN_ENABLED": "0"},
+    "no-preload": {"GUNICORN_PRELOAD": "0", "ADMIN_ENABLED": "1"},
+}
+READY_LINE = b"Application startup complete"
+
+def worker_pids(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+def memory_kb(pid):
+    # Pss umumiy (copy-on-write) sahifalarni jarayonlar orasida bo'lib hisoblaydi, shuning uchun preload ta'sirini ko'rsatadi
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                values[name] = int(rest.split()[0])
+    return {"rss": values["Rss"], "pss": values["Pss"], "private": values["Private_Clean"] + values["Private_Dirty"]}
+
+def measure(name, workers, timeout):
+    server = Server(workers, "http://127.0.0.1:9", env=CONFIGS[name])
+    server.migrate()
+    started = time.perf_counter()
+    server.launch()
+    log_path = os.path.join(server.directory, "gunicorn.log")
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if server.process.poll() is not None:
+                raise RuntimeError(f"gunicorn to'xtadi, jurnal: {log_path}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{workers} ishchi {timeout} s ichida tayyor bo'lmadi, jurnal: {log_path}")
+            with open(log_path, "rb") as f:
+                if f.read().count(READY_LINE) >= workers:
+                    break
+            time.sleep(0.02)
+        ready = time.perf_counter() - started
+        # Ishchilar bir so'rovni bajargandan keyingi holat o'lchanadi
+        for _ in range(workers * 2):
+            server.scrape_db_metrics()
+        memory = [memory_kb(pid) for pid in worker_pids(server.process.pid)]
+        master = memory_kb(server.process.pid)
+    finally:
+        server.stop()
+    return ready, master, memory
+
+def main():
+    parser = argparse.ArgumentParser(description="gunicorn ishchilarining tayyor bo'lish vaqti va xotirasi")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--configs", default=",".join(CONFIGS), help="Vergul bilan ajratilgan sozlamalar")
+    args = parser.parse_args()
+
+    print(f"{args.workers} ishchi, {args.repeat} marta takrorlash (xotira MB, ishchilar bo'yicha o'rtacha)")
+    for name in args.configs.split(","):
+        runs = [measure(name, args.workers, args.timeout) for _ in range(args.repeat)]
+        ready = sorted(run[0] for run in runs)[len(runs) // 2]
+        workers = [worker for run in runs for worker in run[2]]
+        average = {key: sum(worker[key] for worker in workers) / len(workers) / 1024 for key in ("rss", "pss", "private")}
+        master_rss = sum(run[1]["rss"] for run in runs) / len(runs) / 1024
+        print(f"  {name:<18} tayyor {ready:6.2f} s  RSS {average['rss']:6.1f}  PSS {average['pss']:6.1f}  "
+              f"xususiy {average['private']:6.1f}  master RSS {master_rss:6.1f}")
+
+if __name__ == "__main__":
+    main()